@@ -7,6 +7,7 @@ from typing import Union, Optional
 
 from ..train import Config
 from ..train import ReplayBuffer
+from ..train.profiler import NULL_PROFILER
 
 TEN = th.Tensor
 
@@ -42,12 +43,14 @@ class AgentBase:
         self.if_off_policy = args.if_off_policy  # whether off-policy or on-policy of DRL algorithm
         self.clip_grad_norm = args.clip_grad_norm  # clip the gradient after normalization
         self.soft_update_tau = args.soft_update_tau  # the tau of soft target update `net = (1-tau)*net + net1`
+        self.if_flat_soft_update = getattr(args, 'if_flat_soft_update', False)  # soft update in flat param buffers
         self.state_value_tau = args.state_value_tau  # the tau of normalize for value and state
         self.buffer_init_size = args.buffer_init_size  # train after samples over buffer_init_size for off-policy
 
         self.explore_noise_std = getattr(args, 'explore_noise_std', 0.05)  # standard deviation of exploration noise
         self.last_state: Optional[TEN] = None  # last state of the trajectory. shape == (num_envs, state_dim)
         self.device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+        self.profiler = NULL_PROFILER  # time the phases of exploring and updating. It is set by the training process
 
         '''network'''
         self.act = None
@@ -99,18 +102,20 @@ class AgentBase:
 
         state = self.last_state
         for t in range(horizon_len):
-            action = self.explore_action(state)[0]
+            with self.profiler.tick('actor'):
+                action = self.explore_action(state)[0]
             # if_discrete == False  action.shape (1, action_dim) -> (action_dim, )
             # if_discrete == True   action.shape (1, ) -> ()
 
             states[t] = state
             actions[t] = action
 
-            ary_action = action.detach().cpu().numpy()
-            ary_state, reward, terminal, truncate, _ = env.step(ary_action)
-            if terminal or truncate:
-                ary_state, info_dict = env.reset()
-            state = th.as_tensor(ary_state, dtype=th.float32, device=self.device).unsqueeze(0)
+            with self.profiler.tick('env_step'):
+                ary_action = action.detach().cpu().numpy()
+                ary_state, reward, terminal, truncate, _ = env.step(ary_action)
+                if terminal or truncate:
+                    ary_state, info_dict = env.reset()
+                state = th.as_tensor(ary_state, dtype=th.float32, device=self.device).unsqueeze(0)
 
             # CRITICAL FIX: Convert reward to Python float to prevent numpy.float32 → torch.FloatTensor error
             rewards[t] = float(reward)
@@ -151,17 +156,18 @@ class AgentBase:
 
         state = self.last_state  # last_state.shape == (num_envs, state_dim)
         for t in range(horizon_len):
-            action = self.explore_action(state)
+            with self.profiler.tick('actor'):
+                action = self.explore_action(state)
             # if_discrete == False  action.shape (num_envs, action_dim)
             # if_discrete == True   action.shape (num_envs, )
 
             states[t] = state  # state.shape == (num_envs, state_dim)
             actions[t] = action
 
-            state, reward, terminal, truncate, _ = env.step(action)
+            with self.profiler.tick('env_step'):
+                state, reward, terminal, truncate, _ = env.step(action)
 
-            # CRITICAL FIX: Convert reward to Python float to prevent numpy.float32 → torch.FloatTensor error
-            rewards[t] = float(reward)
+            rewards[t] = reward  # reward.shape == (num_envs, ) is a tensor in a vectorized env
             terminals[t] = terminal
             truncates[t] = truncate
 
@@ -177,6 +183,8 @@ class AgentBase:
 
         if self.lambda_fit_cum_r != 0:
             buffer.update_cum_rewards(get_cumulative_rewards=self.get_cumulative_rewards)
+        if self.if_flat_soft_update:
+            self.flatten_target_parameters()
 
         th.set_grad_enabled(True)
         update_times = int(buffer.cur_size * self.repeat_times / self.batch_size)
@@ -226,17 +234,12 @@ class AgentBase:
         return obj_critic.item(), obj_actor.item()
 
     def get_cumulative_rewards(self, rewards: TEN, undones: TEN) -> TEN:
-        cum_rewards = th.empty_like(rewards)
-
         masks = undones * self.gamma
-        horizon_len = rewards.shape[0]
 
         last_state = self.last_state
         next_action = self.act_target(last_state)
         next_value = self.cri_target(last_state, next_action).detach()
-        for t in range(horizon_len - 1, -1, -1):
-            cum_rewards[t] = next_value = rewards[t] + masks[t] * next_value
-        return cum_rewards
+        return get_reverse_scan(xs=rewards, masks=masks, last_y=next_value)  # cum_rewards
 
     def optimizer_backward(self, optimizer: th.optim, objective: TEN):
         """minimize the optimization objective via update the network parameters
@@ -244,10 +247,11 @@ class AgentBase:
         optimizer: `optimizer = th.optim.SGD(net.parameters(), learning_rate)`
         objective: `objective = net(...)` the optimization objective, sometimes is a loss function.
         """
-        optimizer.zero_grad()
-        objective.backward()
-        clip_grad_norm_(parameters=optimizer.param_groups[0]["params"], max_norm=self.clip_grad_norm)
-        optimizer.step()
+        with self.profiler.tick('optimizer'):
+            optimizer.zero_grad()
+            objective.backward()
+            clip_grad_norm_(parameters=optimizer.param_groups[0]["params"], max_norm=self.clip_grad_norm)
+            optimizer.step()
 
     def optimizer_backward_amp(self, optimizer: th.optim, objective: TEN):  # automatic mixed precision
         """minimize the optimization objective via update the network parameters
@@ -275,9 +279,26 @@ class AgentBase:
         target_net: update target network via current network to make training more stable.
         current_net: current network update via an optimizer
         tau: tau of soft target update: `target_net = target_net * (1-tau) + current_net * tau`
+
+        It is a single in-place `lerp_` when both networks keep their parameters in flat buffers,
+        see `flatten_parameters()`. Otherwise, it is a `_foreach_lerp_` over the parameter lists.
         """
-        for tar, cur in zip(target_net.parameters(), current_net.parameters()):
-            tar.data.copy_(cur.data * tau + tar.data * (1.0 - tau))
+        tar_flat = get_flat_parameters(target_net)
+        cur_flat = get_flat_parameters(current_net)
+        if (tar_flat is not None) and (cur_flat is not None) and (tar_flat.shape == cur_flat.shape):
+            tar_flat.lerp_(cur_flat, tau)
+        else:
+            th._foreach_lerp_([tar.data for tar in target_net.parameters()],
+                              [cur.data for cur in current_net.parameters()], tau)
+
+    def flatten_target_parameters(self):
+        """keep the parameters of each (current, target) network pair in flat buffers for `soft_update()`"""
+        for current_net, target_net in ((self.act, self.act_target), (self.cri, self.cri_target)):
+            if (target_net is None) or (target_net is current_net):
+                continue
+            for net in (current_net, target_net):
+                if get_flat_parameters(net) is None:
+                    flatten_parameters(net)
 
     def save_or_load_agent(self, cwd: str, if_save: bool):
         """save or load training files for Agent
@@ -299,6 +320,42 @@ class AgentBase:
                 setattr(self, attr_name, th.load(file_path, map_location=self.device))
 
 
+def flatten_parameters(net: nn.Module) -> Optional[TEN]:
+    """move the parameters of `net` into a flat buffer `net.flat_params`, and the parameters become its views.
+
+    The parameter objects are kept, so the optimizers built on them still work.
+    return None if the parameters have different dtypes or devices
+    """
+    params = list(net.parameters())
+    if len({(param.dtype, param.device) for param in params}) != 1:
+        return None
+
+    flat_params = th.cat([param.data.reshape(-1) for param in params])
+    offset = 0
+    for param in params:
+        param.data = flat_params[offset:offset + param.numel()].view_as(param)
+        offset += param.numel()
+    net.flat_params = flat_params
+    return flat_params
+
+
+def get_flat_parameters(net: nn.Module) -> Optional[TEN]:
+    """return `net.flat_params` if the parameters of `net` are still its views, else return None
+
+    The views are broken when the parameters are replaced, such as `net.to(device)` and `load_state_dict(assign=True)`.
+    """
+    flat_params = getattr(net, 'flat_params', None)
+    if flat_params is None:
+        return None
+
+    offset = 0
+    for param in net.parameters():
+        if param.data_ptr() != flat_params.data_ptr() + offset * flat_params.element_size():
+            return None
+        offset += param.numel()
+    return flat_params if offset == flat_params.numel() else None
+
+
 def get_optim_param(optimizer: th.optim) -> list:  # backup
     params_list = []
     for params_dict in optimizer.state_dict()["state"].values():
@@ -306,6 +363,45 @@ def get_optim_param(optimizer: th.optim) -> list:  # backup
     return params_list
 
 
+def get_reverse_scan(xs: TEN, masks: TEN, last_y: TEN) -> TEN:
+    """the discounted reverse scan `ys[t] = xs[t] + masks[t] * ys[t + 1]`, and `ys[horizon_len] = last_y`
+
+    It gets the same result as the loop `for t in range(horizon_len - 1, -1, -1)` with far fewer kernel launches.
+    The horizon is split into blocks of `block_len ~= sqrt(horizon_len)` steps. A scan inside all blocks in parallel
+    takes `log2(block_len)` rounds, and each round composes the affine map of step `t` with the map of `t + step`
+    (Hillis-Steele scan). Then a short reverse loop over the blocks carries `ys` from each block to the previous one.
+
+    xs.shape == masks.shape == (horizon_len, num_envs)
+    last_y.shape == (num_envs, )  # the bootstrapped value after the last step
+    """
+    horizon_len = xs.shape[0]
+    block_len = 2 ** int(np.ceil(np.log2(horizon_len) / 2))
+    num_blocks = int(np.ceil(horizon_len / block_len))
+
+    '''pad the tail with `xs=0, masks=1`, which passes `last_y` through unchanged'''
+    pad_len = num_blocks * block_len - horizon_len
+    ys = th.cat((xs, xs.new_zeros((pad_len, *xs.shape[1:]))), dim=0)
+    ms = th.cat((masks.to(xs.dtype), xs.new_ones((pad_len, *xs.shape[1:]))), dim=0)
+    ys = ys.view(num_blocks, block_len, *xs.shape[1:])
+    ms = ms.view(num_blocks, block_len, *xs.shape[1:])
+
+    '''scan inside the blocks: ys[:, i] = sum(xs[:, j] * prod(masks[:, i:j])), ms[:, i] = prod(masks[:, i:])'''
+    step = 1
+    while step < block_len:
+        ys[:, :-step] = th.addcmul(ys[:, :-step], ms[:, :-step], ys[:, step:])
+        ms[:, :-step] = ms[:, :-step] * ms[:, step:]
+        step *= 2
+
+    '''carry the `ys` of the first step of each block to the previous block'''
+    next_ys = th.empty_like(ys[:, 0])  # next_ys[i] is the `ys` after the last step of block i
+    next_y = last_y.to(xs.dtype)
+    for i in range(num_blocks - 1, -1, -1):
+        next_ys[i] = next_y
+        next_y = th.addcmul(ys[i, 0], ms[i, 0], next_y)
+    ys = th.addcmul(ys, ms, next_ys.unsqueeze(1))
+    return ys.view(num_blocks * block_len, *xs.shape[1:])[:horizon_len]
+
+
 '''network'''
 
 
@@ -448,3 +544,68 @@ class ConvNet(nn.Module):  # pixel-level state encoder
         print(image.shape)
         output = net(image)
         print(output.shape)
+
+
+def check_reverse_scan_speed(num_envs: int = 64, gpu_id: int = 0):
+    import time
+    device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+    gamma = 0.99
+
+    print(f"| check_reverse_scan_speed() num_envs {num_envs}  ({device})"
+          f"\n| horizon_len    loop(ms)    scan(ms)   max_abs_err", flush=True)
+    for horizon_len in (256, 1024, 2048, 4096, 8192):
+        xs = th.randn((horizon_len, num_envs), dtype=th.float32, device=device)
+        masks = th.rand((horizon_len, num_envs), device=device).gt(0.01) * gamma
+        last_y = th.randn(num_envs, dtype=th.float32, device=device)
+
+        '''the reverse loop'''
+        th.cuda.synchronize(device) if device.type == 'cuda' else None
+        timer = time.time()
+        ys0 = th.empty_like(xs)
+        next_y = last_y
+        for t in range(horizon_len - 1, -1, -1):
+            ys0[t] = next_y = xs[t] + masks[t] * next_y
+        th.cuda.synchronize(device) if device.type == 'cuda' else None
+        used_time0 = time.time() - timer
+
+        '''the reverse scan'''
+        timer = time.time()
+        ys1 = get_reverse_scan(xs=xs, masks=masks, last_y=last_y)
+        th.cuda.synchronize(device) if device.type == 'cuda' else None
+        used_time1 = time.time() - timer
+
+        max_abs_err = (ys0 - ys1).abs().max().item()
+        print(f"| {horizon_len:11} {used_time0 * 1e3:11.2f} {used_time1 * 1e3:11.2f} {max_abs_err:13.2e}", flush=True)
+
+
+def check_soft_update_speed(net_dims=(256, 256), num_ensembles: int = 8, gpu_id: int = 0, num_repeats: int = 256):
+    """microbenchmark: soft update of a critic ensemble, the per-parameter loop vs. `_foreach_lerp_` vs. flat buffers"""
+    import time
+    from copy import deepcopy
+    from .AgentSAC import CriticEnsemble
+    device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+    current_net = CriticEnsemble(list(net_dims), state_dim=32, action_dim=8, num_ensembles=num_ensembles).to(device)
+    target_net = deepcopy(current_net)
+    tau = 5e-3
+
+    def soft_update_by_loop(_target_net, _current_net, _tau):  # the previous implementation
+        for tar, cur in zip(_target_net.parameters(), _current_net.parameters()):
+            tar.data.copy_(cur.data * _tau + tar.data * (1.0 - _tau))
+
+    print(f"| check_soft_update_speed() num_params {sum(p.numel() for p in current_net.parameters())}  ({device})")
+    for name, soft_update in (("loop", soft_update_by_loop), ("foreach_lerp", AgentBase.soft_update),
+                              ("flat_lerp", AgentBase.soft_update)):
+        if name == "flat_lerp":
+            flatten_parameters(current_net)
+            flatten_parameters(target_net)
+        th.cuda.synchronize(device) if device.type == 'cuda' else None
+        timer = time.time()
+        for _ in range(num_repeats):
+            soft_update(target_net, current_net, tau)
+        th.cuda.synchronize(device) if device.type == 'cuda' else None
+        print(f"|   {name:12} {(time.time() - timer) / num_repeats * 1e6:9.1f} us per soft update", flush=True)
+
+
+if __name__ == '__main__':
+    check_reverse_scan_speed()
+    check_soft_update_speed()
@@ -4,7 +4,7 @@ from copy import deepcopy
 from typing import Tuple, List
 
 from .AgentBase import AgentBase
-from .AgentBase import build_mlp, layer_init_with_orthogonal
+from .AgentBase import build_mlp, layer_init_with_orthogonal, get_reverse_scan
 from ..train import Config
 from ..train import ReplayBuffer
 
@@ -63,16 +63,11 @@ class AgentDQN(AgentBase):
         return obj_critic.item(), obj_actor.item()
 
     def get_cumulative_rewards(self, rewards: TEN, undones: TEN) -> TEN:
-        returns = th.empty_like(rewards)
-
         masks = undones * self.gamma
-        horizon_len = rewards.shape[0]
 
         last_state = self.last_state
         next_value = self.act_target(last_state).argmax(dim=1).detach()  # actor is Q Network in DQN style
-        for t in range(horizon_len - 1, -1, -1):
-            returns[t] = next_value = rewards[t] + masks[t] * next_value
-        return returns
+        return get_reverse_scan(xs=rewards, masks=masks, last_y=next_value)  # returns
 
 
 class AgentDoubleDQN(AgentDQN):
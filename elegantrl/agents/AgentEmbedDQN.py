@@ -4,7 +4,7 @@ from copy import deepcopy
 from typing import Tuple, List
 
 from .AgentBase import AgentBase
-from .AgentBase import build_mlp, layer_init_with_orthogonal
+from .AgentBase import build_mlp, layer_init_with_orthogonal, get_reverse_scan
 from ..train import Config
 from ..train import ReplayBuffer
 
@@ -71,16 +71,11 @@ class AgentEmbedDQN(AgentBase):
         return obj_critic.item(), obj_actor.item()
 
     def get_cumulative_rewards(self, rewards: TEN, undones: TEN) -> TEN:
-        returns = th.empty_like(rewards)
-
         masks = undones * self.gamma
-        horizon_len = rewards.shape[0]
 
         last_state = self.last_state
         next_value = self.act_target.get_q_value(last_state).max(dim=1)[0].detach()  # next q_values
-        for t in range(horizon_len - 1, -1, -1):
-            returns[t] = next_value = rewards[t] + masks[t] * next_value
-        return returns
+        return get_reverse_scan(xs=rewards, masks=masks, last_y=next_value)  # returns
 
 
 class AgentEnsembleDQN(AgentEmbedDQN):
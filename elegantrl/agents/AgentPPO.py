@@ -3,7 +3,7 @@ import torch as th
 from torch import nn
 
 from .AgentBase import AgentBase
-from .AgentBase import build_mlp, layer_init_with_orthogonal
+from .AgentBase import build_mlp, layer_init_with_orthogonal, get_reverse_scan
 from ..train import Config
 
 TEN = th.Tensor
@@ -57,17 +57,19 @@ class AgentPPO(AgentBase):
         state = self.last_state  # shape == (1, state_dim) for a single env.
         convert = self.act.convert_action_for_env
         for t in range(horizon_len):
-            action, logprob = [t[0] for t in self.explore_action(state)]
+            with self.profiler.tick('actor'):
+                action, logprob = [t[0] for t in self.explore_action(state)]
 
             states[t] = state
             actions[t] = action
             logprobs[t] = logprob
 
-            ary_action = convert(action).detach().cpu().numpy()
-            ary_state, reward, terminal, truncate, _ = env.step(ary_action)
-            if terminal or truncate:
-                ary_state, info_dict = env.reset()
-            state = th.as_tensor(ary_state, dtype=th.float32, device=self.device).unsqueeze(0)
+            with self.profiler.tick('env_step'):
+                ary_action = convert(action).detach().cpu().numpy()
+                ary_state, reward, terminal, truncate, _ = env.step(ary_action)
+                if terminal or truncate:
+                    ary_state, info_dict = env.reset()
+                state = th.as_tensor(ary_state, dtype=th.float32, device=self.device).unsqueeze(0)
 
             rewards[t] = reward
             terminals[t] = terminal
@@ -110,13 +112,15 @@ class AgentPPO(AgentBase):
 
         convert = self.act.convert_action_for_env
         for t in range(horizon_len):
-            action, logprob = self.explore_action(state)
+            with self.profiler.tick('actor'):
+                action, logprob = self.explore_action(state)
 
             states[t] = state
             actions[t] = action
             logprobs[t] = logprob
 
-            state, reward, terminal, truncate, _ = env.step(convert(action))  # next_state
+            with self.profiler.tick('env_step'):
+                state, reward, terminal, truncate, _ = env.step(convert(action))  # next_state
 
             rewards[t] = reward
             terminals[t] = terminal
@@ -173,18 +177,20 @@ class AgentPPO(AgentBase):
     def update_objectives(self, buffer: tuple[TEN, ...], update_t: int) -> tuple[float, float, float]:
         states, actions, unmasks, logprobs, advantages, reward_sums = buffer
 
-        sample_len = states.shape[0]
-        num_seqs = states.shape[1]
-        ids = th.randint(sample_len * num_seqs, size=(self.batch_size,), requires_grad=False, device=self.device)
-        ids0 = th.fmod(ids, sample_len)  # ids % sample_len
-        ids1 = th.div(ids, sample_len, rounding_mode='floor')  # ids // sample_len
-
-        state = states[ids0, ids1]
-        action = actions[ids0, ids1]
-        unmask = unmasks[ids0, ids1]
-        logprob = logprobs[ids0, ids1]
-        advantage = advantages[ids0, ids1]
-        reward_sum = reward_sums[ids0, ids1]
+        with self.profiler.tick('sample'):
+            sample_len = states.shape[0]
+            num_seqs = states.shape[1]
+            ids = th.randint(sample_len * num_seqs, size=(self.batch_size,), requires_grad=False, device=self.device)
+            ids0 = th.fmod(ids, sample_len)  # ids % sample_len
+            ids1 = th.div(ids, sample_len, rounding_mode='floor')  # ids // sample_len
+
+            state = states[ids0, ids1]
+            action = actions[ids0, ids1]
+            unmask = unmasks[ids0, ids1]
+            logprob = logprobs[ids0, ids1]
+            advantage = advantages[ids0, ids1]
+            reward_sum = reward_sums[ids0, ids1]
+        self.profiler.count('samples', self.batch_size)
 
         value = self.cri(state).squeeze(1)  # critic network predicts the reward_sum (Q value) of state
         obj_critic = (self.criterion(value, reward_sum) * unmask).mean()
@@ -205,8 +211,6 @@ class AgentPPO(AgentBase):
         return obj_critic.item(), obj_surrogate.item(), obj_entropy.item()
 
     def get_advantages(self, states: TEN, rewards: TEN, undones: TEN, unmasks: TEN, values: TEN) -> TEN:
-        advantages = th.empty_like(values)  # advantage value
-
         # update undones rewards when truncated
         truncated = th.logical_not(unmasks)
         if th.any(truncated):
@@ -214,21 +218,19 @@ class AgentPPO(AgentBase):
             undones[truncated] = False
 
         masks = undones * self.gamma
-        horizon_len = rewards.shape[0]
 
         next_state = self.last_state.clone()
         next_value = self.cri(next_state).detach().squeeze(-1)
 
-        advantage = th.zeros_like(next_value)  # last advantage value by GAE (Generalized Advantage Estimate)
+        '''the advantages of both branches follow `advantages[t] = deltas[t] + masks[t] * lambda * advantages[t+1]`'''
         if self.if_use_v_trace:  # get advantage value in reverse time series (V-trace)
-            for t in range(horizon_len - 1, -1, -1):
-                next_value = rewards[t] + masks[t] * next_value
-                advantages[t] = advantage = next_value - values[t] + masks[t] * self.lambda_gae_adv * advantage
-                next_value = values[t]
-        else:  # get advantage value using the estimated value of critic network
-            for t in range(horizon_len - 1, -1, -1):
-                advantages[t] = rewards[t] - values[t] + masks[t] * advantage
-                advantage = values[t] + self.lambda_gae_adv * advantages[t]
+            next_values = th.cat((values[1:], next_value.unsqueeze(0)), dim=0)
+        else:  # get advantage value using the estimated value of critic network, without bootstrapping
+            next_values = th.cat((values[1:], th.zeros_like(next_value).unsqueeze(0)), dim=0)
+        deltas = rewards + masks * next_values - values  # TD errors
+
+        last_advantage = th.zeros_like(next_value)  # last advantage value by GAE (Generalized Advantage Estimate)
+        advantages = get_reverse_scan(xs=deltas, masks=masks * self.lambda_gae_adv, last_y=last_advantage)
         return advantages
 
     def update_avg_std_for_normalization(self, states: TEN):
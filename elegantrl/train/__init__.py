@@ -6,4 +6,5 @@ from .run import train_agent_multiprocessing_multi_gpu
 from .config import build_env, get_gym_env_args
 from .config import Config
 from .evaluator import Evaluator
-from .replay_buffer import ReplayBuffer
+from .replay_buffer import ReplayBuffer, ReplayBufferMemmap
+from .profiler import Profiler
@@ -49,8 +49,13 @@ class Config:
             self.buffer_size = int(1e6)  # ReplayBuffer size. First in first out for off-policy.
             self.repeat_times = 1.0  # repeatedly update network using ReplayBuffer to keep critic's loss small
             self.if_use_per = False  # use PER (Prioritized Experience Replay) for sparse reward
+            self.buffer_memmap_dir = None  # store ReplayBuffer in numpy.memmap files in this dir (True means cwd)
+            self.buffer_state_dtype = None  # store states in 'float16', 'bfloat16' or 'uint8' (None means float32)
+            self.if_flat_soft_update = False  # keep the params of current and target nets in flat buffers
             self.lambda_fit_cum_r = 0.0  # critic fits the mean of a batch cumulative rewards
             self.buffer_init_size = int(self.batch_size * 8)  # train after samples over buffer_init_size for off-policy
+            self.if_async = False  # Workers keep exploring with a stale actor while Learner is updating networks
+            self.max_policy_lag = 2  # Learner waits for the rollouts whose actor is older than `max_policy_lag` updates
         else:  # on-policy
             self.batch_size = int(128)  # num of transitions sampled from replay buffer.
             self.horizon_len = int(2048)  # collect horizon_len step while exploring, then update network
@@ -58,6 +63,8 @@ class Config:
             self.repeat_times = 8.0  # repeatedly update network using ReplayBuffer to keep critic's loss small
             self.if_use_vtrace = True  # use V-trace + GAE (Generalized Advantage Estimation) for sparse reward
             self.buffer_init_size = None  # train after samples over buffer_init_size for off-policy
+            self.if_async = False  # on-policy algorithm should explore using the latest actor
+            self.max_policy_lag = 0
 
         '''Arguments for device'''
         self.gpu_id = int(0)  # `int` means the ID of single GPU, -1 means CPU
@@ -77,10 +84,13 @@ class Config:
 
         self.save_gap = int(8)  # save actor f"{cwd}/actor_*.pth" for learning curve.
         self.eval_times = int(3)  # number of times that get the average episodic cumulative return
+        self.eval_env_pool = ''  # '' one episode at a time, or side by side in 'copy' (env copies) or 'proc'
         self.eval_per_step = int(2e4)  # evaluate the agent per training steps
         self.eval_env_class = None  # eval_env = eval_env_class(*eval_env_args)
         self.eval_env_args = None  # eval_env = eval_env_class(*eval_env_args)
         self.eval_record_step = 0  # evaluator start recording after the exploration reaches this step.
+        self.if_profile = False  # time the phases of training, save steps/sec to `cwd/profile_*.jsonl` and TensorBoard
+        self.profile_gap = 30.0  # save a profile record per `profile_gap` seconds
 
     def init_before_training(self):
         if self.random_seed is None:
@@ -122,7 +132,9 @@ def build_env(env_class=None, env_args: dict = None, gpu_id: int = -1):
 
     if env_args.get('if_build_vec_env'):
         num_envs = env_args['num_envs']
-        env = VecEnv(env_class=env_class, env_args=env_args, num_envs=num_envs, gpu_id=gpu_id)
+        num_envs_per_proc = env_args.get('num_envs_per_proc', 0)
+        env = VecEnv(env_class=env_class, env_args=env_args, num_envs=num_envs, gpu_id=gpu_id,
+                     num_envs_per_proc=num_envs_per_proc)
     elif env_class.__module__ == 'gymnasium.envs.registration':
         env = env_class(id=env_args['env_name'])
     else:
@@ -210,45 +222,64 @@ def get_gym_env_args(env, if_print: bool) -> dict:
 
 
 class SubEnv(Process):
-    def __init__(self, sub_pipe0: Pipe, vec_pipe1: Pipe,
-                 env_class, env_args: dict, env_id: int = 0):
+    def __init__(self, sub_pipe0: Pipe, vec_pipe1: Pipe, env_class, env_args: dict,
+                 shared_tensors: Tuple[TEN, ...], env_id: int = 0, num_envs: int = 1):
+        """A subprocess hosts `num_envs` envs of VecEnv, from `env_id` to `env_id + num_envs - 1`.
+
+        `shared_tensors` are (states, actions, rewards, terminals, truncates) of all envs in shared memory.
+        The Pipes only send the commands and the acknowledgements instead of pickling the arrays:
+        sub_pipe0.recv() gets `True` to step the envs with the actions, or `False` to reset the envs.
+        vec_pipe1.send(env_id) after writing the results of the envs of this subprocess in shared memory.
+        """
         super().__init__()
         self.sub_pipe0 = sub_pipe0
         self.vec_pipe1 = vec_pipe1
 
         self.env_class = env_class
         self.env_args = env_args
+        self.shared_tensors = shared_tensors
         self.env_id = env_id
+        self.num_envs = num_envs
 
     def run(self):
         th.set_grad_enabled(False)
 
         '''build env'''
         if self.env_class.__module__ == 'gymnasium.envs.registration':  # is standard OpenAI Gym env
-            env = self.env_class(id=self.env_args['env_name'])
+            envs = [self.env_class(id=self.env_args['env_name']) for _ in range(self.num_envs)]
         else:
-            env = self.env_class(**kwargs_filter(self.env_class.__init__, self.env_args.copy()))
+            envs = [self.env_class(**kwargs_filter(self.env_class.__init__, self.env_args.copy()))
+                    for _ in range(self.num_envs)]
 
         '''set env random seed'''
         random_seed = self.env_id
         np.random.seed(random_seed)
         th.manual_seed(random_seed)
 
+        '''the numpy arrays share the memory with the shared tensors'''
+        states, actions, rewards, terminals, truncates = [t.numpy() for t in self.shared_tensors]
+        env_ids = range(self.env_id, self.env_id + self.num_envs)
+
         while True:
-            action = self.sub_pipe0.recv()
-            if action is None:
-                state, info_dict = env.reset()
-                self.vec_pipe1.send((self.env_id, state))
+            if_step = self.sub_pipe0.recv()
+            if if_step:
+                for env_id, env in zip(env_ids, envs):
+                    state, reward, terminal, truncate, info_dict = env.step(actions[env_id].copy())
+
+                    done = terminal or truncate
+                    states[env_id] = env.reset()[0] if done else state
+                    rewards[env_id] = reward
+                    terminals[env_id] = terminal
+                    truncates[env_id] = truncate
             else:
-                state, reward, terminal, truncate, info_dict = env.step(action)
-
-                done = terminal or truncate
-                state = env.reset()[0] if done else state
-                self.vec_pipe1.send((self.env_id, state, reward, terminal, truncate))
+                for env_id, env in zip(env_ids, envs):
+                    states[env_id] = env.reset()[0]
+            self.vec_pipe1.send(self.env_id)
 
 
 class VecEnv:
-    def __init__(self, env_class: object, env_args: dict, num_envs: int, gpu_id: int = -1):
+    def __init__(self, env_class: object, env_args: dict, num_envs: int, gpu_id: int = -1,
+                 num_envs_per_proc: int = 0):
         self.device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
         self.num_envs = num_envs  # the number of sub env in vectorized env.
 
@@ -259,20 +290,30 @@ class VecEnv:
         self.action_dim = env_args['action_dim']  # feature number of action
         self.if_discrete = env_args['if_discrete']  # discrete action or continuous action
 
-        '''speed up with multiprocessing: Process, Pipe'''
-        assert self.num_envs <= 64
-        self.res_list = [[] for _ in range(self.num_envs)]
-
-        sub_pipe0s, sub_pipe1s = list(zip(*[Pipe(duplex=False) for _ in range(self.num_envs)]))
+        '''speed up with multiprocessing: Process, Pipe and shared memory'''
+        self.states = th.zeros((num_envs, self.state_dim), dtype=th.float32).share_memory_()
+        self.actions = th.zeros(num_envs, dtype=th.int64).share_memory_() if self.if_discrete \
+            else th.zeros((num_envs, self.action_dim), dtype=th.float32).share_memory_()
+        self.rewards = th.zeros(num_envs, dtype=th.float32).share_memory_()
+        self.terminals = th.zeros(num_envs, dtype=th.bool).share_memory_()
+        self.truncates = th.zeros(num_envs, dtype=th.bool).share_memory_()
+        shared_tensors = (self.states, self.actions, self.rewards, self.terminals, self.truncates)
+
+        if num_envs_per_proc <= 0:  # host several envs in a subprocess when there are more envs than CPUs
+            num_envs_per_proc = int(np.ceil(num_envs / (os.cpu_count() or 1)))
+        env_ids = list(range(0, num_envs, num_envs_per_proc))
+        self.num_procs = len(env_ids)
+
+        sub_pipe0s, sub_pipe1s = list(zip(*[Pipe(duplex=False) for _ in range(self.num_procs)]))
         self.sub_pipe1s = sub_pipe1s
 
         vec_pipe0, vec_pipe1 = Pipe(duplex=False)  # recv, send
         self.vec_pipe0 = vec_pipe0
 
         self.sub_envs = [
-            SubEnv(sub_pipe0=sub_pipe0, vec_pipe1=vec_pipe1,
-                   env_class=env_class, env_args=env_args, env_id=env_id)
-            for env_id, sub_pipe0 in enumerate(sub_pipe0s)
+            SubEnv(sub_pipe0=sub_pipe0, vec_pipe1=vec_pipe1, env_class=env_class, env_args=env_args,
+                   shared_tensors=shared_tensors, env_id=env_id, num_envs=min(num_envs_per_proc, num_envs - env_id))
+            for env_id, sub_pipe0 in zip(env_ids, sub_pipe0s)
         ]
 
         [setattr(p, 'daemon', True) for p in self.sub_envs]  # set before process start to exit safely
@@ -282,33 +323,31 @@ class VecEnv:
         th.set_grad_enabled(False)
 
         for pipe in self.sub_pipe1s:
-            pipe.send(None)
-        states, = self.get_orderly_zip_list_return()
-        states = th.tensor(np.stack(states), dtype=th.float32, device=self.device)
+            pipe.send(False)
+        self.wait_sub_envs()
+        states = self.states.to(self.device, copy=True)
         info_dicts = dict()
         return states, info_dicts
 
     def step(self, action: TEN) -> Tuple[TEN, TEN, TEN, TEN, dict]:  # agent interacts in env
-        action = action.detach().cpu().numpy()
-        for pipe, a in zip(self.sub_pipe1s, action):
-            pipe.send(a)
-
-        states, rewards, terminal, truncate = self.get_orderly_zip_list_return()
-        states = th.tensor(np.stack(states), dtype=th.float32, device=self.device)
-        rewards = th.tensor(rewards, dtype=th.float32, device=self.device)
-        terminal = th.tensor(terminal, dtype=th.bool, device=self.device)
-        truncate = th.tensor(truncate, dtype=th.bool, device=self.device)
+        self.actions.copy_(action.detach().reshape(self.actions.shape))
+        for pipe in self.sub_pipe1s:
+            pipe.send(True)
+        self.wait_sub_envs()
+
+        states = self.states.to(self.device, copy=True)
+        rewards = self.rewards.to(self.device, copy=True)
+        terminal = self.terminals.to(self.device, copy=True)
+        truncate = self.truncates.to(self.device, copy=True)
         info_dicts = dict()
         return states, rewards, terminal, truncate, info_dicts
 
     def close(self):
         [process.terminate() for process in self.sub_envs]
 
-    def get_orderly_zip_list_return(self):
-        for _ in range(self.num_envs):
-            res = self.vec_pipe0.recv()
-            self.res_list[res[0]] = res[1:]
-        return list(zip(*self.res_list))
+    def wait_sub_envs(self):  # the barrier: wait until all subprocesses write their results in shared memory
+        for _ in range(self.num_procs):
+            self.vec_pipe0.recv()
 
 
 def check_vec_env():
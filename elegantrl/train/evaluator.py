@@ -4,7 +4,7 @@ import numpy as np
 import torch as th
 from typing import Tuple, List
 
-from .config import Config
+from .config import Config, VecEnv, build_env
 
 TEN = th.Tensor
 
@@ -42,10 +42,19 @@ class Evaluator:
               f"{'avgR':>8}{'stdR':>7}{'avgS':>7}{'stdS':>6} |"
               f"{'expR':>8}{'objC':>7}{'objA':>7}{'etc.':>7}", flush=True)
 
-        if getattr(env, 'num_envs', 1) == 1:  # get attribute
-            self.get_cumulative_rewards_and_step = self.get_cumulative_rewards_and_step_single_env
-        else:  # vectorized environment
+        self.eval_envs = None  # the envs which run `eval_times` episodes side by side
+        eval_env_pool = getattr(args, 'eval_env_pool', '')
+        eval_env_class = args.eval_env_class if args.eval_env_class else args.env_class
+        eval_env_args = args.eval_env_args if args.eval_env_args else args.env_args
+        if getattr(env, 'num_envs', 1) > 1:  # vectorized environment
             self.get_cumulative_rewards_and_step = self.get_cumulative_rewards_and_step_vectorized_env
+        elif eval_env_pool and (self.eval_times > 1) and (eval_env_class is not None):
+            self.eval_envs = build_eval_envs(env=env, env_class=eval_env_class, env_args=eval_env_args,
+                                             eval_times=self.eval_times, eval_env_pool=eval_env_pool,
+                                             gpu_id=args.gpu_id)
+            self.get_cumulative_rewards_and_step = self.get_cumulative_rewards_and_step_side_by_side
+        else:
+            self.get_cumulative_rewards_and_step = self.get_cumulative_rewards_and_step_single_env
 
         if if_tensorboard:
             from torch.utils.tensorboard import SummaryWriter
@@ -137,6 +146,17 @@ class Evaluator:
         rewards_steps_ten = th.tensor(rewards_steps_list, dtype=th.float32)
         return rewards_steps_ten  # rewards_steps_ten.shape[1] == 2
 
+    def get_cumulative_rewards_and_step_side_by_side(self, actor) -> TEN:
+        return get_rewards_and_steps_side_by_side(self.eval_envs, actor)  # rewards_steps_ten.shape[1] == 2
+
+    def close_eval_envs(self):
+        if isinstance(self.eval_envs, VecEnv):
+            self.eval_envs.close()
+        elif self.eval_envs is not None:
+            for env in self.eval_envs[1:]:  # `self.eval_envs[0]` is `self.env`
+                env.close() if hasattr(env, 'close') else None
+        self.eval_envs = None
+
     def get_cumulative_rewards_and_step_vectorized_env(self, actor) -> TEN:
         rewards_step_list = [get_cumulative_rewards_and_step_from_vec_env(self.env, actor)
                              for _ in range(max(1, self.eval_times // self.env.num_envs))]
@@ -197,6 +217,78 @@ def get_rewards_and_steps(env, actor, if_render: bool = False) -> Tuple[float, i
     return cumulative_returns, episode_steps + 1
 
 
+def build_eval_envs(env, env_class, env_args: dict, eval_times: int, eval_env_pool: str, gpu_id: int = -1):
+    """build the envs for `get_rewards_and_steps_side_by_side()`
+
+    eval_env_pool == 'copy': a list of `eval_times` single envs in this process, `env` is the first one.
+    eval_env_pool == 'proc': a VecEnv of `eval_times` sub envs in a small process pool.
+    """
+    if eval_env_pool == 'copy':
+        return [env, ] + [build_env(env_class, env_args.copy(), gpu_id) for _ in range(eval_times - 1)]
+    elif eval_env_pool == 'proc':
+        env_args = {**env_args, 'num_envs': eval_times, 'if_build_vec_env': True}
+        return build_env(env_class, env_args, gpu_id)
+    else:
+        raise ValueError(f"| build_eval_envs: eval_env_pool should be 'copy' or 'proc', but got {eval_env_pool}")
+
+
+def get_rewards_and_steps_side_by_side(envs, actor) -> TEN:
+    """run an episode in each env side by side, with one batched actor forward per step.
+
+    envs: a list of single envs, or a VecEnv whose sub envs are reset automatically after done.
+    The finished episodes are masked, and the loop stops when all episodes are finished.
+    return: rewards_steps_ten.shape == (num_envs, 2), the cumulative rewards and the steps of each episode
+    """
+    device = next(actor.parameters()).device
+    if_vec_env = isinstance(envs, VecEnv)
+    num_envs = envs.num_envs if if_vec_env else len(envs)
+    max_step = envs.max_step if if_vec_env else envs[0].max_step
+
+    cumulative_returns = th.zeros(num_envs, dtype=th.float32)
+    episode_steps = th.zeros(num_envs, dtype=th.long)
+    alive_ids = list(range(num_envs))  # the envs whose episodes are not finished
+    if if_vec_env:
+        states = envs.reset()[0]
+    else:
+        states = th.as_tensor(np.array([env.reset()[0] for env in envs]), dtype=th.float32)
+
+    for _ in range(max_step):
+        actions = actor(states.to(device))  # a batched actor forward for the alive envs
+        if if_vec_env:
+            states, rewards, terminals, truncates, _ = envs.step(actions)
+            if_alive = th.zeros(num_envs, dtype=th.bool)
+            if_alive[alive_ids] = True
+            cumulative_returns += rewards.cpu() * if_alive
+            episode_steps += if_alive
+            if_alive &= ~th.logical_or(terminals, truncates).cpu()
+            alive_ids = th.nonzero(if_alive).squeeze(1).tolist()
+        else:
+            actions = actions.detach().cpu().numpy()
+            next_states = []
+            next_alive_ids = []
+            for env_id, action in zip(alive_ids, actions):
+                state, reward, terminated, truncated, _ = envs[env_id].step(action)
+                cumulative_returns[env_id] += reward
+                episode_steps[env_id] += 1
+                if not (terminated or truncated):
+                    next_states.append(state)
+                    next_alive_ids.append(env_id)
+            alive_ids = next_alive_ids
+            states = th.as_tensor(np.array(next_states), dtype=th.float32) if alive_ids else None
+
+        if len(alive_ids) == 0:
+            break
+    else:
+        print("| get_rewards_and_steps_side_by_side: WARNING. max_step > 12345", flush=True)
+
+    if not if_vec_env:
+        for env_id, env in enumerate(envs):
+            env_unwrapped = getattr(env, 'unwrapped', env)
+            if hasattr(env_unwrapped, 'cumulative_returns'):
+                cumulative_returns[env_id] = float(env_unwrapped.cumulative_returns)
+    return th.stack((cumulative_returns, episode_steps.float()), dim=1)
+
+
 def get_cumulative_rewards_and_step_from_vec_env(env, actor) -> List[Tuple[float, int]]:
     device = env.device
     env_num = env.num_envs
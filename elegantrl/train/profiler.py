@@ -0,0 +1,118 @@
+import os
+import json
+import time
+from contextlib import nullcontext
+from typing import Dict
+
+NULL_CONTEXT = nullcontext()  # the shared context of a disabled tick
+
+
+class Profiler:
+    def __init__(self, cwd: str = '.', name: str = 'learner', if_enable: bool = False, dump_gap: float = 30.0):
+        """Time the phases of training and count the env steps and the sampled transitions in a process.
+
+        Usage:
+            with profiler.tick('env_step'):
+                state, reward, terminal, truncate, _ = env.step(action)
+            profiler.count('steps', num_envs)
+            profiler.dump(step=total_step)  # save a record per `dump_gap` seconds
+
+        The phases can be nested, such as 'sample' and 'optimizer' in 'update_net'.
+        A record of the last `dump_gap` seconds is appended to `{cwd}/profile_{name}.jsonl`, and is written
+        to TensorBoard `{cwd}/tensorboard/profile_{name}` when tensorboard is installed.
+        The time is measured on the host, so an asynchronous CUDA kernel is counted in the phase which waits for it.
+        When `if_enable=False`, `tick()` returns a shared nullcontext and `count()` returns at once, so a disabled
+        tick costs only its `with` statement (about 0.2 us), not zero. `NULL_PROFILER` is the shared disabled one.
+        """
+        self.if_enable = if_enable
+        self.cwd = cwd
+        self.name = name
+        self.dump_gap = dump_gap  # save a record per `dump_gap` seconds
+
+        self.used_times: Dict[str, float] = {}  # the used seconds of each phase in this record
+        self.call_nums: Dict[str, int] = {}  # the call numbers of each phase in this record
+        self.counts: Dict[str, int] = {'steps': 0, 'samples': 0}  # the env steps and sampled transitions in this record
+        self.timer_stack = []  # (phase, start time) of the nested phases
+        self.start_time = time.perf_counter()
+        self.record_time = self.start_time
+        self.tensorboard = None
+
+    def tick(self, phase: str):
+        if not self.if_enable:
+            return NULL_CONTEXT
+        self.timer_stack.append((phase, time.perf_counter()))
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        phase, timer = self.timer_stack.pop()
+        self.used_times[phase] = self.used_times.get(phase, 0.0) + time.perf_counter() - timer
+        self.call_nums[phase] = self.call_nums.get(phase, 0) + 1
+
+    def count(self, name: str, num: int):
+        if self.if_enable:
+            self.counts[name] = self.counts.get(name, 0) + num
+
+    def dump(self, step: int = None, if_force: bool = False) -> dict:
+        """save and return a record of the phases since the last record, return {} before `dump_gap` seconds"""
+        record_time = time.perf_counter()
+        used_time = record_time - self.record_time
+        if (not self.if_enable) or (used_time < self.dump_gap and not if_force) or (used_time <= 0):
+            return {}
+
+        record = {
+            'name': self.name,
+            'step': step,
+            'time': record_time - self.start_time,
+            'used_time': used_time,
+            'steps_per_sec': self.counts['steps'] / used_time,
+            'samples_per_sec': self.counts['samples'] / used_time,
+            'phases': {phase: {'sec': t, 'ratio': t / used_time, 'calls': self.call_nums[phase]}
+                       for phase, t in self.used_times.items()},
+        }
+        with open(f"{self.cwd}/profile_{self.name}.jsonl", 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.write_tensorboard(record=record)
+
+        self.used_times = {}
+        self.call_nums = {}
+        self.counts = {'steps': 0, 'samples': 0}
+        self.record_time = record_time
+        return record
+
+    def write_tensorboard(self, record: dict):
+        if self.tensorboard is None:
+            try:
+                from torch.utils.tensorboard import SummaryWriter
+            except ImportError:  # tensorboard is not installed, only save the json record
+                self.tensorboard = False
+                return
+            self.tensorboard = SummaryWriter(f"{self.cwd}/tensorboard/profile_{self.name}")
+        if self.tensorboard is False:
+            return
+
+        x = int(record['time'] if record['step'] is None else record['step'])
+        self.tensorboard.add_scalar(f"profile_{self.name}/steps_per_sec", record['steps_per_sec'], x)
+        self.tensorboard.add_scalar(f"profile_{self.name}/samples_per_sec", record['samples_per_sec'], x)
+        for phase, phase_dict in record['phases'].items():
+            self.tensorboard.add_scalar(f"profile_{self.name}/ratio_{phase}", phase_dict['ratio'], x)
+        self.tensorboard.flush()
+
+    def close(self, step: int = None):
+        self.dump(step=step, if_force=True)
+        if self.tensorboard:
+            self.tensorboard.close()
+        self.tensorboard = None
+
+
+NULL_PROFILER = Profiler()  # the shared disabled profiler, which keeps no state
+
+
+def load_profile_records(cwd: str, name: str = 'learner') -> list:
+    file_path = f"{cwd}/profile_{name}.jsonl"
+    if not os.path.isfile(file_path):
+        return []
+    with open(file_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
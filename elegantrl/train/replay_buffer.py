@@ -1,9 +1,12 @@
 import os
 import math
+import warnings
+import numpy as np
 import torch as th
 from typing import Tuple
 
 from .config import Config
+from .profiler import NULL_PROFILER
 
 TEN = th.Tensor
 
@@ -25,6 +28,7 @@ class ReplayBuffer:  # for off-policy
         self.max_size = max_size
         self.num_seqs = num_seqs
         self.device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+        self.profiler = NULL_PROFILER  # time the sampling. It is set by the training process
 
         """The struction of ReplayBuffer (for example, num_seqs = num_workers * num_envs == 2*4 = 8
         ReplayBuffer:
@@ -48,22 +52,49 @@ class ReplayBuffer:  # for off-policy
         d: done=False
         sequence of transition: s-a-r-d, s-a-r-d, s-a-r-D  s-a-r-d, s-a-r-d, s-a-r-d, s-a-r-d, s-a-r-D  s-a-r-d, ...
                                 <------trajectory------->  <----------trajectory--------------------->  <-----------
+
+        Compact storage (`args.buffer_state_dtype` in {float16, bfloat16, uint8}):
+        self.states stores the states in `buffer_state_dtype`. For uint8, `state = stored * scale + offset`
+            with a per-dimension scale and offset, from `args.buffer_state_bounds=(low, high)`,
+            or fitted to the states of the first update. The states out of bounds are clipped, counted in
+            `self.num_clipped_states`, and warned about once.
+        self.flags  stores `undone | unmask << 1` in uint8, instead of self.undones and self.unmasks.
+        The sampled items are decoded to float32 on the fly. The next_state is still read by index.
         """
         assert (action_dim < 256) or (not if_discrete)  # if_discrete==True, then action_dim < 256
-        self.states = th.empty((max_size, num_seqs, state_dim), dtype=th.float32, device=self.device)
-        self.actions = th.empty((max_size, num_seqs, action_dim), dtype=th.float32, device=self.device) \
-            if not if_discrete else th.empty((max_size, num_seqs), dtype=th.uint8, device=self.device)
-        self.rewards = th.empty((max_size, num_seqs), dtype=th.float32, device=self.device)
-        self.undones = th.empty((max_size, num_seqs), dtype=th.float32, device=self.device)
-        self.unmasks = th.empty((max_size, num_seqs), dtype=th.float32, device=self.device)
-
-        self.cum_rewards = th.empty_like(self.rewards)
+        state_dtype = getattr(args, 'buffer_state_dtype', None)
+        state_dtype = getattr(th, state_dtype) if isinstance(state_dtype, str) else state_dtype
+        self.state_dtype = th.float32 if state_dtype is None else state_dtype
+        assert self.state_dtype in {th.float32, th.float16, th.bfloat16, th.uint8}
+        self.if_compact = self.state_dtype != th.float32
+
+        self.state_scale = th.ones(state_dim, dtype=th.float32, device=self.device)
+        self.state_offset = th.zeros(state_dim, dtype=th.float32, device=self.device)
+        state_bounds = getattr(args, 'buffer_state_bounds', None)
+        self.if_fit_state_bounds = (self.state_dtype == th.uint8) and (state_bounds is None)
+        self.num_clipped_states = 0  # the number of state elements clipped to the bounds of uint8 storage
+        if (self.state_dtype == th.uint8) and (state_bounds is not None):
+            self.set_state_bounds(*state_bounds)
+
+        self.states = self.build_item('states', (max_size, num_seqs, state_dim), self.state_dtype)
+        self.actions = self.build_item('actions', (max_size, num_seqs, action_dim), th.float32) \
+            if not if_discrete else self.build_item('actions', (max_size, num_seqs), th.uint8)
+        self.rewards = self.build_item('rewards', (max_size, num_seqs), th.float32)
+        if self.if_compact:
+            self.flags = self.build_item('flags', (max_size, num_seqs), th.uint8)  # bit0: undone, bit1: unmask
+            self.item_names = ('states', 'actions', 'rewards', 'flags')
+        else:
+            self.undones = self.build_item('undones', (max_size, num_seqs), th.float32)
+            self.unmasks = self.build_item('unmasks', (max_size, num_seqs), th.float32)
+            self.item_names = ('states', 'actions', 'rewards', 'undones', 'unmasks')
+
+        self.cum_rewards = th.empty((max_size, num_seqs), dtype=th.float32, device=self.device)
         self.ids0 = th.tensor((), dtype=th.long, device=self.device)
         self.ids1 = th.tensor((), dtype=th.long, device=self.device)
 
         self.if_use_per = if_use_per
         if if_use_per:
-            self.sum_trees = [SumTree(buf_len=max_size) for _ in range(num_seqs)]
+            self.sum_trees = VecSumTree(buf_len=max_size, num_trees=num_seqs, device=self.device)
             self.per_alpha = getattr(args, 'per_alpha', 0.6)  # alpha = (Uniform:0, Greedy:1)
             self.per_beta = getattr(args, 'per_beta', 0.4)  # alpha = (Uniform:0, Greedy:1)
             """PER.  Prioritized Experience Replay. Section 4
@@ -75,120 +106,167 @@ class ReplayBuffer:  # for off-policy
             self.per_alpha = None
             self.per_beta = None
 
-    def update(self, items: Tuple[TEN, ...]):
+    @property
+    def items(self) -> Tuple[TEN, ...]:
+        return tuple(getattr(self, name) for name in self.item_names)
+
+    def build_item(self, name: str, shape: Tuple[int, ...], dtype: th.dtype) -> TEN:
+        return th.empty(shape, dtype=dtype, device=self.device)
+
+    def set_state_bounds(self, low, high):
+        low = th.as_tensor(low, dtype=th.float32, device=self.device).expand_as(self.state_offset)
+        high = th.as_tensor(high, dtype=th.float32, device=self.device).expand_as(self.state_offset)
+        self.state_scale[:] = (high - low).clamp_min(1e-6) / 255
+        self.state_offset[:] = low
+        self.if_fit_state_bounds = False
+
+    def encode_items(self, items: Tuple[TEN, ...]) -> Tuple[TEN, ...]:
+        """(states, actions, rewards, undones, unmasks) -> the items stored in ReplayBuffer"""
+        if not self.if_compact:
+            return items
         states, actions, rewards, undones, unmasks = items
+
+        if self.state_dtype == th.uint8:
+            if self.if_fit_state_bounds:  # widen the bounds of the first states, since later states may be out of them
+                low, high = states.reshape(-1, states.shape[-1]).float().aminmax(dim=0)
+                margin = (high - low).clamp_min(1e-3) * 0.25
+                self.set_state_bounds(low=low - margin, high=high + margin)
+            states = (states.to(self.device) - self.state_offset).div_(self.state_scale).round_()
+            num_clipped = ((states < 0) | (states > 255)).sum().item()
+            if num_clipped and self.num_clipped_states == 0:
+                warnings.warn(f"| ReplayBuffer: {num_clipped} state elements are out of the uint8 state bounds and "
+                              f"clipped. Set `args.buffer_state_bounds=(low, high)` to cover the states.")
+            self.num_clipped_states += num_clipped
+            states = states.clamp_(0, 255).to(th.uint8)
+        else:
+            states = states.to(self.state_dtype)
+        flags = undones.bool().to(th.uint8) | unmasks.bool().to(th.uint8) << 1
+        return states, actions, rewards, flags
+
+    def decode_items(self, items: Tuple[TEN, ...], next_state: TEN) -> Tuple[TEN, TEN, TEN, TEN, TEN, TEN]:
+        """the sampled items stored in ReplayBuffer -> (state, action, reward, undone, unmask, next_state)"""
+        if not self.if_compact:
+            return (*items, next_state)
+        state, action, reward, flag = items
+        undone, unmask = self.decode_flags(flag)
+        return self.decode_state(state), action, reward, undone, unmask, self.decode_state(next_state)
+
+    def decode_state(self, state: TEN) -> TEN:
+        if self.state_dtype == th.uint8:
+            return th.addcmul(self.state_offset, state.float(), self.state_scale)
+        return state.float()
+
+    @staticmethod
+    def decode_flags(flag: TEN) -> Tuple[TEN, TEN]:
+        undone = flag.bitwise_and(1).float()
+        unmask = flag.bitwise_and(2).bool().float()
+        return undone, unmask
+
+    def get_items(self, ids0: TEN, ids1: TEN) -> Tuple[TEN, TEN, TEN, TEN, TEN, TEN]:
+        items = [self.read_item(item_id=item_id, ids0=ids0, ids1=ids1) for item_id in range(len(self.item_names))]
+        next_state = self.read_item(item_id=0, ids0=th.remainder(ids0 + 1, self.max_size), ids1=ids1)
+        return self.decode_items(items=items, next_state=next_state)
+
+    def read_item(self, item_id: int, ids0: TEN, ids1: TEN) -> TEN:
+        return self.items[item_id][ids0, ids1]
+
+    def write_items(self, items: Tuple[TEN, ...]):
+        """write the encoded items of `add_size` steps into the ring of ReplayBuffer from the pointer"""
+        p0 = self.p
+        p1 = self.p + self.add_size
+        for buf_item, item in zip(self.items, items):
+            if p1 > self.max_size:
+                p2 = self.max_size - p0
+                buf_item[p0:self.max_size], buf_item[0:p1 - self.max_size] = item[:p2], item[p2:]
+            else:
+                buf_item[p0:p1] = item
+
+    def update(self, items: Tuple[TEN, ...]):
+        # states, actions, rewards, undones, unmasks = items
         # assert states.shape[1:] == (num_envs, state_dim)
         # assert actions.shape[1:] == (num_envs, action_dim if if_discrete else 1)
         # assert rewards.shape[1:] == (num_envs,)
         # assert undones.shape[1:] == (num_envs,)
         # assert unmasks.shape[1:] == (num_envs,)
-        self.add_size = rewards.shape[0]
+        self.add_size = items[2].shape[0]
+        self.write_items(self.encode_items(items))
 
         p = self.p + self.add_size  # pointer
         if p > self.max_size:
             self.if_full = True
-            p0 = self.p
-            p1 = self.max_size
-            p2 = self.max_size - self.p
             p = p - self.max_size
 
-            self.states[p0:p1], self.states[0:p] = states[:p2], states[-p:]
-            self.actions[p0:p1], self.actions[0:p] = actions[:p2], actions[-p:]
-            self.rewards[p0:p1], self.rewards[0:p] = rewards[:p2], rewards[-p:]
-            self.undones[p0:p1], self.undones[0:p] = undones[:p2], undones[-p:]
-            self.unmasks[p0:p1], self.unmasks[0:p] = unmasks[:p2], unmasks[-p:]
-        else:
-            self.states[self.p:p] = states
-            self.actions[self.p:p] = actions
-            self.rewards[self.p:p] = rewards
-            self.undones[self.p:p] = undones
-            self.unmasks[self.p:p] = unmasks
-
         if self.if_use_per:
             '''data_ids for single env'''
-            data_ids = th.arange(self.p, p, dtype=th.long, device=self.device)
-            if p > self.max_size:
-                data_ids = th.fmod(data_ids, self.max_size)
+            beg = self.p - 1 if (self.p > 0 or self.if_full) else 0  # the previous newest transition
+            end = self.p + self.add_size
+            data_ids = th.remainder(th.arange(beg, end, dtype=th.long, device=self.device), self.max_size)
+            probs = th.full(data_ids.shape, 10., dtype=th.float32, device=self.device)  # 10 is max_prob
+            probs[-1] = 0.  # the newest transition has no next_state yet, so it can't be sampled
 
             '''apply data_ids for vectorized env'''
-            for sum_tree in self.sum_trees:
-                sum_tree.update_ids(data_ids=data_ids.cpu(), prob=10.)
+            tree_ids = th.arange(self.num_seqs, dtype=th.long, device=self.device)
+            self.sum_trees.update_ids(tree_ids=tree_ids.repeat_interleave(data_ids.shape[0]),
+                                      data_ids=data_ids.repeat(self.num_seqs),
+                                      probs=probs.repeat(self.num_seqs))
 
         self.p = p
         self.cur_size = self.max_size if self.if_full else self.p
 
     def sample(self, batch_size: int) -> Tuple[TEN, TEN, TEN, TEN, TEN, TEN]:
-        sample_len = self.cur_size - 1
-
-        ids = th.randint(sample_len * self.num_seqs, size=(batch_size,), requires_grad=False, device=self.device)
-        self.ids0 = ids0 = th.fmod(ids, sample_len)  # ids % sample_len
-        self.ids1 = ids1 = th.div(ids, sample_len, rounding_mode='floor')  # ids // sample_len
+        self.profiler.count('samples', batch_size)
+        with self.profiler.tick('sample'):
+            sample_len = self.cur_size - 1
 
-        return (
-            self.states[ids0, ids1],
-            self.actions[ids0, ids1],
-            self.rewards[ids0, ids1],
-            self.undones[ids0, ids1],
-            self.unmasks[ids0, ids1],
-            self.states[ids0 + 1, ids1],  # next_state
-        )
+            ids = th.randint(sample_len * self.num_seqs, size=(batch_size,), requires_grad=False, device=self.device)
+            self.ids0 = ids0 = th.fmod(ids, sample_len)  # ids % sample_len
+            self.ids1 = ids1 = th.div(ids, sample_len, rounding_mode='floor')  # ids // sample_len
+            return self.get_items(ids0=ids0, ids1=ids1)
 
     def sample_for_per(self, batch_size: int) -> Tuple[TEN, TEN, TEN, TEN, TEN, TEN, TEN, TEN]:
-        beg = -self.max_size
-        end = (self.cur_size - self.max_size) if (self.cur_size < self.max_size) else -1
-
-        '''get is_indices, is_weights'''
-        is_indices: list = []
-        is_weights: list = []
+        self.profiler.count('samples', batch_size)
+        with self.profiler.tick('sample'):
+            return self._sample_for_per(batch_size=batch_size)
 
+    def _sample_for_per(self, batch_size: int) -> Tuple[TEN, TEN, TEN, TEN, TEN, TEN, TEN, TEN]:
         assert batch_size % self.num_seqs == 0
         sub_batch_size = batch_size // self.num_seqs
-        for env_i in range(self.num_seqs):
-            sum_tree = self.sum_trees[env_i]
-            _is_indices, _is_weights = sum_tree.important_sampling(batch_size, beg, end, self.per_beta)
-            is_indices.append(_is_indices + sub_batch_size * env_i)
-            is_weights.append(_is_weights)
 
-        is_indices: TEN = th.hstack(is_indices).to(self.device)
-        is_weights: TEN = th.hstack(is_weights).to(self.device)
+        '''get is_indices, is_weights. The batch of all sum trees descends at the same time.'''
+        ids0, ids1, leaf_values = self.sum_trees.important_sampling(batch_size=sub_batch_size)
+        ids0 = ids0.reshape(-1)  # shape == (num_seqs, sub_batch_size) -> (batch_size, )
+        ids1 = ids1.reshape(-1)
+        leaf_values = leaf_values.reshape(-1)
+
+        prob_ary = leaf_values / leaf_values.min()  # normalize the weights using the max weight of this batch
+        is_weights = th.pow(prob_ary, -self.per_beta)
+        is_indices = ids1 * self.max_size + ids0  # flatten (ids0, ids1) for `td_error_update_for_per()`
 
-        self.ids0 = ids0 = th.fmod(is_indices, self.cur_size)  # is_indices % sample_len
-        self.ids1 = ids1 = th.div(is_indices, self.cur_size, rounding_mode='floor')  # is_indices // sample_len
+        self.ids0 = ids0
+        self.ids1 = ids1
         return (
-            self.states[ids0, ids1],
-            self.actions[ids0, ids1],
-            self.rewards[ids0, ids1],
-            self.undones[ids0, ids1],
-            self.unmasks[ids0, ids1],
-            self.states[ids0 + 1, ids1],  # next_state
+            *self.get_items(ids0=ids0, ids1=ids1),  # (state, action, reward, undone, unmask, next_state)
             is_weights,  # important sampling weights
             is_indices,  # important sampling indices
         )
 
     def td_error_update_for_per(self, is_indices: TEN, td_error: TEN):  # td_error = (q-q).detach_().abs()
-        prob = td_error.clamp(1e-8, 10).pow(self.per_alpha)
-
-        # self.sum_tree.update_ids(is_indices.cpu(), prob.cpu())
-        batch_size = td_error.shape[0]
-        sub_batch_size = batch_size // self.num_seqs
-        for env_i in range(self.num_seqs):
-            sum_tree = self.sum_trees[env_i]
-            slice_i = env_i * sub_batch_size
-            slice_j = slice_i + sub_batch_size
+        probs = td_error.view(-1).clamp(1e-8, 10).pow(self.per_alpha)
 
-            sum_tree.update_ids(is_indices[slice_i:slice_j].cpu(), prob[slice_i:slice_j].cpu())
+        ids0 = th.fmod(is_indices, self.max_size)  # is_indices % max_size
+        ids1 = th.div(is_indices, self.max_size, rounding_mode='floor')  # is_indices // max_size
+        self.sum_trees.update_ids(tree_ids=ids1, data_ids=ids0, probs=probs)
 
     def save_or_load_history(self, cwd: str, if_save: bool):
-        item_names = (
-            (self.states, "states"),
-            (self.actions, "actions"),
-            (self.rewards, "rewards"),
-            (self.undones, "undones"),
-        )
+        item_names = tuple(zip(self.items, self.item_names))
+        if self.state_dtype == th.uint8:
+            item_names += ((self.state_scale, "state_scale"), (self.state_offset, "state_offset"))
 
         if if_save:
             for item, name in item_names:
-                if self.cur_size == self.p:
+                if name in {"state_scale", "state_offset"}:
+                    buf_item = item
+                elif self.cur_size == self.p:
                     buf_item = item[:self.cur_size]
                 else:
                     buf_item = th.vstack((item[self.p:self.cur_size], item[0:self.p]))
@@ -203,6 +281,10 @@ class ReplayBuffer:  # for off-policy
                 print(f"| buffer.save_or_load_history(): Load {file_path}", flush=True)
                 buf_item = th.load(file_path)
 
+                if name in {"state_scale", "state_offset"}:
+                    item[:] = buf_item
+                    self.if_fit_state_bounds = False
+                    continue
                 max_size = buf_item.shape[0]
                 item[:max_size] = buf_item
                 max_sizes.append(max_size)
@@ -218,11 +300,123 @@ class ReplayBuffer:  # for off-policy
         else:
             p1 = self.max_size
             p0 = p1 - self.add_size
-        cum_rewards = get_cumulative_rewards(rewards=self.rewards[p0:p1, :],
-                                             undones=self.undones[p0:p1, :])
+        if self.if_compact:
+            undones = self.decode_flags(self.flags[p0:p1, :].to(self.device))[0]
+        else:
+            undones = self.undones[p0:p1, :].to(self.device)
+        cum_rewards = get_cumulative_rewards(rewards=self.rewards[p0:p1, :].to(self.device), undones=undones)
         self.cum_rewards[p0:p1, :] = cum_rewards
 
 
+class ReplayBufferMemmap(ReplayBuffer):  # for off-policy
+    def __init__(self,
+                 max_size: int,
+                 state_dim: int,
+                 action_dim: int,
+                 gpu_id: int = 0,
+                 num_seqs: int = 1,
+                 if_use_per: bool = False,
+                 if_discrete: bool = False,
+                 args: Config = Config()):
+        """ReplayBuffer stored in `numpy.memmap` files, for a `max_size` larger than the memory.
+
+        The stored items (states, actions, rewards, undones, unmasks) are CPU tensors sharing memory with the files
+        `{memmap_dir}/replay_buffer_{name}.npy`, which are written in place as a ring just like ReplayBuffer.
+        Sampling only pages in the sampled rows. The latest `cache_len` steps are also kept in a hot cache
+        on the device of ReplayBuffer, which serves the sampled rows of recent transitions without disk access.
+        `save_or_load_history()` flushes the files and saves the pointer instead of re-serializing the items.
+        The files are reopened for `args.continue_train`, otherwise they are overwritten.
+        """
+        memmap_dir = getattr(args, 'buffer_memmap_dir', None)
+        self.memmap_dir = memmap_dir if isinstance(memmap_dir, str) else args.cwd
+        self.if_reopen = args.continue_train
+        self.memmaps = {}
+        os.makedirs(self.memmap_dir, exist_ok=True)
+        super().__init__(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=gpu_id,
+                         num_seqs=num_seqs, if_use_per=if_use_per, if_discrete=if_discrete, args=args)
+
+        '''hot cache: the transition of step `t` is stored in `cache_items[t % cache_len]`'''
+        self.cache_len = min(getattr(args, 'buffer_cache_len', 2 ** 12), max_size)
+        self.cache_size = 0  # the number of the latest steps in hot cache
+        self.num_added = 0  # the number of steps added since the hot cache was built
+        self.cache_items = [th.empty((self.cache_len, *item.shape[1:]), dtype=item.dtype, device=self.device)
+                            for item in self.items]
+
+        if self.if_reopen:
+            self.save_or_load_history(cwd=self.memmap_dir, if_save=False)
+
+    def build_item(self, name: str, shape: Tuple[int, ...], dtype: th.dtype) -> TEN:
+        np_dtype = th.empty((), dtype=th.int16 if dtype == th.bfloat16 else dtype).numpy().dtype  # no numpy.bfloat16
+        file_path = f"{self.memmap_dir}/replay_buffer_{name}.npy"
+
+        memmap = None
+        if self.if_reopen and os.path.isfile(file_path):
+            memmap = np.load(file_path, mmap_mode='r+')
+            if memmap.shape != shape or memmap.dtype != np_dtype:
+                print(f"| ReplayBufferMemmap: overwrite {file_path} with shape {shape}", flush=True)
+                memmap = None
+        if memmap is None:
+            memmap = np.lib.format.open_memmap(file_path, mode='w+', dtype=np_dtype, shape=shape)
+        self.memmaps[name] = memmap
+        item = th.from_numpy(memmap)  # the tensor shares memory with the memmap file
+        return item.view(th.bfloat16) if dtype == th.bfloat16 else item
+
+    def write_items(self, items: Tuple[TEN, ...]):
+        super().write_items(tuple(item.cpu() for item in items))  # write the memmap files
+
+        '''update hot cache using the latest `cache_len` steps'''
+        add_size = self.add_size
+        cache_ids = th.remainder(th.arange(self.num_added, self.num_added + add_size, device=self.device),
+                                 self.cache_len)[-self.cache_len:]
+        for item, cache_item in zip(items, self.cache_items):
+            cache_item[cache_ids] = item[-self.cache_len:].to(self.device, cache_item.dtype)
+        self.num_added += add_size
+        self.cache_size = min(self.cache_size + add_size, self.cache_len)
+
+    def read_item(self, item_id: int, ids0: TEN, ids1: TEN) -> TEN:
+        item = self.items[item_id]
+        cache_item = self.cache_items[item_id]
+
+        ages = th.remainder(self.p - 1 - ids0, self.max_size)  # the newest step has age 0
+        if_hit = ages < self.cache_size
+        hit_ids = th.nonzero(if_hit).squeeze(1)
+        miss_ids = th.nonzero(~if_hit).squeeze(1)
+
+        out = th.empty((ids0.shape[0], *item.shape[2:]), dtype=item.dtype, device=self.device)
+        cache_ids = th.remainder(self.num_added - 1 - ages[hit_ids], self.cache_len)
+        out[hit_ids] = cache_item[cache_ids, ids1[hit_ids]]
+        miss_ids0 = ids0[miss_ids].cpu()
+        miss_ids1 = ids1[miss_ids].cpu()
+        out[miss_ids] = item[miss_ids0, miss_ids1].to(self.device)  # only page in the sampled rows
+        return out
+
+    def save_or_load_history(self, cwd: str, if_save: bool):
+        pointer_path = f"{self.memmap_dir}/replay_buffer_pointer.npy"
+        bounds_path = f"{self.memmap_dir}/replay_buffer_state_bounds.npy"
+        if if_save:
+            for memmap in self.memmaps.values():
+                memmap.flush()
+            np.save(pointer_path, np.array((self.p, self.cur_size, self.if_full), dtype=np.int64))
+            if self.state_dtype == th.uint8:
+                np.save(bounds_path, th.stack((self.state_scale, self.state_offset)).cpu().numpy())
+            print(f"| buffer.save_or_load_history(): Flush the memmap files in {self.memmap_dir}", flush=True)
+        elif os.path.isfile(pointer_path):
+            self.p, self.cur_size, if_full = np.load(pointer_path).tolist()
+            self.if_full = bool(if_full)
+            if self.state_dtype == th.uint8 and os.path.isfile(bounds_path):
+                state_scale, state_offset = th.from_numpy(np.load(bounds_path)).to(self.device)
+                self.state_scale[:], self.state_offset[:] = state_scale, state_offset
+                self.if_fit_state_bounds = False
+            print(f"| buffer.save_or_load_history(): Load the memmap files in {self.memmap_dir}", flush=True)
+            if self.if_use_per:  # the priorities of the loaded transitions are reset to max_prob
+                data_ids = th.arange(self.cur_size, device=self.device)
+                probs = th.full(data_ids.shape, 10., dtype=th.float32, device=self.device)
+                probs[data_ids == (self.p - 1) % self.max_size] = 0.  # the newest transition has no next_state
+                tree_ids = th.arange(self.num_seqs, device=self.device)
+                self.sum_trees.update_ids(tree_ids=tree_ids.repeat_interleave(data_ids.shape[0]),
+                                          data_ids=data_ids.repeat(self.num_seqs), probs=probs.repeat(self.num_seqs))
+
+
 class SumTree:
     """ BinarySearchTree for PER (SumTree)
     Contributor: GitHub GyChou, GitHub MissIsSipPiu
@@ -297,3 +491,147 @@ class SumTree:
         prob_ary = leaf_values / self.tree[beg:end].min()
         weights = th.pow(prob_ary, -per_beta)
         return indices, weights
+
+
+class VecSumTree:
+    """ Vectorized BinarySearchTree for PER (SumTree)
+    `num_trees` sum trees are stacked in one tensor on the device of ReplayBuffer (one tree for one sequence).
+    The whole batch descends all the trees at the same time, instead of walking the tree one scalar at a time.
+
+    Tree index (buf_len=3 -> leaf_len=4 -> tree_len=7):
+          0       -> storing priority sum
+        |  |
+      1     2
+     | |   | |
+    3  4  5  6    -> storing priority for transitions. leaf 6 is a padding leaf with zero priority.
+    ARY type for storing: TEN[num_trees, tree_len]
+    """
+
+    def __init__(self, buf_len: int, num_trees: int = 1, device: th.device = th.device('cpu')):
+        self.buf_len = buf_len  # replay buffer len
+        self.num_trees = num_trees  # the number of sum trees. `num_trees = num_seqs` of ReplayBuffer
+        self.depth = max(1, math.ceil(math.log2(buf_len)))  # the depth of the tree (the number of parent layers)
+        self.leaf_len = 2 ** self.depth  # the number of leaf nodes (padding to a power of 2)
+        self.tree_len = 2 * self.leaf_len - 1  # parent_nodes_num + leaf_nodes_num
+        self.device = device
+
+        self.tree = th.zeros((num_trees, self.tree_len), dtype=th.float32, device=device)
+        self.tree_ids = th.arange(num_trees, dtype=th.long, device=device).unsqueeze(1)  # for batch searching
+
+    def update_ids(self, tree_ids: TEN, data_ids: TEN, probs: TEN):
+        """update the priority of leaf nodes, and then propagate the change through the trees layer by layer
+
+        tree_ids: the tree (sequence) index of each data. shape == (batch_size, )
+        data_ids: the data index of each data. shape == (batch_size, )
+        probs: the priority of each data. shape == (batch_size, )
+        """
+        tree = self.tree.view(-1)  # all trees share a flatten index: tree_id * tree_len + node_id
+        offsets = tree_ids.to(self.device) * self.tree_len
+
+        node_ids = data_ids.to(self.device) + (self.leaf_len - 1)
+        tree[offsets + node_ids] = probs.to(device=self.device, dtype=th.float32)
+        for depth in range(self.depth):  # the duplicate parent indices get the same sum, so `.unique()` is needless
+            node_ids = th.div(node_ids - 1, 2, rounding_mode='floor')  # parent indices
+            l_ids = offsets + node_ids * 2 + 1  # left children indices
+            tree[offsets + node_ids] = tree[l_ids] + tree[l_ids + 1]
+
+    def important_sampling(self, batch_size: int) -> Tuple[TEN, TEN, TEN]:
+        """sample `batch_size` data from each tree with proportional prioritization (stratified sampling)
+
+        batch_size: the number of data sampled from each tree
+        return: (data_ids, tree_ids, leaf_values), each of them has `shape == (num_trees, batch_size)`
+        """
+        tree = self.tree
+        tree_ids = self.tree_ids.expand(self.num_trees, batch_size)
+
+        # get random values for searching indices with proportional prioritization
+        rand_values = th.arange(batch_size, device=self.device) + th.rand((self.num_trees, batch_size), device=self.device)
+        values = rand_values * (tree[:, 0:1] / batch_size)
+
+        node_ids = th.zeros((self.num_trees, batch_size), dtype=th.long, device=self.device)
+        for depth in range(self.depth):
+            l_ids = node_ids * 2 + 1  # left children indices
+            l_values = tree[tree_ids, l_ids]
+            r_values = tree[tree_ids, l_ids + 1]
+
+            # go right when the value is larger than the left child, and never walk into a zero-priority subtree
+            if_right = th.logical_or(values >= l_values, l_values <= 0) & r_values.gt(0)
+            values = values - l_values * if_right
+            node_ids = l_ids + if_right.long()
+
+        leaf_values = tree[tree_ids, node_ids]
+        data_ids = node_ids - (self.leaf_len - 1)
+        return data_ids, tree_ids, leaf_values
+
+
+def check_vec_sum_tree_speed(buf_len: int = 2 ** 18, num_trees: int = 4, batch_size: int = 512, gpu_id: int = 0):
+    """microbenchmark: important_sampling + update_ids of `VecSumTree` vs. a list of `SumTree`"""
+    import time
+    device = th.device(f"cuda:{gpu_id}" if (th.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+    sub_batch_size = batch_size // num_trees
+    probs = th.rand((num_trees, buf_len), dtype=th.float32) + 0.1
+    data_ids = th.arange(buf_len, dtype=th.long)
+
+    '''SumTree (current implementation, one tree per sequence on CPU)'''
+    sum_trees = [SumTree(buf_len=buf_len) for _ in range(num_trees)]
+    for tree_id, sum_tree in enumerate(sum_trees):
+        sum_tree.update_ids(data_ids=data_ids, prob=probs[tree_id])
+
+    timer = time.time()
+    for sum_tree in sum_trees:  # the same work as `SumTree.important_sampling()`: walk the tree one scalar at a time
+        values = (th.arange(sub_batch_size) + th.rand(sub_batch_size)) * (sum_tree.tree[0] / sub_batch_size)
+        leaf_ids_values = [sum_tree.get_leaf_id_and_value(v) for v in values]
+        sum_tree.update_ids(data_ids=th.randint(buf_len, size=(sub_batch_size,)), prob=th.rand(sub_batch_size) + 0.1)
+    used_time0 = time.time() - timer
+    del leaf_ids_values
+
+    '''VecSumTree (all trees in one tensor on the device of ReplayBuffer)'''
+    vec_sum_tree = VecSumTree(buf_len=buf_len, num_trees=num_trees, device=device)
+    vec_sum_tree.update_ids(tree_ids=th.arange(num_trees).repeat_interleave(buf_len),
+                            data_ids=data_ids.repeat(num_trees), probs=probs.view(-1))
+
+    timer = time.time()
+    for _ in range(8):
+        data_ids1, tree_ids1, leaf_values = vec_sum_tree.important_sampling(batch_size=sub_batch_size)
+        vec_sum_tree.update_ids(tree_ids=tree_ids1.reshape(-1), data_ids=data_ids1.reshape(-1),
+                                probs=th.rand(batch_size, device=device) + 0.1)
+    th.cuda.synchronize() if device.type == 'cuda' else None
+    used_time1 = (time.time() - timer) / 8
+
+    print(f"| check_vec_sum_tree_speed() buf_len {buf_len}  num_trees {num_trees}  batch_size {batch_size}"
+          f"\n|   SumTree    {used_time0 * 1e3:9.3f} ms per batch"
+          f"\n|   VecSumTree {used_time1 * 1e3:9.3f} ms per batch  ({device})", flush=True)
+
+
+def check_compact_buffer_speed(max_size: int = 2 ** 16, num_seqs: int = 4, state_dim: int = 64,
+                               batch_size: int = 512, gpu_id: int = 0):
+    """microbenchmark: bytes per transition and sample throughput of ReplayBuffer with `buffer_state_dtype`"""
+    import time
+    action_dim = 8
+    for state_dtype in (None, 'float16', 'bfloat16', 'uint8'):
+        args = Config()
+        args.buffer_state_dtype = state_dtype
+        buffer = ReplayBuffer(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=gpu_id,
+                              num_seqs=num_seqs, args=args)
+        states = th.randn((max_size, num_seqs, state_dim), device=buffer.device)
+        buffer.update((states, th.rand((max_size, num_seqs, action_dim), device=buffer.device),
+                       th.rand((max_size, num_seqs), device=buffer.device),
+                       th.ones((max_size, num_seqs), dtype=th.bool, device=buffer.device),
+                       th.ones((max_size, num_seqs), dtype=th.bool, device=buffer.device)))
+        num_bytes = sum([item.element_size() * item.numel() for item in buffer.items]) / (max_size * num_seqs)
+        state_error = (buffer.decode_state(buffer.states) - states).abs().max().item()
+
+        buffer.sample(batch_size)
+        th.cuda.synchronize() if buffer.device.type == 'cuda' else None
+        timer = time.time()
+        for _ in range(64):
+            buffer.sample(batch_size)
+        th.cuda.synchronize() if buffer.device.type == 'cuda' else None
+        used_time = (time.time() - timer) / 64
+        print(f"| check_compact_buffer_speed() state_dtype {str(state_dtype):8}  {num_bytes:6.1f} bytes per transition"
+              f"  {batch_size / used_time / 1e6:6.2f} M samples/s  max state error {state_error:.4f}", flush=True)
+
+
+if __name__ == '__main__':
+    check_vec_sum_tree_speed()
+    check_compact_buffer_speed()
@@ -9,9 +9,10 @@ from multiprocessing import Process, Pipe
 
 from .config import Config
 from .config import build_env
-from .replay_buffer import ReplayBuffer
+from .replay_buffer import ReplayBuffer, ReplayBufferMemmap
 from .evaluator import Evaluator
 from .evaluator import get_rewards_and_steps
+from .profiler import Profiler
 
 if os.name == 'nt':  # if is WindowOS (Windows NT)
     """Fix bug about Anaconda in WindowOS
@@ -62,7 +63,8 @@ def train_agent_single_process(args: Config):
 
     '''init buffer'''
     if args.if_off_policy:
-        buffer = ReplayBuffer(
+        buffer_class = ReplayBufferMemmap if args.buffer_memmap_dir else ReplayBuffer
+        buffer = buffer_class(
             gpu_id=args.gpu_id,
             num_seqs=args.num_envs,
             max_size=args.buffer_size,
@@ -81,8 +83,15 @@ def train_agent_single_process(args: Config):
     eval_env = build_env(eval_env_class, eval_env_args, args.gpu_id)
     evaluator = Evaluator(cwd=args.cwd, env=eval_env, args=args, if_tensorboard=False)
 
+    '''init profiler'''
+    profiler = Profiler(cwd=args.cwd, name='single_process', if_enable=args.if_profile, dump_gap=args.profile_gap)
+    agent.profiler = profiler
+    if args.if_off_policy:
+        buffer.profiler = profiler
+
     '''train loop'''
     cwd = args.cwd
+    num_envs = args.num_envs
     break_step = args.break_step
     horizon_len = args.horizon_len
     if_off_policy = args.if_off_policy
@@ -101,7 +110,9 @@ def train_agent_single_process(args: Config):
 
     if_train = True
     while if_train:
-        buffer_items = agent.explore_env(env, horizon_len)
+        with profiler.tick('explore'):
+            buffer_items = agent.explore_env(env, horizon_len)
+        profiler.count('steps', horizon_len * num_envs)
         """buffer_items
         buffer_items = (states, actions,           rewards, undones, unmasks)  # off-policy
         buffer_items = (states, actions, logprobs, rewards, undones, unmasks)  # on-policy
@@ -110,10 +121,11 @@ def train_agent_single_process(args: Config):
         actions.shape == (horizon_len, num_workers * num_envs, action_dim)  # if_discrete=False
         actions.shape == (horizon_len, num_workers * num_envs)              # if_discrete=True
         """
-        if if_off_policy:
-            buffer.update(buffer_items)
-        else:
-            buffer[:] = buffer_items
+        with profiler.tick('buffer_update'):
+            if if_off_policy:
+                buffer.update(buffer_items)
+            else:
+                buffer[:] = buffer_items
 
         if if_discrete:
             show_str = action_to_str(_action_ary=buffer_items[1].data.cpu())
@@ -122,16 +134,21 @@ def train_agent_single_process(args: Config):
         exp_r = buffer_items[2].mean().item()
 
         th.set_grad_enabled(True)
-        logging_tuple = agent.update_net(buffer)
+        with profiler.tick('update_net'):
+            logging_tuple = agent.update_net(buffer)
         logging_tuple = (*logging_tuple, agent.explore_rate, show_str)
         th.set_grad_enabled(False)
 
-        evaluator.evaluate_and_save(actor=agent.act, steps=horizon_len, exp_r=exp_r, logging_tuple=logging_tuple)
+        with profiler.tick('evaluate'):
+            evaluator.evaluate_and_save(actor=agent.act, steps=horizon_len, exp_r=exp_r, logging_tuple=logging_tuple)
         if_train = (evaluator.total_step <= break_step) and (not os.path.exists(f"{cwd}/stop"))
+        profiler.dump(step=evaluator.total_step)
+    profiler.close(step=evaluator.total_step)
 
     print(f'| UsedTime: {time.time() - evaluator.start_time:>7.0f} | SavedDir: {cwd}', flush=True)
 
     env.close() if hasattr(env, 'close') else None
+    evaluator.close_eval_envs()
     evaluator.save_training_curve_jpg()
     agent.save_or_load_agent(cwd, if_save=True)
     if if_save_buffer and hasattr(buffer, 'save_or_load_history'):
@@ -150,9 +167,14 @@ def train_agent_multiprocessing(args: Config):
     learner_pipe = Pipe(duplex=False)
     evaluator_pipe = Pipe(duplex=True)
 
+    '''build the shared memory for rollout and actor'''
+    shared_rollout = SharedRollout(args=args)
+
     '''build Process'''
-    learner = Learner(learner_pipe=learner_pipe, worker_pipes=worker_pipes, evaluator_pipe=evaluator_pipe, args=args)
-    workers = [Worker(worker_pipe=worker_pipe, learner_pipe=learner_pipe, worker_id=worker_id, args=args)
+    learner = Learner(learner_pipe=learner_pipe, worker_pipes=worker_pipes, evaluator_pipe=evaluator_pipe,
+                      shared_rollout=shared_rollout, args=args)
+    workers = [Worker(worker_pipe=worker_pipe, learner_pipe=learner_pipe, worker_id=worker_id,
+                      shared_rollout=shared_rollout, args=args)
                for worker_id, worker_pipe in enumerate(worker_pipes)]
     evaluator = EvaluatorProc(evaluator_pipe=evaluator_pipe, args=args)
 
@@ -180,13 +202,18 @@ def train_agent_multiprocessing_multi_gpu(args: Config):
         learner_pipe = Pipe(duplex=False)
         evaluator_pipe = Pipe(duplex=True)
 
+        '''shared memory build'''
+        shared_rollout = SharedRollout(args=args)
+
         '''Process build'''
         learner = Learner(learner_pipe=learner_pipe,
                           worker_pipes=worker_pipes,
                           evaluator_pipe=evaluator_pipe,
+                          shared_rollout=shared_rollout,
                           learners_pipe=learners_pipe,
                           args=args)
-        workers = [Worker(worker_pipe=worker_pipe, learner_pipe=learner_pipe, worker_id=worker_id, args=args)
+        workers = [Worker(worker_pipe=worker_pipe, learner_pipe=learner_pipe, worker_id=worker_id,
+                          shared_rollout=shared_rollout, args=args)
                    for worker_id, worker_pipe in enumerate(worker_pipes)]
         evaluator = EvaluatorProc(evaluator_pipe=evaluator_pipe, args=args)
 
@@ -208,6 +235,7 @@ class Learner(Process):
             learner_pipe: Pipe,
             worker_pipes: List[Pipe],
             evaluator_pipe: Pipe,
+            shared_rollout: 'SharedRollout',
             learners_pipe: Optional[List[Pipe]] = None,
             args: Config = Config(),
     ):
@@ -215,6 +243,7 @@ class Learner(Process):
         self.recv_pipe = learner_pipe[0]
         self.send_pipes = [worker_pipe[1] for worker_pipe in worker_pipes]
         self.eval_pipe = evaluator_pipe[1]
+        self.shared_rollout = shared_rollout
         self.learners_pipe = learners_pipe
         self.args = args
 
@@ -239,8 +268,24 @@ class Learner(Process):
             agent.save_or_load_agent(args.cwd, if_save=False)
 
         '''Learner init buffer'''
-        if args.if_off_policy:
-            buffer = ReplayBuffer(
+        buffer_class = ReplayBufferMemmap if (args.if_off_policy and args.buffer_memmap_dir) else ReplayBuffer
+        if_async = args.if_off_policy and args.if_async
+        if args.if_async:
+            assert args.if_off_policy, "| Learner: `args.if_async=True` only supports off-policy algorithm"
+            assert num_learners == 1, "| Learner: `args.if_async=True` only supports single Learner"
+        if if_async:  # the rollouts of Workers are appended to the same sequences in the order they arrive
+            buffer = buffer_class(
+                gpu_id=args.gpu_id,
+                num_seqs=args.num_envs,
+                max_size=args.buffer_size * args.num_workers,
+                state_dim=args.state_dim,
+                action_dim=1 if args.if_discrete else args.action_dim,
+                if_use_per=args.if_use_per,
+                if_discrete=args.if_discrete,
+                args=args,
+            )
+        elif args.if_off_policy:
+            buffer = buffer_class(
                 gpu_id=args.gpu_id,
                 num_seqs=args.num_envs * args.num_workers * num_learners,
                 max_size=args.buffer_size,
@@ -266,45 +311,57 @@ class Learner(Process):
         state_dim = args.state_dim
         action_dim = args.action_dim
         horizon_len = args.horizon_len
+        max_policy_lag = args.max_policy_lag
         cwd = args.cwd
+        profiler = Profiler(cwd=cwd, name=f'learner{learner_id}' if num_learners > 1 else 'learner',
+                            if_enable=args.if_profile, dump_gap=args.profile_gap)
+        agent.profiler = profiler
+        if if_off_policy:
+            buffer.profiler = profiler
+        self.profiler = profiler
         del args
 
         agent.last_state = th.empty((num_seqs, state_dim), dtype=th.float32, device=agent.device)
 
-        states = th.zeros((horizon_len, num_seqs, state_dim), dtype=th.float32, device=agent.device)
-        actions = th.zeros((horizon_len, num_seqs, action_dim), dtype=th.float32, device=agent.device) \
-            if not if_discrete else th.zeros((horizon_len, num_seqs), dtype=th.int32).to(agent.device)
-        rewards = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=agent.device)
-        undones = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=agent.device)
-        unmasks = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=agent.device)
-        if if_off_policy:
-            buffer_items_tensor = (states, actions, rewards, undones, unmasks)
+        shared_rollout = self.shared_rollout
+        if num_learners == 1 and shared_rollout.device == agent.device:
+            buffer_items_tensor = shared_rollout.buffer_items  # use the shared memory directly without copying
         else:
-            logprobs = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=agent.device)
-            buffer_items_tensor = (states, actions, logprobs, rewards, undones, unmasks)
+            states = th.zeros((horizon_len, num_seqs, state_dim), dtype=th.float32, device=agent.device)
+            actions = th.zeros((horizon_len, num_seqs, action_dim), dtype=th.float32, device=agent.device) \
+                if not if_discrete else th.zeros((horizon_len, num_seqs), dtype=th.int32).to(agent.device)
+            rewards = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=agent.device)
+            undones = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=agent.device)
+            unmasks = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=agent.device)
+            if if_off_policy:
+                buffer_items_tensor = (states, actions, rewards, undones, unmasks)
+            else:
+                logprobs = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=agent.device)
+                buffer_items_tensor = (states, actions, logprobs, rewards, undones, unmasks)
 
         if_train = True
+        if if_async:
+            self.train_asynchronously(agent=agent, buffer=buffer, horizon_len=horizon_len,
+                                      max_policy_lag=max_policy_lag)
+            if_train = False
         while if_train:
-            actor = agent.act
-            actor = deepcopy(actor).cpu() if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
-
             '''Learner send actor to Workers'''
-            for send_pipe in self.send_pipes:
-                send_pipe.send(actor)
+            with profiler.tick('transfer'):
+                shared_rollout.save_actor(actor=agent.act)
+                for send_pipe in self.send_pipes:
+                    send_pipe.send(True)  # a small "ready" message instead of the pickled actor
             '''Learner receive (buffer_items, last_state) from Workers'''
-            for _ in range(num_workers):
-                worker_id, buffer_items, last_state = self.recv_pipe.recv()
-
-                buf_i = num_envs * worker_id
-                buf_j = num_envs * (worker_id + 1)
-                for buffer_item, buffer_tensor in zip(buffer_items, buffer_items_tensor):
-                    buffer_tensor[:, buf_i:buf_j] = buffer_item.to(agent.device)
-                agent.last_state[buf_i:buf_j] = last_state.to(agent.device)
-            del buffer_items, last_state
+            with profiler.tick('wait'):
+                for _ in range(num_workers):
+                    self.recv_pipe.recv()  # worker_id. Workers write (buffer_items, last_state) in shared memory
+            with profiler.tick('transfer'):
+                shared_rollout.load_buffer_items(buffer_items_tensor=buffer_items_tensor, last_state=agent.last_state)
+            profiler.count('steps', horizon_len * num_envs * num_workers)
 
             '''COMMUNICATE between Learners: Learner send actor to other Learners'''
             _buffer_len = num_envs * num_workers
-            _buffer_items_tensor = [t[:, :_buffer_len].cpu().detach() for t in buffer_items_tensor]
+            _buffer_items_tensor = [t[:, :_buffer_len].cpu().detach() for t in buffer_items_tensor] \
+                if num_communications > 0 else None
             for shift_id in range(num_communications):
                 _learner_pipe = self.learners_pipe[learner_id][0]
                 _learner_pipe.send(_buffer_items_tensor)
@@ -320,21 +377,23 @@ class Learner(Process):
                     buffer_tensor[:, _buf_i:_buf_j] = buffer_item.to(agent.device)
 
             '''Learner update training data to (buffer, agent)'''
-            if if_off_policy:
-                buffer.update(buffer_items_tensor)
-            else:
-                buffer[:] = buffer_items_tensor
+            with profiler.tick('buffer_update'):
+                if if_off_policy:
+                    buffer.update(buffer_items_tensor)
+                else:
+                    buffer[:] = buffer_items_tensor
 
             '''Learner update network using training data'''
             th.set_grad_enabled(True)
-            logging_tuple = agent.update_net(buffer)
+            with profiler.tick('update_net'):
+                logging_tuple = agent.update_net(buffer)
             th.set_grad_enabled(False)
 
             '''Learner receive training signal from Evaluator'''
             if self.eval_pipe.poll():  # whether there is any data available to be read of this pipe0
                 if_train = self.eval_pipe.recv()  # True means evaluator in idle moments.
-                # actor = agent.act
-                # actor = deepcopy(actor).cpu() if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
+                actor = agent.act
+                actor = deepcopy(actor).cpu() if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
             else:
                 actor = None
 
@@ -342,6 +401,7 @@ class Learner(Process):
             if if_train:
                 exp_r = buffer_items_tensor[2].mean().item()  # the average rewards of exploration
                 self.eval_pipe.send((actor, num_steps, exp_r, logging_tuple))
+            profiler.dump()
 
         '''Learner send the terminal signal to workers after break the loop'''
         print("| Learner Close Worker", flush=True)
@@ -355,15 +415,88 @@ class Learner(Process):
             print(f"| LearnerPipe.run: ReplayBuffer saving in {cwd}", flush=True)
             buffer.save_or_load_history(cwd, if_save=True)
             print(f"| LearnerPipe.run: ReplayBuffer saved  in {cwd}", flush=True)
+        profiler.close()
         print("| Learner Closed", flush=True)
 
+    def train_asynchronously(self, agent, buffer: ReplayBuffer, horizon_len: int, max_policy_lag: int):
+        """Workers keep exploring with a stale actor while Learner is updating networks.
+
+        The slot of each Worker in SharedRollout is a bounded queue of one rollout. A Worker writes the next rollout
+        into its slot after Learner sends a "ready" message, which means Learner has consumed the last one.
+        Learner drains whatever rollouts have arrived and keeps updating networks. The policy lag of a rollout is
+        the number of actors saved by Learner since the actor which explored this rollout. Each Worker publishes
+        the actor_version it loads in `shared_rollout.worker_versions`. Learner waits for the rollouts when any
+        Worker may be exploring with an actor older than `max_policy_lag` updates.
+        """
+        shared_rollout = self.shared_rollout
+        profiler = self.profiler
+
+        actor_version = shared_rollout.save_actor(actor=agent.act)
+        worker_versions = shared_rollout.worker_versions  # the actor_version that each Worker is exploring with
+        for send_pipe in self.send_pipes:
+            send_pipe.send(True)  # the slots are empty
+
+        policy_lags = []  # the policy lags of the rollouts since the last evaluation
+        exp_r = 0.0
+        if_train = True
+        while if_train:
+            '''Learner receive rollouts from Workers'''
+            num_rollouts = 0
+            exp_rs = []
+            while (self.recv_pipe.poll() or buffer.cur_size == 0
+                   or actor_version - worker_versions.min().item() > max_policy_lag):
+                with profiler.tick('wait'):
+                    worker_id, rollout_version = self.recv_pipe.recv()
+                with profiler.tick('transfer'):
+                    states, actions, rewards, undones, unmasks = shared_rollout.get_buffer_items(
+                        worker_id=worker_id, device=agent.device)
+                    unmasks = unmasks.clone()
+                    unmasks[-1] = False  # the next_state of the last step isn't the next item of this sequence
+                with profiler.tick('buffer_update'):
+                    buffer.update((states, actions, rewards, undones, unmasks))
+                self.send_pipes[worker_id].send(True)  # the slot of this Worker is consumed
+                profiler.count('steps', rewards.shape[0] * rewards.shape[1])
+
+                policy_lags.append(actor_version - rollout_version)
+                exp_rs.append(rewards.mean().item())
+                num_rollouts += 1
+            exp_r = np.mean(exp_rs) if exp_rs else exp_r  # the average rewards of exploration
+
+            '''Learner update network using training data'''
+            th.set_grad_enabled(True)
+            with profiler.tick('update_net'):
+                logging_tuple = agent.update_net(buffer)
+            th.set_grad_enabled(False)
+            with profiler.tick('transfer'):
+                actor_version = shared_rollout.save_actor(actor=agent.act)
+
+            '''Learner receive training signal from Evaluator'''
+            if self.eval_pipe.poll():  # whether there is any data available to be read of this pipe0
+                if_train = self.eval_pipe.recv()  # True means evaluator in idle moments.
+                actor = agent.act
+                actor = deepcopy(actor).cpu() if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
+            else:
+                actor = None
+
+            '''Learner send actor, training log and policy lag to Evaluator'''
+            if if_train:
+                num_steps = horizon_len * num_rollouts
+                avg_lag = float(np.mean(policy_lags)) if policy_lags else 0.0
+                max_lag = max(policy_lags) if policy_lags else 0
+                logging_tuple = (*logging_tuple, avg_lag, f"PolicyLag(avg, max) {avg_lag:.1f} {max_lag}")
+                self.eval_pipe.send((actor, num_steps, exp_r, logging_tuple))
+                policy_lags = [] if actor is not None else policy_lags
+            profiler.dump()
+
 
 class Worker(Process):
-    def __init__(self, worker_pipe: Pipe, learner_pipe: Pipe, worker_id: int, args: Config):
+    def __init__(self, worker_pipe: Pipe, learner_pipe: Pipe, worker_id: int,
+                 shared_rollout: 'SharedRollout', args: Config):
         super().__init__()
         self.recv_pipe = worker_pipe[0]
         self.send_pipe = learner_pipe[1]
         self.worker_id = worker_id
+        self.shared_rollout = shared_rollout
         self.args = args
 
     def run(self):
@@ -395,29 +528,155 @@ class Worker(Process):
 
         '''init buffer'''
         horizon_len = args.horizon_len
+        num_envs = args.num_envs
+
+        '''init profiler'''
+        profiler = Profiler(cwd=args.cwd, name=f'worker{worker_id}', if_enable=args.if_profile,
+                            dump_gap=args.profile_gap)
+        agent.profiler = profiler
 
         '''loop'''
+        if_async = args.if_off_policy and args.if_async
         del args
 
-        while True:
+        shared_rollout = self.shared_rollout
+        while if_async:
+            '''Worker explore with the latest actor, which may be updated by Learner during exploring'''
+            with profiler.tick('transfer'):
+                actor_version = shared_rollout.load_actor(actor=agent.act, worker_id=worker_id)
+            with profiler.tick('explore'):
+                buffer_items = agent.explore_env(env, horizon_len)
+            profiler.count('steps', horizon_len * num_envs)
+
+            '''Worker send the training data to Learner after Learner consumes the last one'''
+            with profiler.tick('wait'):
+                if_explore = self.recv_pipe.recv()
+            if not if_explore:
+                break
+            with profiler.tick('transfer'):
+                shared_rollout.save_buffer_items(worker_id=worker_id, buffer_items=buffer_items,
+                                                 last_state=agent.last_state)
+                self.send_pipe.send((worker_id, actor_version))
+            profiler.dump()
+
+        while not if_async:
             '''Worker receive actor from Learner'''
-            actor = self.recv_pipe.recv()
-            if actor is None:
+            with profiler.tick('wait'):
+                if_explore = self.recv_pipe.recv()
+            if not if_explore:
                 break
-            agent.act = actor.to(agent.device) if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
+            with profiler.tick('transfer'):
+                shared_rollout.load_actor(actor=agent.act)
 
             '''Worker send the training data to Learner'''
-            buffer_items = agent.explore_env(env, horizon_len)
-            last_state = agent.last_state
-            if os.name == 'nt':  # WindowsNT_OS can only send cpu_tensor
-                buffer_items = [t.cpu() for t in buffer_items]
-                last_state = deepcopy(last_state).cpu()
-            self.send_pipe.send((worker_id, buffer_items, last_state))
-
+            with profiler.tick('explore'):
+                buffer_items = agent.explore_env(env, horizon_len)
+            profiler.count('steps', horizon_len * num_envs)
+            with profiler.tick('transfer'):
+                shared_rollout.save_buffer_items(worker_id=worker_id, buffer_items=buffer_items,
+                                                 last_state=agent.last_state)
+                self.send_pipe.send(worker_id)
+            profiler.dump()
+
+        profiler.close()
         env.close() if hasattr(env, 'close') else None
         print(f"| Worker-{self.worker_id} Closed", flush=True)
 
 
+class SharedRollout:
+    """The shared memory for the rollout transport between Workers and Learner.
+
+    Each Worker writes `(buffer_items, last_state)` into its own slot in place, and Learner writes the actor
+    parameters in place. So the Pipes only send a small "ready" message instead of pickling the tensors and the actor.
+    A Worker writes its slot only after Learner has sent the "ready" message, so a slot is never read and written
+    at the same time. The actor is guarded by `actor_lock`, because Workers load it while Learner is updating
+    in the async mode (`args.if_async=True`). `actor_version` counts the actors saved by Learner, and
+    `worker_versions[worker_id]` is the actor_version that a Worker loaded for its current exploration.
+
+    The slot of worker_id is `buffer_item[:, num_envs * worker_id: num_envs * (worker_id + 1)]`
+    `states.shape == (horizon_len, num_workers * num_envs, state_dim)`
+    `actions.shape == (horizon_len, num_workers * num_envs, action_dim)`  # if_discrete=False
+    `actions.shape == (horizon_len, num_workers * num_envs)`              # if_discrete=True
+    `last_state.shape == (num_workers * num_envs, state_dim)`
+    """
+
+    def __init__(self, args: Config):
+        self.num_envs = args.num_envs
+        self.num_seqs = args.num_envs * args.num_workers
+
+        '''CUDA tensors are shared through CUDA IPC. WindowsNT_OS can only share cpu_tensor'''
+        if_cuda = th.cuda.is_available() and (args.gpu_id >= 0) and (os.name != 'nt')
+        self.device = th.device(f"cuda:{args.gpu_id}" if if_cuda else "cpu")
+
+        horizon_len = args.horizon_len
+        num_seqs = self.num_seqs
+        state_dim = args.state_dim
+        action_dim = args.action_dim
+        device = self.device
+
+        states = th.zeros((horizon_len, num_seqs, state_dim), dtype=th.float32, device=device)
+        actions = th.zeros((horizon_len, num_seqs, action_dim), dtype=th.float32, device=device) \
+            if not args.if_discrete else th.zeros((horizon_len, num_seqs), dtype=th.int32, device=device)
+        rewards = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=device)
+        undones = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=device)
+        unmasks = th.zeros((horizon_len, num_seqs), dtype=th.bool, device=device)
+        if args.if_off_policy:
+            buffer_items = (states, actions, rewards, undones, unmasks)
+        else:
+            logprobs = th.zeros((horizon_len, num_seqs), dtype=th.float32, device=device)
+            buffer_items = (states, actions, logprobs, rewards, undones, unmasks)
+        self.buffer_items = tuple(t.share_memory_() for t in buffer_items)
+        self.last_state = th.zeros((num_seqs, state_dim), dtype=th.float32, device=device).share_memory_()
+
+        '''build a dummy actor on CPU to get the shape of actor parameters'''
+        actor = args.agent_class(args.net_dims, args.state_dim, args.action_dim, gpu_id=-1, args=args).act
+        self.actor_params = {name: t.detach().to(device).clone().share_memory_()
+                             for name, t in actor.state_dict().items()}
+        self.actor_version = th.zeros(1, dtype=th.int64).share_memory_()
+        self.worker_versions = th.zeros(args.num_workers, dtype=th.int64).share_memory_()
+        self.actor_lock = mp.Lock()
+
+    def save_actor(self, actor: th.nn.Module) -> int:
+        with self.actor_lock:
+            for name, t in actor.state_dict().items():
+                self.actor_params[name].copy_(t)
+            self.synchronize()
+            self.actor_version += 1
+            return self.actor_version.item()
+
+    def load_actor(self, actor: th.nn.Module, worker_id: int = None) -> int:
+        with self.actor_lock:
+            actor.load_state_dict(self.actor_params)  # copy the parameters into the actor of this process
+            self.synchronize()
+            actor_version = self.actor_version.item()
+            if worker_id is not None:
+                self.worker_versions[worker_id] = actor_version
+            return actor_version
+
+    def save_buffer_items(self, worker_id: int, buffer_items: tuple, last_state: th.Tensor):
+        buf_i = self.num_envs * worker_id
+        buf_j = self.num_envs * (worker_id + 1)
+        for buffer_item, shared_item in zip(buffer_items, self.buffer_items):
+            shared_item[:, buf_i:buf_j] = buffer_item
+        self.last_state[buf_i:buf_j] = last_state
+        self.synchronize()
+
+    def get_buffer_items(self, worker_id: int, device: th.device) -> tuple:
+        buf_i = self.num_envs * worker_id
+        buf_j = self.num_envs * (worker_id + 1)
+        return tuple(shared_item[:, buf_i:buf_j].to(device) for shared_item in self.buffer_items)
+
+    def load_buffer_items(self, buffer_items_tensor: tuple, last_state: th.Tensor):
+        num_seqs = self.num_seqs
+        for shared_item, buffer_tensor in zip(self.buffer_items, buffer_items_tensor):
+            if shared_item is not buffer_tensor:  # Learner may use the shared memory as buffer_items_tensor directly
+                buffer_tensor[:, :num_seqs] = shared_item.to(buffer_tensor.device)
+        last_state[:num_seqs] = self.last_state.to(last_state.device)
+
+    def synchronize(self):  # finish writing the CUDA tensors before the other processes read them
+        th.cuda.synchronize(self.device) if self.device.type == 'cuda' else None
+
+
 class EvaluatorProc(Process):
     def __init__(self, evaluator_pipe: Pipe, args: Config):
         super().__init__()
@@ -439,23 +698,33 @@ class EvaluatorProc(Process):
         cwd = args.cwd
         break_step = args.break_step
         device = th.device(f"cuda:{args.gpu_id}" if (th.cuda.is_available() and (args.gpu_id >= 0)) else "cpu")
+        profiler = Profiler(cwd=cwd, name='evaluator', if_enable=args.if_profile, dump_gap=args.profile_gap)
         del args
 
         if_train = True
         while if_train:
-            '''Evaluator receive training log from Learner'''
-            actor, steps, exp_r, logging_tuple = self.pipe0.recv()
+            '''Evaluator receive training log from Learner, and drop the stale actors when Learner gets ahead'''
+            with profiler.tick('wait'):
+                actor, steps, exp_r, logging_tuple = self.pipe0.recv()
+                while self.pipe0.poll():  # the logs queued during the last evaluation
+                    new_actor, new_steps, exp_r, logging_tuple = self.pipe0.recv()
+                    actor = actor if new_actor is None else new_actor
+                    steps += new_steps
+            profiler.count('steps', steps)
 
             '''Evaluator evaluate the actor and save the training log'''
             if actor is None:
                 evaluator.total_step += steps  # update total_step but don't update recorder
             else:
                 actor = actor.to(device) if os.name == 'nt' else actor  # WindowsNT_OS can only send cpu_tensor
-                evaluator.evaluate_and_save(actor, steps, exp_r, logging_tuple)
+                with profiler.tick('evaluate'):
+                    evaluator.evaluate_and_save(actor, steps, exp_r, logging_tuple)
 
             '''Evaluator send the training signal to Learner'''
             if_train = (evaluator.total_step <= break_step) and (not os.path.exists(f"{cwd}/stop"))
             self.pipe0.send(if_train)
+            profiler.dump(step=evaluator.total_step)
+        profiler.close(step=evaluator.total_step)
 
         '''Evaluator save the training log and draw the learning curve'''
         evaluator.save_training_curve_jpg()
@@ -471,6 +740,7 @@ class EvaluatorProc(Process):
                 time.sleep(1)
             time.sleep(1)
 
+        evaluator.close_eval_envs()
         eval_env.close() if hasattr(eval_env, 'close') else None
         print("| Evaluator Closed", flush=True)
 
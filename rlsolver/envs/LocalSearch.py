@@ -44,14 +44,15 @@ class LocalSearch:
         kth = self.num_nodes - num_spin
 
         prev_xs = self.good_xs.clone()
-        prev_vs_raw = sim.calculate_obj_values_for_loop(prev_xs, if_sum=False)
-        prev_vs = prev_vs_raw.sum(dim=1)
+        prev_vs = sim.calculate_obj_values(prev_xs)
+
+        '''ws(weights): the gains of flipping each node of the initial xs'''
+        ws = sim.calculate_gains(prev_xs)
+        ws_std = ws.max(dim=0, keepdim=True)[0] - ws.min(dim=0, keepdim=True)[0]
 
         thresh = None
         for _ in range(num_iters):
             '''flip randomly with ws(weights)'''
-            ws = sim.n0_num_n1 - (4 if sim.if_bidirectional else 2) * prev_vs_raw
-            ws_std = ws.max(dim=0, keepdim=True)[0] - ws.min(dim=0, keepdim=True)[0]
 
             spin_rand = ws + th.randn_like(ws, dtype=th.float32) * (ws_std.float() * noise_std)
             thresh = th.kthvalue(spin_rand, k=kth, dim=1)[0][:, None] if thresh is None else thresh
@@ -64,12 +65,8 @@ class LocalSearch:
             update_xs_by_vs(prev_xs, prev_vs, xs, vs)
 
         '''addition'''
-        for i in range(sim.num_nodes):
-            xs1 = prev_xs.clone()
-            xs1[:, i] = th.logical_not(xs1[:, i])
-            vs1 = sim.calculate_obj_values(xs1)
-
-            update_xs_by_vs(prev_xs, prev_vs, xs1, vs1)
+        gains = sim.calculate_gains(prev_xs)
+        sim.flip_sweep_inplace(prev_xs, prev_vs, gains)
 
         num_update = update_xs_by_vs(self.good_xs, self.good_vs, prev_xs, prev_vs)
         return self.good_xs, self.good_vs, num_update
@@ -18,6 +18,12 @@ class iSCO:
         self.adj_matrix = params_dict['adj_matrix']
         self.sum_A = torch.sum(self.adj_matrix)
 
+        # the analytic local distribution: the gradient of the energy is -XA, no autograd graph is needed
+        self.if_analytic = True
+        self.cached_sample = None  # the sample returned by the last step, its version and its fields
+        self.cached_version = -1  # the in-place version counter of the cached sample, to catch edits by the caller
+        self.cached_fields = None
+
     def random_gen_init_sample(self):
         sample = torch.bernoulli(torch.full((BATCH_SIZE, self.max_num_nodes,), 0.5, device=self.device)).to(torch.float16)
 
@@ -29,7 +35,7 @@ class iSCO:
         ll_y, ll_y2x = self.ll_y2x(
             trajectory, y, temperature)
         log_acc = torch.clamp(ll_y + ll_y2x - ll_x - ll_x2y, max=0.0)
-        y = self.select_sample(log_acc, x, y)
+        y = self.select_sample(log_acc, x, y, trajectory)
 
         return y, ll_y * temperature, log_acc.exp()
 
@@ -43,10 +49,34 @@ class iSCO:
             'll_x2y': torch.sum(ll_selected, dim=-1),
             'selected_idx': selected_idx,
         }
+        if self.if_analytic:
+            trajectory['fields_x'] = self.cached_fields
 
         return ll_x, y, trajectory
 
     def get_local_dist(self, sample, temperature):
+        if not self.if_analytic:
+            return self.get_local_dist_autograd(sample, temperature)
+        if sample is not self.cached_sample or sample._version != self.cached_version:
+            self.cached_sample = sample
+            self.cached_version = sample._version
+            self.cached_fields = self.calc_fields(sample)
+        return self.calc_local_dist(sample, self.cached_fields, temperature)
+
+    def calc_fields(self, sample):
+        # fields = XA, the neighbor sum of the spins, by the tensor core matmul
+        return torch.matmul(sample * 2 - 1, self.adj_matrix)
+
+    def calc_local_dist(self, sample, fields, temperature):
+        # energy = -0.25 * sum(XA * delta_x), grad_x = -XA, the same as tensor_core_energy() without autograd
+        energy_x = (-0.25 * (fields * (sample * 2 - 1)).sum(dim=1)).to(torch.float) / temperature
+        grad_x = -fields.to(torch.float) / temperature
+        delta_x = 1 - sample * 2
+        score_change_x = (delta_x * grad_x) / 2
+        prob_x_local = torch.log_softmax(score_change_x, dim=-1)
+        return energy_x, prob_x_local
+
+    def get_local_dist_autograd(self, sample, temperature):
         energy_x, grad_x = self.tensor_core_energy(sample, temperature)
         grad_x = grad_x.detach()
         energy_x = energy_x.detach()
@@ -58,8 +88,18 @@ class iSCO:
         return energy_x, prob_x_local
 
     def ll_y2x(self, forward_trajectory, y, temperature):
-        ll_y, log_prob = self.get_local_dist(
-            y, temperature)
+        if self.if_analytic:
+            # the fields of y are updated from the fields of x by the flipped nodes only
+            selected_mask = forward_trajectory['selected_idx']['selected_mask']
+            spin_deltas = (y * 2 - 1) * 2 * selected_mask  # the spins of the flipped nodes change sign
+            batch_ids, node_ids = spin_deltas.nonzero(as_tuple=True)
+            fields_y = forward_trajectory['fields_x'].index_add(
+                0, batch_ids, spin_deltas[batch_ids, node_ids].unsqueeze(1) * self.adj_matrix[node_ids])
+            forward_trajectory['fields_y'] = fields_y
+            ll_y, log_prob = self.calc_local_dist(y, fields_y, temperature)
+        else:
+            ll_y, log_prob = self.get_local_dist(
+                y, temperature)
         selected_mask = forward_trajectory['selected_idx']['selected_mask']
         order_info = forward_trajectory['selected_idx']['perturbed_ll']
         backwd_idx = torch.argsort(order_info, dim=-1)
@@ -71,8 +111,12 @@ class iSCO:
 
         return ll_y, ll_y2x
 
-    def select_sample(self, log_acc, x, y):
+    def select_sample(self, log_acc, x, y, trajectory=None):
         y, acc = math_util.mh_step(log_acc, x, y)
+        if self.if_analytic and trajectory is not None:
+            self.cached_sample = y
+            self.cached_version = y._version
+            self.cached_fields = torch.where(acc.unsqueeze(-1), trajectory['fields_y'], trajectory['fields_x'])
 
         return y
 
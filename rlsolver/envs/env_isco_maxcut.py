@@ -17,6 +17,14 @@ class iSCO:
         self.edge_from = params_dict['edge_from']
         self.edge_to = params_dict['edge_to']
 
+        # the analytic local distribution: the gradient of the cut is a neighbor sum, no autograd graph is needed
+        self.if_analytic = True
+        self.adjacency, self.nbr_ids, self.nbr_weights = math_util.build_adjacency(
+            self.edge_from, self.edge_to, self.max_num_nodes)
+        self.cached_sample = None  # the sample returned by the last step, its version and its fields
+        self.cached_version = -1  # the in-place version counter of the cached sample, to catch edits by the caller
+        self.cached_fields = None
+
     def random_gen_init_sample(self, params_dict):
         sample = torch.bernoulli(torch.full((BATCH_SIZE, self.max_num_nodes,), 0.5, device=self.device))
 
@@ -28,7 +36,7 @@ class iSCO:
         ll_y, ll_y2x = self.ll_y2x(
             trajectory, y, temperature)
         log_acc = torch.clamp(ll_y + ll_y2x - ll_x - ll_x2y, max=0.0)
-        y = self.select_sample(log_acc, x, y)
+        y = self.select_sample(log_acc, x, y, trajectory)
 
         return y, ll_y * temperature, log_acc.exp()
 
@@ -43,10 +51,34 @@ class iSCO:
             'll_x2y': torch.sum(ll_selected, dim=-1),
             'selected_idx': selected_idx,
         }
+        if self.if_analytic:
+            trajectory['fields_x'] = self.cached_fields
 
         return ll_x, y, trajectory
 
     def get_local_dist(self, sample, temperature):
+        if not self.if_analytic:
+            return self.get_local_dist_autograd(sample, temperature)
+        if sample is not self.cached_sample or sample._version != self.cached_version:
+            self.cached_sample = sample
+            self.cached_version = sample._version
+            self.cached_fields = self.calc_fields(sample)
+        return self.calc_local_dist(sample, self.cached_fields, temperature)
+
+    def calc_fields(self, sample):
+        # fields = A @ spins, the neighbor sum of the spins
+        spins = sample.float() * 2 - 1
+        return torch.sparse.mm(self.adjacency, spins.T).T
+
+    def calc_local_dist(self, sample, fields, temperature):
+        # energy = sum_edges (1 - s_i * s_j) / 2 / temperature, grad_x = -fields / temperature
+        spins = sample.float() * 2 - 1
+        energy_x = (self.num_edges - 0.5 * torch.sum(spins * fields, dim=-1)) / 2.0 / temperature
+        score_change_x = spins * fields / 2.0 / temperature  # (delta_x * grad_x) / 2
+        prob_x_local = torch.log_softmax(score_change_x, dim=-1)
+        return energy_x, prob_x_local
+
+    def get_local_dist_autograd(self, sample, temperature):
         x = sample.clone().detach().requires_grad_(True)
         energy_x = vmap(self.model, in_dims=(0, None))(x, temperature)
         grad_x = torch.autograd.grad(energy_x, x, grad_outputs=torch.ones_like(energy_x), retain_graph=False,
@@ -61,8 +93,17 @@ class iSCO:
         return energy_x, prob_x_local
 
     def ll_y2x(self, forward_trajectory, y, temperature):
-        ll_y, log_prob = self.get_local_dist(
-            y, temperature)
+        if self.if_analytic:
+            # the fields of y are updated from the fields of x by the flipped nodes only
+            selected_mask = forward_trajectory['selected_idx']['selected_mask']
+            spin_deltas = (y.float() * 2 - 1) * 2 * selected_mask  # the spins of the flipped nodes change sign
+            fields_y = math_util.add_flip_deltas(forward_trajectory['fields_x'], self.nbr_ids, self.nbr_weights,
+                                                 spin_deltas)
+            forward_trajectory['fields_y'] = fields_y
+            ll_y, log_prob = self.calc_local_dist(y, fields_y, temperature)
+        else:
+            ll_y, log_prob = self.get_local_dist(
+                y, temperature)
         selected_mask = forward_trajectory['selected_idx']['selected_mask']
         order_info = forward_trajectory['selected_idx']['perturbed_ll']
         backwd_idx = torch.argsort(order_info, dim=-1)
@@ -83,7 +124,42 @@ class iSCO:
 
         return energy
 
-    def select_sample(self, log_acc, x, y):
+    def select_sample(self, log_acc, x, y, trajectory=None):
         y, acc = math_util.mh_step(log_acc, x, y)
+        if self.if_analytic and trajectory is not None:
+            self.cached_sample = y
+            self.cached_version = y._version
+            self.cached_fields = torch.where(acc.unsqueeze(-1), trajectory['fields_y'], trajectory['fields_x'])
 
         return y
+
+
+def check_local_dist(filename='../data/syn_BA/BA_100_ID0.txt', batch_size=64, num_steps=200):
+    """compare the analytic local distribution with the autograd one, and the time of the sampling steps"""
+    import os
+    import time
+    from rlsolver.methods.iSCO.util import maxcut_util
+    params_dict = maxcut_util.load_data(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+    sampler = iSCO(params_dict)
+    sample = torch.bernoulli(torch.full((batch_size, sampler.max_num_nodes,), 0.5, device=sampler.device))
+    temperature = sampler.init_temperature
+
+    energy0, log_prob0 = sampler.get_local_dist_autograd(sample, temperature)
+    energy1, log_prob1 = sampler.get_local_dist(sample, temperature)
+    assert torch.allclose(energy0, energy1, atol=1e-4) and torch.allclose(log_prob0, log_prob1, atol=1e-4)
+
+    for if_analytic in (False, True):
+        sampler.if_analytic = if_analytic
+        x = sample
+        mu = torch.ones(batch_size, device=sampler.device) * 10
+        timer = time.time()
+        for step in range(num_steps):
+            path_length = torch.clamp(torch.poisson(mu), min=1, max=sampler.max_num_nodes).long()
+            x, energy, acc = sampler.step(x, path_length, temperature)
+        used_time = time.time() - timer
+        print(f"| if_analytic {if_analytic:1}  steps/sec {num_steps / used_time:9.1f}  "
+              f"max_cut {energy.max().item():9.1f}")
+
+
+if __name__ == '__main__':
+    check_local_dist()
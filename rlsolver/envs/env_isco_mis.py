@@ -18,6 +18,14 @@ class iSCO:
         self.edge_to = params_dict['edge_to']
         self.lam = LAMADA
 
+        # the analytic local distribution: the gradient of the penalty is a neighbor sum, no autograd graph is needed
+        self.if_analytic = True
+        self.adjacency, self.nbr_ids, self.nbr_weights = math_util.build_adjacency(
+            self.edge_from, self.edge_to, self.max_num_nodes)
+        self.cached_sample = None  # the sample returned by the last step, its version and its fields
+        self.cached_version = -1  # the in-place version counter of the cached sample, to catch edits by the caller
+        self.cached_fields = None
+
     def random_gen_init_sample(self, params_dict):
         sample = torch.bernoulli(torch.full((BATCH_SIZE, self.max_num_nodes,), 0.5, device=self.device))
 
@@ -29,7 +37,7 @@ class iSCO:
         ll_y, ll_y2x = self.ll_y2x(
             trajectory, y, temperature)
         log_acc = torch.clamp(ll_y + ll_y2x - ll_x - ll_x2y, max=0.0)
-        y = self.select_sample(log_acc, x, y)
+        y = self.select_sample(log_acc, x, y, trajectory)
 
         return y, ll_y * temperature, log_acc.exp()
 
@@ -43,10 +51,33 @@ class iSCO:
             'll_x2y': torch.sum(ll_selected, dim=-1),
             'selected_idx': selected_idx,
         }
+        if self.if_analytic:
+            trajectory['fields_x'] = self.cached_fields
 
         return ll_x, y, trajectory
 
     def get_local_dist(self, sample, temperature):
+        if not self.if_analytic:
+            return self.get_local_dist_autograd(sample, temperature)
+        if sample is not self.cached_sample or sample._version != self.cached_version:
+            self.cached_sample = sample
+            self.cached_version = sample._version
+            self.cached_fields = self.calc_fields(sample)
+        return self.calc_local_dist(sample, self.cached_fields, temperature)
+
+    def calc_fields(self, sample):
+        # fields = A @ x, the number of the selected neighbors
+        return torch.sparse.mm(self.adjacency, sample.float().T).T
+
+    def calc_local_dist(self, sample, fields, temperature):
+        # energy = (sum x - lam * sum_edges x_i * x_j) / temperature, grad_x = (1 - lam * fields) / temperature
+        x = sample.float()
+        energy_x = (torch.sum(x, dim=-1) - self.lam * 0.5 * torch.sum(x * fields, dim=-1)) / temperature
+        score_change_x = ((1 - x * 2) * (1 - self.lam * fields) / temperature) / 2
+        prob_x_local = torch.log_softmax(score_change_x, dim=-1)
+        return energy_x, prob_x_local
+
+    def get_local_dist_autograd(self, sample, temperature):
         x = sample.clone().detach().requires_grad_(True)
         energy_x = vmap(self.model, in_dims=(0, None))(x, temperature)
         grad_x = torch.autograd.grad(energy_x, x, grad_outputs=torch.ones_like(energy_x), retain_graph=False,
@@ -61,8 +92,17 @@ class iSCO:
         return energy_x, prob_x_local
 
     def ll_y2x(self, forward_trajectory, y, temperature):
-        ll_y, log_prob = self.get_local_dist(
-            y, temperature)
+        if self.if_analytic:
+            # the fields of y are updated from the fields of x by the flipped nodes only
+            selected_mask = forward_trajectory['selected_idx']['selected_mask']
+            x_deltas = (y.float() * 2 - 1) * selected_mask  # +1 if a node is selected, -1 if it is unselected
+            fields_y = math_util.add_flip_deltas(forward_trajectory['fields_x'], self.nbr_ids, self.nbr_weights,
+                                                 x_deltas)
+            forward_trajectory['fields_y'] = fields_y
+            ll_y, log_prob = self.calc_local_dist(y, fields_y, temperature)
+        else:
+            ll_y, log_prob = self.get_local_dist(
+                y, temperature)
         selected_mask = forward_trajectory['selected_idx']['selected_mask']
         order_info = forward_trajectory['selected_idx']['perturbed_ll']
         backwd_idx = torch.argsort(order_info, dim=-1)
@@ -84,7 +124,11 @@ class iSCO:
 
         return energy / temperature
 
-    def select_sample(self, log_acc, x, y):
+    def select_sample(self, log_acc, x, y, trajectory=None):
         y, acc = math_util.mh_step(log_acc, x, y)
+        if self.if_analytic and trajectory is not None:
+            self.cached_sample = y
+            self.cached_version = y._version
+            self.cached_fields = torch.where(acc.unsqueeze(-1), trajectory['fields_y'], trajectory['fields_x'])
 
         return y
@@ -201,7 +201,7 @@ def check_local_search():
                           x=good_xs[0], v=good_vs[0].item(), )
 
     for i in range(num_iters):
-        evolutionary_replacement(good_xs, good_vs, low_k=2, if_maximize=if_maximize)
+        evolutionary_replacement(good_xs, good_vs, low_k=2, if_maximize=if_maximize, if_replace_duplicates=True)
 
         for _ in range(4):
             sim.local_search_inplace(good_xs, good_vs)
@@ -6,7 +6,6 @@ rlsolver_path = os.path.join(cur_path, '../../rlsolver')
 sys.path.append(os.path.dirname(rlsolver_path))
 
 from rlsolver.methods.util_read_data import (load_graph_list, GraphList,
-                                             build_adjacency_bool,
                                              build_adjacency_indies,
                                              obtain_num_nodes,
                                              update_xs_by_vs, )
@@ -24,14 +23,11 @@ class SimulatorMaxcut:
         self.int_type = int_type = th.long
         self.if_maximize = True
         self.if_bidirectional = if_bidirectional
+        self.max_chunk_bytes = 2 ** 28  # the memory budget of the (num_sims, num_edges) temporary tensors
 
         '''load graph'''
         graph_list: GraphList = graph_list if graph_list else load_graph_list(graph_name=sim_name)
 
-        '''建立邻接矩阵'''
-        # self.adjacency_matrix = build_adjacency_matrix(graph_list=graph_list, if_bidirectional=True).to(device)
-        self.adjacency_bool = build_adjacency_bool(graph_list=graph_list, if_bidirectional=True).to(device)
-
         '''建立邻接索引'''
         n0_to_n1s, n0_to_dts = build_adjacency_indies(graph_list=graph_list, if_bidirectional=if_bidirectional)
         n0_to_n1s = [t.to(int_type).to(device) for t in n0_to_n1s]
@@ -43,24 +39,49 @@ class SimulatorMaxcut:
         n0_to_n0s = [(th.zeros_like(n1s) + i) for i, n1s in enumerate(n0_to_n1s)]
         self.n0_ids = th.hstack(n0_to_n0s)[None, :]
         self.n1_ids = th.hstack(n0_to_n1s)[None, :]
-        len_sim_ids = self.num_edges * (2 if if_bidirectional else 1)
-        self.sim_ids = th.zeros(len_sim_ids, dtype=int_type, device=device)[None, :]
         self.n0_num_n1 = th.tensor([n1s.shape[0] for n1s in n0_to_n1s], device=device)[None, :]
 
+        '''symmetric sparse adjacency matrix without self-loops, for the gains of flipping each node'''
+        n0s, n1s = self.n0_ids[0], self.n1_ids[0]
+        if_other = n0s != n1s
+        n0s, n1s = n0s[if_other], n1s[if_other]
+        if not if_bidirectional:
+            n0s, n1s = th.hstack((n0s, n1s)), th.hstack((n1s, n0s))
+        self.adjacency_sparse = th.sparse_coo_tensor(th.stack((n0s, n1s)), th.ones(n0s.shape[0], device=device),
+                                                     size=(self.num_nodes, self.num_nodes),
+                                                     check_invariants=True).coalesce()
+        row_ids, col_ids = self.adjacency_sparse.indices()  # sorted by rows after coalesce()
+        values = self.adjacency_sparse.values()
+        crow_ids = [0] + th.bincount(row_ids, minlength=self.num_nodes).cumsum(dim=0).tolist()
+        self.gain_n1s = [col_ids[crow_ids[i]:crow_ids[i + 1]] for i in range(self.num_nodes)]
+        self.gain_dts = [values[crow_ids[i]:crow_ids[i + 1]] for i in range(self.num_nodes)]  # the number of edges
+
     def calculate_obj_values(self, xs: TEN, if_sum: bool = True) -> TEN:
-        num_sims = xs.shape[0]  # 并行维度，环境数量。xs, vs第一个维度， dim0 , 就是环境数量
-        if num_sims != self.sim_ids.shape[0]:
-            self.n0_ids = self.n0_ids[0].repeat(num_sims, 1)
-            self.n1_ids = self.n1_ids[0].repeat(num_sims, 1)
-            self.sim_ids = self.sim_ids[0:1] + th.arange(num_sims, dtype=self.int_type, device=self.device)[:, None]
+        """the cut values of xs.shape == (num_sims, num_nodes), or the cut of each edge if not `if_sum`.
 
-        values = xs[self.sim_ids, self.n0_ids] ^ xs[self.sim_ids, self.n1_ids]
-        if if_sum:
-            values = values.sum(1)
+        The edge endpoints (n0_ids, n1_ids) are broadcast over the sims instead of being repeated num_sims times.
+        The sims are evaluated in chunks, so the temporary (chunk_size, num_edges) tensors fit in `max_chunk_bytes`.
+        """
+        n0_ids, n1_ids = self.n0_ids[0], self.n1_ids[0]
+        if not if_sum:
+            values = xs[:, n0_ids] ^ xs[:, n1_ids]
+            return values // 2 if self.if_bidirectional else values
+
+        num_sims = xs.shape[0]  # 并行维度，环境数量。xs, vs第一个维度， dim0 , 就是环境数量
+        chunk_size = self.calc_chunk_size(num_sims)
+        values = th.empty(num_sims, dtype=self.int_type, device=xs.device)
+        for i in range(0, num_sims, chunk_size):
+            chunk_xs = xs[i:i + chunk_size]
+            values[i:i + chunk_size] = (chunk_xs[:, n0_ids] ^ chunk_xs[:, n1_ids]).sum(1)
         if self.if_bidirectional:
             values = values // 2
         return values
 
+    def calc_chunk_size(self, num_sims: int) -> int:
+        # three (chunk_size, num_edges) bool tensors: the two gathered endpoints and their xor
+        bytes_per_sim = max(3 * self.n0_ids.shape[1], 1)
+        return max(1, min(num_sims, self.max_chunk_bytes // bytes_per_sim))
+
     def calculate_obj_values_for_loop(self, xs: TEN, if_sum: bool = True) -> TEN:  # 代码简洁，但是计算效率低
         num_sims, num_nodes = xs.shape
         values = th.zeros((num_sims, num_nodes), dtype=self.int_type, device=self.device)
@@ -80,12 +101,41 @@ class SimulatorMaxcut:
         xs[:, 0] = 0
         return xs
 
+    def calculate_gains(self, xs: TEN) -> TEN:
+        """gains[i, j] is the change of the cut value after flipping xs[i, j]. gains.shape == (num_sims, num_nodes)
+
+        With the spins ys = 1 - 2 * xs, gains[i, j] = ys[i, j] * sum_k(adjacency[j, k] * ys[i, k])
+        """
+        ys = 1 - 2 * xs.float()
+        return ys * th.sparse.mm(self.adjacency_sparse, ys.T).T
+
+    def flip_sweep_inplace(self, good_xs: TEN, good_vs: TEN, gains: TEN):
+        """for node i in 0, 1, ..., num_nodes-1: flip xs[:, i] of the sims which cut value does not decrease.
+
+        It gives the same good_xs and good_vs as flipping a column and calling `update_xs_by_vs` for each node,
+        but only the gains of the flipped node and its neighbors are updated, which costs O(num_sims * degree).
+        """
+        for i in range(self.num_nodes):
+            gain = gains[:, i]
+            if_flip = gain.ge(0)
+            if_flip_float = if_flip.float()
+            good_xs[:, i] ^= if_flip
+            good_vs.add_((gain * if_flip_float).to(good_vs.dtype))
+
+            n1s = self.gain_n1s[i]
+            if n1s.shape[0] > 0:
+                # the edge (i, n1) changes from same-side to cut or the opposite: gains[:, n1] += 2 * dt * ys[i] * ys[n1]
+                ys_i = 1 - 2 * good_xs[:, i, None].float()  # the spin after flipping
+                ys_n1 = 1 - 2 * good_xs[:, n1s].float()
+                gains[:, n1s] += (2 * self.gain_dts[i]) * ys_i * ys_n1 * if_flip_float[:, None]
+            gains[:, i] = gain * (1 - 2 * if_flip_float)
+        return good_xs, good_vs
+
     def local_search_inplace(self, good_xs: TEN, good_vs: TEN,
                              num_iters: int = 8, num_spin: int = 8, noise_std: float = 0.3):
 
-        vs_raw = self.calculate_obj_values_for_loop(good_xs, if_sum=False)
-        good_vs = vs_raw.sum(dim=1).long() if good_vs.shape == () else good_vs.long()
-        ws = self.n0_num_n1 - (2 if self.if_bidirectional else 1) * vs_raw
+        good_vs = self.calculate_obj_values(good_xs).long() if good_vs.shape == () else good_vs.long()
+        ws = self.calculate_gains(good_xs)
         ws_std = ws.max(dim=0, keepdim=True)[0] - ws.min(dim=0, keepdim=True)[0]
         rd_std = ws_std.float() * noise_std
         spin_rand = ws + th.randn_like(ws, dtype=th.float32) * rd_std
@@ -103,55 +153,58 @@ class SimulatorMaxcut:
             update_xs_by_vs(good_xs, good_vs, xs, vs, if_maximize=self.if_maximize)
 
         '''addition'''
-        for i in range(self.num_nodes):
-            xs1 = good_xs.clone()
-            xs1[:, i] = th.logical_not(xs1[:, i])
-            vs1 = self.calculate_obj_values(xs1)
-
-            update_xs_by_vs(good_xs, good_vs, xs1, vs1, if_maximize=self.if_maximize)
+        gains = self.calculate_gains(good_xs)
+        self.flip_sweep_inplace(good_xs, good_vs, gains)
         return good_xs, good_vs
 
 
 '''check'''
 
 
-def find_best_num_sims():
-    gpu_id = int(sys.argv[1]) if len(sys.argv) > 1 else 0
-
-    calculate_obj_func = 'calculate_obj_values'
-    graph_name = 'gset_14'
-    num_sims = 2 ** 16
-    num_iter = 2 ** 6
-    # calculate_obj_func = 'calculate_obj_values_for_loop'
-    # graph_name = 'gset_14'
-    # num_sims = 2 ** 13
-    # num_iter = 2 ** 9
+def find_best_num_sims(simulator: SimulatorMaxcut = None, min_num_sims: int = 2 ** 6, max_num_sims: int = 2 ** 20,
+                       num_evals: int = 2 ** 20, min_speedup: float = 1.05) -> int:
+    """the num_sims with the most evaluated sims per second of `calculate_obj_values`.
 
-    if os.name == 'nt':
-        graph_name = 'powerlaw_64'
-        num_sims = 2 ** 4
-        num_iter = 2 ** 3
-
-    graph = load_graph_list(graph_name=graph_name)
-    device = th.device(f'cuda:{gpu_id}' if th.cuda.is_available() and gpu_id >= 0 else 'cpu')
-    simulator = SimulatorMaxcut(sim_name=graph_name, graph_list=graph, device=device, if_bidirectional=False)
+    num_sims is doubled from `min_num_sims`, and each num_sims evaluates about `num_evals` random solutions.
+    The search stops when doubling num_sims does not speed up by `min_speedup`, or when it runs out of memory.
+    """
+    if simulator is None:
+        gpu_id = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        graph_name = 'powerlaw_64' if os.name == 'nt' else 'gset_14'
+        device = th.device(f'cuda:{gpu_id}' if th.cuda.is_available() and gpu_id >= 0 else 'cpu')
+        simulator = SimulatorMaxcut(sim_name=graph_name, device=device, if_bidirectional=False)
+    device = simulator.device
 
     print('find the best num_sims')
-    from math import ceil
-    for j in (1, 1, 1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32):
-        _num_sims = int(num_sims * j)
-        _num_iter = ceil(num_iter * num_sims / _num_sims)
-
-        timer = time.time()
-        for i in range(_num_iter):
-            xs = simulator.generate_xs_randomly(num_sims=_num_sims)
-            vs = getattr(simulator, calculate_obj_func)(xs=xs)
-            assert isinstance(vs, TEN)
-            # print(f"| {i}  max_obj_value {vs.max().item()}")
-        print(f"_num_iter {_num_iter:8}  "
-              f"_num_sims {_num_sims:8}  "
-              f"UsedTime {time.time() - timer:9.3f}  "
+    best_num_sims = min_num_sims
+    best_speed = 0.
+    num_sims = min_num_sims
+    while num_sims <= max_num_sims:
+        num_iter = max(num_evals // num_sims, 2)
+        try:
+            xs = simulator.generate_xs_randomly(num_sims=num_sims)
+            simulator.calculate_obj_values(xs=xs)  # warm up
+            if device.type == 'cuda':
+                th.cuda.synchronize(device)
+            timer = time.time()
+            for i in range(num_iter):
+                vs = simulator.calculate_obj_values(xs=xs)
+                assert isinstance(vs, TEN)
+            if device.type == 'cuda':
+                th.cuda.synchronize(device)
+        except th.cuda.OutOfMemoryError:
+            print(f"num_sims {num_sims:8}  out of memory")
+            break
+        speed = num_iter * num_sims / (time.time() - timer)
+        print(f"num_sims {num_sims:8}  "
+              f"sims/sec {speed:12.0f}  "
               f"GPU {gpu_info_str(device)}")
+        if speed < best_speed * min_speedup:
+            break
+        best_num_sims, best_speed = num_sims, speed
+        num_sims *= 2
+    print(f"best num_sims {best_num_sims}")
+    return best_num_sims
 
 
 def check_simulator():
@@ -202,7 +255,7 @@ def check_local_search():
                           x=good_xs[0], v=good_vs[0].item(), )
 
     for i in range(num_iters):
-        evolutionary_replacement(good_xs, good_vs, low_k=2, if_maximize=if_maximize)
+        evolutionary_replacement(good_xs, good_vs, low_k=2, if_maximize=if_maximize, if_replace_duplicates=True)
 
         for _ in range(4):
             sim.local_search_inplace(good_xs, good_vs)
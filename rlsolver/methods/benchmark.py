@@ -0,0 +1,224 @@
+import sys
+import os
+cur_path = os.path.dirname(os.path.abspath(__file__))
+rlsolver_path = os.path.join(cur_path, '../../rlsolver')
+sys.path.append(os.path.dirname(rlsolver_path))
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+import json
+import time
+import random
+import contextlib
+import numpy as np
+import torch as th
+import multiprocessing as mp
+import multiprocessing.connection
+from typing import List, Tuple, Dict, Callable, Optional
+
+from rlsolver.methods.config import *
+from rlsolver.methods.util import calc_txt_files_with_prefixes
+from rlsolver.methods.util_read_data import read_nxgraph
+from rlsolver.methods.util_obj import obj_maxcut
+from rlsolver.methods.util_result import write_graph_result
+
+'''solvers: solve(filename, seed, time_limit) -> (obj, solution). The heavy solvers are imported in their own process'''
+
+
+def solve_by_greedy(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.greedy import greedy_maxcut
+    graph = read_nxgraph(filename)
+    score, solution, scores = greedy_maxcut(None, graph, None)
+    return score, solution
+
+
+def solve_by_simulated_annealing(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.simulated_annealing import simulated_annealing
+    graph = read_nxgraph(filename)
+    score, solution, scores = simulated_annealing(0.2, None, graph, None)
+    return score, solution
+
+
+def solve_by_simulated_annealing_batch(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.simulated_annealing_batch import simulated_annealing_batch
+    graph = read_nxgraph(filename)
+    score, solution, scores = simulated_annealing_batch(0.2, 10 * graph.number_of_nodes(), graph, num_chains=1024)
+    return score, solution
+
+
+def solve_by_tabu_search(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.genetic_algorithm import tabu_search
+    graph = read_nxgraph(filename)
+    init_solution = [random.randint(0, 1) for _ in range(graph.number_of_nodes())]
+    solution, score = tabu_search(init_solution, graph)
+    return score, solution
+
+
+def solve_by_mcpg(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.mcpg import mcpg
+    best_obj, best_x = mcpg(filename)
+    return float(best_obj), best_x.int().tolist()
+
+
+def solve_by_gurobi(filename: str, seed: int, time_limit: Optional[float]):
+    from rlsolver.methods.gurobi import run_using_gurobi  # gurobi writes its own result file too
+    x_values = run_using_gurobi(filename, time_limit=None if time_limit is None else int(time_limit))
+    solution = [int(round(x)) for x in x_values]
+    return obj_maxcut(solution, read_nxgraph(filename)), solution
+
+
+SOLVERS: Dict[str, Callable] = {
+    'greedy': solve_by_greedy,
+    'simulated_annealing': solve_by_simulated_annealing,
+    'simulated_annealing_batch': solve_by_simulated_annealing_batch,
+    'tabu_search': solve_by_tabu_search,
+    'mcpg': solve_by_mcpg,
+    'gurobi': solve_by_gurobi,
+}
+
+'''runner'''
+
+
+def calc_instance_name(filename: str) -> str:
+    """the path of an instance relative to rlsolver/data, so instances with the same name in two directories differ"""
+    return os.path.relpath(os.path.abspath(filename), os.path.join(rlsolver_path, 'data')).replace(os.sep, '/')
+
+
+def calc_task_key(method: str, filename: str, seed: int) -> str:
+    return f"{method}|{calc_instance_name(filename)}|{seed}"
+
+
+def load_benchmark_records(record_path: str) -> List[dict]:
+    """the last record of each task, since a retried task appends a new record"""
+    if not os.path.isfile(record_path):
+        return []
+    with open(record_path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return list({record['key']: record for record in records}.values())
+
+
+def run_task(method: str, filename: str, seed: int, time_limit: Optional[float], log_path: str,
+             result_conn: mp.connection.Connection):
+    """run a task in a child process, print its logs to `log_path` and send the result by `result_conn`"""
+    random.seed(seed)
+    np.random.seed(seed)
+    th.manual_seed(seed)
+    start_time = time.time()
+    with open(log_path, 'w') as log_file, contextlib.redirect_stdout(log_file), contextlib.redirect_stderr(log_file):
+        try:
+            obj, solution = SOLVERS[method](filename, seed, time_limit)
+            status, solution = 'done', [int(x) for x in solution]
+        except Exception as error:
+            print(f"| {method} {filename} seed {seed} failed: {repr(error)}")
+            status, obj, solution = 'failed', None, None
+    result_conn.send((calc_task_key(method, filename, seed), status, obj, solution, time.time() - start_time))
+    result_conn.close()
+
+
+def run_benchmark(methods: List[str], files: List[str], seeds: List[int], num_workers: int = 0,
+                  time_limit: Optional[float] = None, record_path: str = '../result/benchmark_records.jsonl',
+                  if_retry_failed: bool = False) -> List[dict]:
+    """run the (method x instance x seed) tasks in `num_workers` processes at the same time.
+
+    Each task runs in its own process, which is terminated after `time_limit` seconds (None: no limit).
+    Each task sends its result by its own pipe, so terminating a task while it is sending can't corrupt the results
+    of the other tasks. The pipe of a terminated task is closed without being read.
+    A finished task writes its solution with `write_graph_result` and appends a record to `record_path`.
+    The tasks which have a record are skipped, so an interrupted benchmark resumes from the unfinished tasks.
+    The failed and timed out tasks are run again only when `if_retry_failed=True`.
+    """
+    assert all(method in SOLVERS for method in methods), f"unknown methods: {set(methods) - set(SOLVERS)}"
+    num_workers = num_workers if num_workers > 0 else os.cpu_count()
+    os.makedirs(os.path.dirname(os.path.abspath(record_path)), exist_ok=True)
+    log_dir = f"{os.path.splitext(record_path)[0]}_logs"
+    os.makedirs(log_dir, exist_ok=True)
+
+    records = [r for r in load_benchmark_records(record_path) if r['status'] == 'done' or not if_retry_failed]
+    done_keys = {r['key'] for r in records}
+    tasks = [(method, filename, seed) for method in methods for filename in files for seed in seeds
+             if calc_task_key(method, filename, seed) not in done_keys]
+    print(f"| benchmark: {len(tasks)} tasks to run, {len(done_keys)} tasks skipped, {num_workers} workers")
+
+    running: Dict[str, tuple] = {}  # key: (process, result_conn, method, filename, seed, start_time)
+    while tasks or running:
+        while tasks and len(running) < num_workers:
+            method, filename, seed = tasks.pop(0)
+            key = calc_task_key(method, filename, seed)
+            log_path = f"{log_dir}/{key.replace('|', '_').replace('/', '_')}.log"
+            result_conn, send_conn = mp.Pipe(duplex=False)
+            process = mp.Process(target=run_task, args=(method, filename, seed, time_limit, log_path, send_conn),
+                                 daemon=True)
+            process.start()
+            send_conn.close()  # the child has its own copy, so result_conn gets EOF if the child exits without a result
+            running[key] = (process, result_conn, method, filename, seed, time.time())
+
+        finished = []
+        conn_keys = {item[1]: key for key, item in running.items()}
+        for result_conn in mp.connection.wait(list(conn_keys), timeout=0.2):
+            try:
+                finished.append(result_conn.recv())
+            except EOFError:  # the process crashed before sending its result
+                key = conn_keys[result_conn]
+                finished.append((key, 'failed', None, None, time.time() - running[key][5]))
+
+        '''terminate the timed out tasks'''
+        for key, (process, result_conn, method, filename, seed, start_time) in running.items():
+            used_time = time.time() - start_time
+            if time_limit is not None and used_time > time_limit:
+                process.terminate()
+                finished.append((key, 'timeout', None, None, used_time))
+
+        for key, status, obj, solution, used_time in finished:
+            if key not in running:
+                continue  # a task may finish and time out in the same round
+            process, result_conn, method, filename, seed, start_time = running.pop(key)
+            process.join()
+            result_conn.close()  # the pipe of a terminated task is dropped with whatever it holds
+            if status == 'done':
+                write_graph_result(obj, used_time, len(solution), method, solution, filename,
+                                   info_dict={'seed': seed})
+            record = {'key': key, 'method': method, 'filename': filename, 'seed': seed,
+                      'status': status, 'obj': obj, 'running_duration': used_time}
+            records.append(record)
+            with open(record_path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+            print(f"| {status:8} {key:48} obj {obj}  {used_time:9.2f}s")
+    return records
+
+
+def summarize_benchmark(records: List[dict]) -> str:
+    """a table of the average objective and running duration of each method on each instance"""
+    groups = {}
+    for record in records:
+        groups.setdefault((record['method'], calc_instance_name(record['filename'])), []).append(record)
+
+    lines = [f"{'method':26} {'instance':32} {'runs':>4} {'failed':>6} {'obj_avg':>12} {'obj_std':>10} "
+             f"{'obj_max':>12} {'duration':>10}"]
+    for (method, instance), group in sorted(groups.items()):
+        objs = np.array([r['obj'] for r in group if r['status'] == 'done'], dtype=np.float64)
+        durations = np.array([r['running_duration'] for r in group if r['status'] == 'done'], dtype=np.float64)
+        num_failed = len(group) - len(objs)
+        if len(objs) > 0:
+            lines.append(f"{method:26} {instance:32} {len(group):4} {num_failed:6} {objs.mean():12.3f} "
+                         f"{objs.std():10.3f} {objs.max():12.3f} {durations.mean():9.2f}s")
+        else:
+            lines.append(f"{method:26} {instance:32} {len(group):4} {num_failed:6} {'-':>12} {'-':>10} "
+                         f"{'-':>12} {'-':>10}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    assert PROBLEM == Problem.maxcut
+    methods = ['greedy', 'simulated_annealing', 'tabu_search']
+    seeds = [0, 1, 2]
+    time_limit = 600  # seconds of each task
+    num_workers = 0  # 0: all cores
+
+    directory_data = '../data/syn_BA'
+    prefixes = ['BA_100_']
+    files = calc_txt_files_with_prefixes(directory_data, prefixes)
+    # files = [file for directory in ('../data/syn_BA', '../data/syn_ER', '../data/syn_PL')
+    #          for file in calc_txt_files_with_prefixes(directory, ['BA_', 'ER_', 'PL_'])]
+
+    records = run_benchmark(methods=methods, files=files, seeds=seeds, num_workers=num_workers, time_limit=time_limit,
+                            record_path='../result/benchmark_records.jsonl')
+    print(summarize_benchmark(records))
@@ -43,6 +43,9 @@ GRAPH_TYPES: List[GraphType] = [GraphType.ER, GraphType.PL, GraphType.BA]
     # graph_types = ["erdos_renyi", "powerlaw", "barabasi_albert"]
 NUM_IDS = 30  # ID0, ..., ID29
 
+# the txt graph files are converted to .npz files in this directory once, keyed by the file hash. None: not cache
+GRAPH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/.graph_cache')
+
 
 
 INF = 1e6
@@ -0,0 +1,79 @@
+import os
+import sys
+
+cur_path = os.path.dirname(os.path.abspath(__file__))
+rlsolver_path = os.path.join(cur_path, '../../../rlsolver')
+sys.path.append(os.path.dirname(rlsolver_path))
+
+import time
+import numpy as np
+import torch
+
+from rlsolver.methods.util_read_data import read_graph_edges
+from rlsolver.methods.eco_s2v.src.networks.mpnn import MPNN, SparseMPNN
+
+"""
+Compare the forward time of the dense MPNN and the edge list SparseMPNN on CPU.
+The graphs are Gset files if they exist, else random graphs with the same numbers of nodes and edges as Gset.
+"""
+
+GSET_SIZES = {'gset_14.txt': (800, 4694), 'gset_22.txt': (2000, 19990), 'gset_55.txt': (5000, 12498),
+              'gset_70.txt': (10000, 9999), 'gset_81.txt': (20000, 40000)}
+
+
+def load_edges(graph_name, gset_dir=os.path.join(rlsolver_path, 'data/gset')):
+    """both directions of the edges of a Gset graph, (num_nodes, row_ids, col_ids, weights)"""
+    filename = os.path.join(gset_dir, graph_name)
+    if os.path.isfile(filename):
+        num_nodes, srcs, dsts, weights = read_graph_edges(filename)
+    else:
+        num_nodes, num_edges = GSET_SIZES[graph_name]
+        rng = np.random.default_rng(0)
+        srcs = rng.integers(0, num_nodes, size=num_edges)
+        dsts = (srcs + rng.integers(1, num_nodes, size=num_edges)) % num_nodes  # no self-loops
+        keys = np.unique(np.minimum(srcs, dsts) * num_nodes + np.maximum(srcs, dsts))  # no repeated edges
+        srcs, dsts = keys // num_nodes, keys % num_nodes
+        weights = np.ones(keys.shape[0])
+    row_ids = torch.as_tensor(np.concatenate([srcs, dsts]), dtype=torch.long)
+    col_ids = torch.as_tensor(np.concatenate([dsts, srcs]), dtype=torch.long)
+    weights = torch.as_tensor(np.concatenate([weights, weights]), dtype=torch.float)
+    return num_nodes, row_ids, col_ids, weights
+
+
+def calc_forward_time(forward, num_repeats):
+    forward()
+    timer = time.time()
+    for _ in range(num_repeats):
+        out = forward()
+    return (time.time() - timer) / num_repeats, out
+
+
+def benchmark_mpnn(graph_names=tuple(GSET_SIZES), n_obs_in=7, max_dense_nodes=2000, num_repeats=3):
+    torch.manual_seed(0)
+    network = MPNN(n_obs_in=n_obs_in, n_layers=3, n_features=64, n_hid_readout=[], tied_weights=False)
+    sparse_network = SparseMPNN(n_obs_in=n_obs_in, n_layers=3, n_features=64, n_hid_readout=[], tied_weights=False)
+    sparse_network.load_state_dict(network.state_dict())  # the checkpoints of MPNN are loaded directly
+
+    print(f"| {'graph':12} {'nodes':>6} {'edges':>6} {'dense':>9} {'sparse':>9} {'max_diff':>9}")
+    for graph_name in graph_names:
+        num_nodes, row_ids, col_ids, weights = load_edges(graph_name)
+        node_features = torch.rand((1, num_nodes, n_obs_in))
+
+        with torch.no_grad():
+            sparse_time, sparse_out = calc_forward_time(
+                lambda: sparse_network.forward_edges(node_features, row_ids, col_ids, weights), num_repeats)
+            if num_nodes <= max_dense_nodes:  # the dense MPNN uses O(N^2) memory
+                adj = torch.zeros((num_nodes, num_nodes))
+                adj.index_put_((row_ids, col_ids), weights, accumulate=True)  # sums repeated edges like index_add
+                obs = torch.cat([node_features[0].T, adj], dim=0)
+                dense_time, dense_out = calc_forward_time(lambda: network(obs), num_repeats)
+                dense_time = f"{dense_time:8.3f}s"
+                max_diff = f"{(dense_out - sparse_out).abs().max().item():9.2e}"
+            else:
+                dense_time, max_diff = '-', '-'
+        print(f"| {graph_name:12} {num_nodes:6} {row_ids.shape[0] // 2:6} {dense_time:>9} {sparse_time:8.3f}s "
+              f"{max_diff:>9}")
+
+
+if __name__ == '__main__':
+    benchmark_mpnn()
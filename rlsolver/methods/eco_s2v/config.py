@@ -40,6 +40,7 @@ NUM_GENERATED_INSTANCES_IN_SELECT_BEST = 10  # select_best_neural_network
 NUM_TRAINED_NODES_IN_INFERENCE = 20  # also used in select_best_neural_network
 NUM_INFERENCE_NODES = [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1100, 1200, 2000, 3000, 4000, 5000, 10000]
 USE_TENSOR_CORE_IN_INFERENCE = True if ALG == Alg.eeco else False
+USE_SPARSE_MPNN_IN_INFERENCE = False  # SparseMPNN: the edge embeddings on the real edges only, for large sparse graphs
 INFERENCE_PREFIXES = [GRAPH_TYPE.value + "_" + str(i) + "_" for i in NUM_INFERENCE_NODES]
 # PREFIXES = ["BA_100_", "BA_200_", "BA_300_", "BA_400_", "BA_500_", "BA_600_", "BA_700_", "BA_800_", "BA_900_",
 #             "BA_1000_", "BA_1100_", "BA_1200_", "BA_2000_", "BA_3000_", "BA_4000_",
@@ -13,6 +13,7 @@ import torch.optim as optim
 
 from rlsolver.methods.eco_s2v.config import *
 from rlsolver.methods.eco_s2v.src.agents.utils import ReplayBuffer, Logger, TestMetric, set_global_seed
+from rlsolver.methods.eco_s2v.src.envs.graph_store import as_observation, stack_observations
 from rlsolver.methods.eco_s2v.src.envs.util_envs import ExtraAction
 
 fix_seed = False # if test stepVsObj, set it as True; and False otherwise.
@@ -287,7 +288,7 @@ class DQN:
         last_record_obj_time = time.time()
 
         # Initialise the state
-        state = torch.as_tensor(self.env.reset())
+        state = as_observation(self.env.reset())
         score = 0
         losses_eps = []
         t1 = time.time()
@@ -326,7 +327,7 @@ class DQN:
             # Store transition in replay buffer
             action = torch.as_tensor([action], dtype=torch.long)
             reward = torch.as_tensor([reward], dtype=torch.float)
-            state_next = torch.as_tensor(state_next)
+            state_next = as_observation(state_next)
 
             done = torch.as_tensor([done], dtype=torch.float)
 
@@ -350,7 +351,7 @@ class DQN:
 
                 self.env, self.acting_in_reversible_spin_env = self.get_random_env()
                 self.replay_buffer = self.get_replay_buffer_for_env(self.env)
-                state = torch.as_tensor(self.env.reset())
+                state = as_observation(self.env.reset())
                 score = 0
                 losses_eps = []
                 t1 = time.time()
@@ -564,7 +565,7 @@ class DQN:
 
                     i_test += 1
 
-            actions = self.predict(torch.FloatTensor(np.array(obs_batch)).to(self.device),
+            actions = self.predict(stack_observations(obs_batch).float().to(self.device),
                                    testing_in_reversible_spin_env)
 
             actions = np.array(actions)
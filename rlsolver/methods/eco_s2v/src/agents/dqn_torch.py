@@ -13,6 +13,7 @@ import torch.optim as optim
 
 from rlsolver.methods.eco_s2v.config import *
 from rlsolver.methods.eco_s2v.src.agents.utils import ReplayBuffer, Logger, TestMetric, set_global_seed
+from rlsolver.methods.eco_s2v.src.envs.graph_store import as_observation, stack_observations
 from rlsolver.methods.eco_s2v.src.envs.util_envs import ExtraAction
 
 fix_seed = False # if test stepVsObj, set it as True; and False otherwise.
@@ -262,7 +263,7 @@ class DQN:
         return self.replay_buffers[env.action_space.n]
 
     def get_random_replay_buffer(self):
-        return random.sample(self.replay_buffers.items(), k=1)[0][1]
+        return random.sample(sorted(self.replay_buffers.items()), k=1)[0][1]
 
     def learn(self, timesteps, start_time=None, verbose=False):
         total_time = 0
@@ -324,7 +325,7 @@ class DQN:
 
                 self.env, self.acting_in_reversible_spin_env = self.get_random_env()
                 self.replay_buffer = self.get_replay_buffer_for_env(self.env)
-                state = torch.as_tensor(self.env.reset())
+                state = as_observation(self.env.reset())
                 score = score = torch.tensor(0, device=self.device, dtype=torch.float)
                 losses_eps = []
                 t1 = time.time()
@@ -460,8 +461,7 @@ class DQN:
                 action = torch.randint(0, self.env.action_space.n, (1,), device=self.device, dtype=torch.long)
             else:
                 # 从尚未翻转的 spin 中随机选择一个
-                state_tensor = torch.tensor(state, dtype=torch.float32)  # 转换为 PyTorch Tensor
-                allowed_actions = (state_tensor[0, :] == self.allowed_action_state).nonzero(as_tuple=True)[0]
+                allowed_actions = (state[0, :] == self.allowed_action_state).nonzero(as_tuple=True)[0]
                 action = allowed_actions[torch.randint(0, len(allowed_actions), (1,))].item()
         return action
 
@@ -541,7 +541,7 @@ class DQN:
 
                     i_test += 1
 
-            actions = self.predict(torch.stack(obs_batch, dim=0).to(self.device),
+            actions = self.predict(stack_observations(obs_batch).to(self.device),
                                    testing_in_reversible_spin_env)
             if isinstance(actions, int):
                 actions = [actions]
@@ -2,13 +2,13 @@ import json
 import math
 import os
 import random
-import threading
 from collections import namedtuple
 
 import numpy as np
 import torch
 
 from rlsolver.methods.eco_s2v.config import *
+from rlsolver.methods.eco_s2v.src.envs.graph_store import GRAPH_STORE, GraphObservation, stack_observations
 
 Transition = namedtuple(
     'Transition', ('state', 'action', 'reward', 'state_next', 'done')
@@ -31,43 +31,98 @@ def set_global_seed(seed, env):
 
 
 class ReplayBuffer:
+    """
+    A ring buffer of Transitions in preallocated tensors, one tensor of shape (capacity, ...) per field.
+
+    The tensors are allocated by the first transition. A GraphObservation keeps its node features in the tensor and its
+    graph handle in `self._graph_handles[field]`. A batch is gathered by indices in O(batch_size) when it is sampled.
+    For a CUDA device, it is gathered into one of two pinned staging buffers and copied with non_blocking=True, so the
+    copy is queued on the stream and a staging buffer is not refilled while its copy is in flight.
+    """
+
     def __init__(self, capacity):
         self._capacity = capacity
-        self._memory = {}
+        self._memory = None  # field: tensor, shape == (capacity, *the shape of the field)
+        self._graph_handles = {}  # field: the graph handles of the GraphObservation fields, shape == (capacity,)
         self._position = 0
+        self._size = 0
 
-        self.next_batch_process = None
-        self.next_batch_size = None
-        self.next_batch_device = None
-        self.next_batch = None
+        self._staging = [None, None]  # the pinned buffers of the batches copied to a CUDA device
+        self._staging_events = [None, None]
+        self._staging_id = 0
 
     def add(self, *args):
         """
-        Saves a transition.
+        Saves a transition, or a batch of transitions for Alg.eeco.
         """
-        if self.next_batch_process is not None:
-            # Don't add to the buffer when sampling from it.
-            self.next_batch_process.join()
         if ALG == Alg.eeco:
-            for i in range(len(args[0])):
-                self._memory[self._position] = Transition(args[0][i], args[1][i], args[2][i], args[3][i], args[4][i], )
-                self._position = (self._position + 1) % self._capacity
+            self._add_batch(args)
         else:
-            self._memory[self._position] = Transition(*args)
-            self._position = (self._position + 1) % self._capacity
-
-    def _prepare_sample(self, batch_size, device=None):
-        self.next_batch_size = batch_size
-        self.next_batch_device = device
+            self._add_batch([stack_observations([item]) for item in args])
 
-        batch = random.sample(list(self._memory.values()), batch_size)
-
-        self.next_batch = [torch.stack(tensors).to(device) for tensors in zip(*batch)]
-        self.next_batch_ready = True
-
-    def launch_sample(self, *args):
-        self.next_batch_process = threading.Thread(target=self._prepare_sample, args=args)
-        self.next_batch_process.start()
+    def _allocate(self, items):
+        self._memory = {}
+        for field, item in zip(Transition._fields, items):
+            if isinstance(item, GraphObservation):
+                self._graph_handles[field] = torch.zeros(self._capacity, dtype=torch.long)
+                item = item.state
+            self._memory[field] = torch.empty((self._capacity, *item.shape[1:]), dtype=item.dtype)
+
+    def _add_batch(self, items):
+        if self._memory is None:
+            self._allocate(items)
+        batch_size = items[0].shape[0]
+        indices = (self._position + torch.arange(batch_size)) % self._capacity
+        for field, item in zip(Transition._fields, items):
+            if isinstance(item, GraphObservation):
+                # the graphs of the overwritten transitions are released from GRAPH_STORE
+                GRAPH_STORE.release(self._graph_handles[field][indices[indices < self._size]].tolist())
+                GRAPH_STORE.acquire(list(item.graph_handles), item.graphs)
+                self._graph_handles[field][indices] = torch.as_tensor(item.graph_handles)
+                item = item.state
+            self._memory[field][indices] = item.to(device='cpu', dtype=self._memory[field].dtype)
+        self._position = (self._position + batch_size) % self._capacity
+        self._size = min(self._size + batch_size, self._capacity)
+
+    def _sample_indices(self, batch_size):
+        if batch_size > self._size:
+            raise ValueError("Sample larger than the replay buffer: {} > {}".format(batch_size, self._size))
+        # distinct indices as random.sample, the duplicates of torch.randint are drawn again
+        indices = torch.randint(self._size, (batch_size,)).unique()
+        while indices.shape[0] < batch_size:
+            indices = torch.cat((indices, torch.randint(self._size, (batch_size - indices.shape[0],)))).unique()
+        return indices[torch.randperm(batch_size)]
+
+    def _gather(self, indices, device=None):
+        batch_size = indices.shape[0]
+        if_pinned = device is not None and torch.device(device).type == 'cuda'
+        if if_pinned:
+            self._staging_id = 1 - self._staging_id
+            staging = self._staging[self._staging_id]
+            if self._staging_events[self._staging_id] is not None:
+                self._staging_events[self._staging_id].synchronize()  # the last copy from this staging buffer is done
+            if staging is None or staging['state'].shape[0] != batch_size:
+                staging = {field: torch.empty((batch_size, *tensor.shape[1:]), dtype=tensor.dtype).pin_memory()
+                           for field, tensor in self._memory.items()}
+                self._staging[self._staging_id] = staging
+
+        batch = []
+        for field, tensor in self._memory.items():
+            if if_pinned:
+                torch.index_select(tensor, 0, indices, out=staging[field])
+                item = staging[field].to(device, non_blocking=True)
+            else:
+                item = tensor[indices].to(device)
+            if field in self._graph_handles:
+                # the graphs are kept by the batch, they may be released from GRAPH_STORE before the batch is used
+                graph_handles = self._graph_handles[field][indices].tolist()
+                item = GraphObservation(item, graph_handles, [GRAPH_STORE.graphs[handle] for handle in graph_handles])
+            batch.append(item)
+
+        if if_pinned:
+            self._staging_events[self._staging_id] = torch.cuda.Event()
+            self._staging_events[self._staging_id].record()
+        return batch
 
     def sample(self, batch_size, device=None):
         """
@@ -75,22 +130,10 @@ class ReplayBuffer:
         and transfered to the specified device.
         Return a list of tensors in the order specified in Transition.
         """
-        if self.next_batch_process is not None:
-            self.next_batch_process.join()
-        else:
-            self.launch_sample(batch_size, device)
-            self.sample(batch_size, device)
-
-        if self.next_batch_size == batch_size and self.next_batch_device == device:
-            next_batch = self.next_batch
-            self.launch_sample(batch_size, device)
-            return next_batch
-        else:
-            self.launch_sample(batch_size, device)
-            self.sample(batch_size, device)
+        return self._gather(self._sample_indices(batch_size), device)
 
     def __len__(self):
-        return len(self._memory)
+        return self._size
 
 
 class eeco_ReplayBuffer:
@@ -174,201 +217,156 @@ class eeco_ReplayBuffer:
     #     return [self._memory[key][indices] for key in list(self._memory.keys())[:-1]]
 
 
-class PrioritisedReplayBuffer:
-
-    def __init__(self, capacity=10000, alpha=0.7, beta0=0.5):
-
-        # The capacity of the replay buffer.
-        self._capacity = capacity
-
-        # A binary (max-)heap of the buffer contents, sorted by the td_error <--> priority.
-        self.priority_heap = {}  # heap_position : [buffer_position, td_error, transition]
-
-        # Maps a buffer position (when the transition was added) to the position of the
-        # transition in the priority_heap.
-        self.buffer2heap = {}  # buffer_position : heap_position
-
-        # The current position in the replay buffer.  Starts at 1 for ease of binary-heap calcs.
-        self._buffer_position = 1
-
-        # Flag for when the replay buffer reaches max capicity.
-        self.full = False
+class SumTree:
+    """
+    A sum tree of priorities in one tensor. A batch of leaves is updated, and a batch of values is searched, at the
+    same time with one gather per level of the tree.
+    """
 
+    def __init__(self, capacity):
+        self.depth = max(1, math.ceil(math.log2(capacity)))
+        self.leaf_len = 2 ** self.depth  # the leaves after capacity are padding leaves of priority 0
+        self.tree = torch.zeros(2 * self.leaf_len - 1, dtype=torch.float64)
+
+    def update(self, ids, priorities):
+        node_ids = ids + (self.leaf_len - 1)
+        self.tree[node_ids] = priorities.to(self.tree.dtype)
+        for _ in range(self.depth):  # the duplicate parents get the same sum
+            node_ids = torch.div(node_ids - 1, 2, rounding_mode='floor')
+            left_ids = node_ids * 2 + 1
+            self.tree[node_ids] = self.tree[left_ids] + self.tree[left_ids + 1]
+
+    def total(self):
+        return self.tree[0]
+
+    def get(self, ids):
+        return self.tree[ids + (self.leaf_len - 1)]
+
+    def search(self, values):
+        """the leaf of each value, where the cumulative sum of the leaves before it is <= value"""
+        node_ids = torch.zeros(values.shape, dtype=torch.long)
+        for _ in range(self.depth):
+            left_ids = node_ids * 2 + 1
+            left_values = self.tree[left_ids]
+            if_left = values < left_values
+            node_ids = torch.where(if_left, left_ids, left_ids + 1)
+            values = torch.where(if_left, values, values - left_values)
+        return node_ids - (self.leaf_len - 1)
+
+
+class PrioritisedReplayBuffer(ReplayBuffer):
+    """
+    Prioritised replay on the tensors of ReplayBuffer, the priorities are a tensor of the td errors of the slots.
+
+    mode='rank': P(i) is proportional to rank(i)^-alpha, where the rank is by the td error. A batch takes one
+        transition from each of batch_size partitions of equal probability (stratified sampling). The slots are
+        sorted by the td errors every `sort_interval` samples, the transitions added since then wait for the next sort.
+    mode='proportional': P(i) is proportional to td_error(i)^alpha, sampled by stratified search of a SumTree.
+
+    A new transition gets the maximal td error seen so far. The importance weights are (N * P(i))^-beta / max_weight,
+    and beta is annealed to 1 by configure_beta_anneal_time().
+    """
+
+    def __init__(self, capacity=10000, alpha=0.7, beta0=0.5, mode='rank', sort_interval=100, epsilon=1e-6):
+        super().__init__(capacity)
+        assert mode in ('rank', 'proportional')
+        self.mode = mode
         self.alpha = alpha
         self.beta = beta0
         self.beta_step = 0
 
-        self.partitions = []
-        self.probabilities = []
-        self.__partitions_fixed = False
+        self.td_errors = torch.zeros(capacity)
+        self.max_td_error = 1.
+        self.epsilon = epsilon  # a transition with td error 0 can still be sampled in the proportional mode
+        self.sum_tree = SumTree(capacity) if mode == 'proportional' else None
+        self.new_positions = []  # the (position, num_added) of the adds since the last sample
 
-    def __get_max_td_err(self):
-        try:
-            return self.priority_heap[0][1]
-        except KeyError:
-            # Nothing exists in the priority heap yet!
-            return 1
+        self.sort_interval = sort_interval
+        self.rank_ids = None  # the slots sorted by the td errors in descending order
+        self.num_samples_since_sort = 0
+        self.partitions = None  # (starts, ends, probabilities) of the ranks for a batch size
+        self.partitions_key = None
 
     def add(self, *args):
-        """
-        Add the transition described by *args : (state, action, reward, state_next, done), to the
-        memory.
-        """
-        # By default a new transition has equal highest priority in the heap.
-        trans = [self._buffer_position, self.__get_max_td_err(), Transition(*args)]
-        try:
-            # Find the heap position of the transition to be replaced
-            heap_pos = self.buffer2heap[self._buffer_position]
-            self.full = True  # We found a transition in this buffer slot --> the memory is at capacity.
-        except KeyError:
-            # No transition in the buffer slot, therefore we will be adding one fresh.
-            heap_pos = self._buffer_position
-
-        # Update the heap, associated data stuctures and re-sort.
-        self.__update_heap(heap_pos, trans)
-        self.up_heap(heap_pos)
-        if self.full:
-            self.down_heap(heap_pos)
-
-        # Iterate to the next buffer position.
-        self._buffer_position = (self._buffer_position % self._capacity) + 1
-
-    def __update_heap(self, heap_pos, val):
-        """
-        heapList[heap_pos] <-- val = [buffer_position, td_error, transition]
-        """
-        self.priority_heap[heap_pos] = val
-        self.buffer2heap[val[0]] = heap_pos
-
-    def up_heap(self, i):
-        """
-        Iteratively swap heap items with their parents until they are in the correct order.
-        """
-        if i >= 2:
-            i_parent = i // 2
-            if self.priority_heap[i_parent][1] < self.priority_heap[i][1]:
-                tmp = self.priority_heap[i]
-                self.__update_heap(i, self.priority_heap[i_parent])
-                self.__update_heap(i_parent, tmp)
-                self.up_heap(i_parent)
-
-    def down_heap(self, i):
-        """
-        Iteratively swap heap items with their children until they are in the correct order.
-        """
-        i_largest = i
-        left = 2 * i
-        right = 2 * i + 1
-
-        size = self._capacity if self.full else len(self)
-
-        if left < size and self.priority_heap[left][1] > self.priority_heap[i_largest][1]:
-            i_largest = left
-        if right < size and self.priority_heap[right][1] > self.priority_heap[i_largest][1]:
-            i_largest = right
-
-        if i_largest != i:
-            tmp = self.priority_heap[i]
-            self.__update_heap(i, self.priority_heap[i_largest])
-            self.__update_heap(i_largest, tmp)
-            self.down_heap(i_largest)
+        position = self._position
+        super().add(*args)
+        num_added = (self._position - position) % self._capacity or self._capacity
+        if num_added == 1:
+            self.td_errors[position] = self.max_td_error
+        else:
+            self.td_errors[(position + torch.arange(num_added)) % self._capacity] = self.max_td_error
+        if self.sum_tree is not None:
+            self.new_positions.append((position, num_added))  # added to the sum tree in one update before sampling
 
-    def rebalance(self):
+    def update_priorities(self, buffer_positions, td_error):
+        buffer_positions = torch.as_tensor(buffer_positions, dtype=torch.long).reshape(-1).cpu()
+        td_error = torch.as_tensor(td_error, dtype=torch.float).reshape(-1).detach().cpu()
+        self.td_errors[buffer_positions] = td_error
+        self.max_td_error = max(self.max_td_error, td_error.max().item())
+        if self.sum_tree is not None:
+            self._update_sum_tree(buffer_positions)
+
+    def _update_sum_tree(self, ids):
+        self.sum_tree.update(ids, (self.td_errors[ids].abs() + self.epsilon) ** self.alpha)
+
+    def _flush_new_positions(self):
+        ids = torch.cat([(position + torch.arange(num_added)) % self._capacity
+                         for position, num_added in self.new_positions])
+        self.new_positions = []
+        self._update_sum_tree(ids.unique())
+
+    def update_partitions(self, num_partitions, num_ranks):
         """
-        rebalance priority_heap
+        The partitions of the ranks [0, num_ranks) into num_partitions parts of equal probability.
         """
-        sort_array = sorted(self.priority_heap.values(), key=lambda x: x[1], reverse=True)
-        # reconstruct priority_queue
-        self.priority_heap.clear()
-        self.buffer2heap.clear()
-
-        count = 1
-        while count <= self._capacity:
-            self.__update_heap(count, sort_array[count - 1])
-            count += 1
-
-        # sort the heap
-        for i in range(self._capacity // 2, 1, -1):
-            self.down_heap(i)
-
-    def update_partitions(self, num_partitions):
-
-        # P(t_i) = p_i^alpha / Sum_k(p_k^alpha), where the priority p_i = 1 / rank_i.
-        priorities = [math.pow(rank, -self.alpha) for rank in range(1, len(self.priority_heap) + 1)]
-        priorities_sum = sum(priorities)
-        probabilities = dict(
-            [(rank0index + 1, priority / priorities_sum) for rank0index, priority in enumerate(priorities)])
-
-        partitions = [1]
-        partition_num = 1
-
-        cum_probabilty = 0
-        next_boundary = partition_num / num_partitions
-        rank = 1
-        while partition_num < num_partitions:
-            cum_probabilty += probabilities[rank]
-            rank += 1
-            if cum_probabilty >= next_boundary:
-                partitions.append(rank)
-                partition_num += 1
-                next_boundary = partition_num / num_partitions
-        partitions.append(len(self.priority_heap))
-
-        partitions = [(a, b) for a, b in zip(partitions, partitions[1:])]
-
-        return partitions, probabilities
-
-    def update_priorities(self, buffer_positions, td_error):
-        for buf_id, td_err in zip(buffer_positions, td_error):
-            heap_id = self.buffer2heap[buf_id]
-            [id, _, trans] = self.priority_heap[heap_id]
-            self.priority_heap[heap_id] = [id, td_err, trans]
-            self.down_heap(heap_id)
-            self.up_heap(heap_id)
+        ranks = torch.arange(1, num_ranks + 1, dtype=torch.float64)
+        probabilities = ranks.pow(-self.alpha)
+        probabilities /= probabilities.sum()
+        boundaries = torch.arange(1, num_partitions, dtype=torch.float64) / num_partitions
+        starts = torch.searchsorted(torch.cumsum(probabilities, dim=0), boundaries) + 1
+        starts = torch.cat((torch.zeros(1, dtype=torch.long), starts)).clamp(max=num_ranks - 1)
+        ends = torch.cat((starts[1:], torch.tensor([num_ranks])))
+        return starts, torch.maximum(ends, starts + 1), probabilities
+
+    def _sample_ranks(self, batch_size):
+        if self.rank_ids is None or self.num_samples_since_sort >= self.sort_interval:
+            self.rank_ids = torch.argsort(self.td_errors[:self._size], descending=True)
+            self.num_samples_since_sort = 0
+        self.num_samples_since_sort += 1
+
+        num_ranks = self.rank_ids.shape[0]
+        if self.partitions_key != (batch_size, num_ranks):
+            self.partitions = self.update_partitions(batch_size, num_ranks)
+            self.partitions_key = (batch_size, num_ranks)
+        starts, ends, probabilities = self.partitions
+        ranks = starts + (torch.rand(batch_size) * (ends - starts)).long()
+        return self.rank_ids[ranks], probabilities[ranks], num_ranks
+
+    def _sample_proportional(self, batch_size):
+        if self.new_positions:
+            self._flush_new_positions()
+        total = self.sum_tree.total()
+        values = (torch.arange(batch_size) + torch.rand(batch_size, dtype=torch.float64)) * (total / batch_size)
+        ids = self.sum_tree.search(values).clamp(max=self._size - 1)
+        return ids, self.sum_tree.get(ids) / total, self._size
 
     def sample(self, batch_size, device=None):
-
-        # print("\nStarting sample():...")
-        # t = time.time()
-
-        if batch_size != len(self.partitions) or not self.__partitions_fixed:
-            # t1 = time.time()
-            self.partitions, self.probabilities = self.update_partitions(batch_size)
-            if self.full:
-                # Once the buffer is full, the partitions no longer need to be updated
-                # (as they depend only on the number of stored transitions and alpha).
-                self.__partitions_fixed = True
-            # print("\tupdate_partitions in :", time.time()-t1)
-
         self.beta = min(self.beta + self.beta_step, 1)
 
-        # t1 = time.time()
-
-        batch_ranks = [np.random.randint(low, high) for low, high in self.partitions]
-        batch_buffer_positions, batch_td_errors, batch_transitions = zip(
-            *[self.priority_heap[rank] for rank in batch_ranks])
-        batch = [torch.stack(tensors).to(device) for tensors in zip(*batch_transitions)]
-
-        # print("\tbatch sampled in :", time.time() - t1)
-        # t1 = time.time()
+        if self.mode == 'rank':
+            ids, sample_probs, num_ranks = self._sample_ranks(batch_size)
+        else:
+            ids, sample_probs, num_ranks = self._sample_proportional(batch_size)
+        batch = self._gather(ids, device)
 
-        N = self._capacity if self.full else len(self)
         # Note this is a column vector to match the dimensions of weights and td_target in dqn.train_step(...)
-        sample_probs = torch.FloatTensor([[self.probabilities[rank]] for rank in batch_ranks])
-        weights = (N * sample_probs).pow(-self.beta)
+        weights = (num_ranks * sample_probs.unsqueeze(1)).pow(-self.beta)
         weights /= weights.max()
-
-        # print("\tweights calculated in :", time.time() - t1)
-        # print("...finished in :", time.time() - t)
-
-        return batch, weights.to(device), batch_buffer_positions
+        return batch, weights.float().to(device), ids
 
     def configure_beta_anneal_time(self, beta_max_at_samples):
         self.beta_step = (1 - self.beta) / beta_max_at_samples
 
-    def __len__(self):
-        return len(self.priority_heap)
-
 
 class Logger:
     def __init__(self, save_path, args, n_sims):
@@ -441,3 +439,36 @@ class Logger:
         with open(self.save_path, 'w') as output:
             json.dump(self._memory, output, ensure_ascii=True, indent=4)
             print(f"result saved to {self.save_path}")
+
+
+def check_replay_buffer_graph_observation():
+    """add transitions whose GraphObservations carry no graphs (graphs=None), their graphs are already in GRAPH_STORE"""
+    graph = torch.rand(3, 4)
+    handle = GRAPH_STORE.new_handle()
+    GRAPH_STORE.acquire([handle], [graph])  # the reference of the env
+
+    buffer = ReplayBuffer(capacity=2)
+    for _ in range(3):
+        obs = GraphObservation(torch.rand(2, 4), handle)
+        assert obs.graphs is None
+        buffer._add_batch([stack_observations([obs]), torch.tensor([1]), torch.tensor([0.5]),
+                           stack_observations([obs]), torch.tensor([False])])
+    assert GRAPH_STORE.ref_counts[handle] == 1 + 2 * 2  # the env, and state and state_next of 2 transitions
+
+    state, action, reward, state_next, done = buffer.sample(2)
+    assert torch.equal(state.resolve()[:, 2:], graph.expand(2, 3, 4))
+
+    # an unknown handle without its graph cannot be acquired
+    try:
+        GRAPH_STORE.acquire([GRAPH_STORE.new_handle()])
+        raise AssertionError("acquire() should raise KeyError for a missing graph")
+    except KeyError:
+        pass
+
+    GRAPH_STORE.release([handle] * (1 + 2 * 2))
+    assert handle not in GRAPH_STORE.graphs
+    print("| check_replay_buffer_graph_observation passed")
+
+
+if __name__ == '__main__':
+    check_replay_buffer_graph_observation()
@@ -0,0 +1,103 @@
+import torch
+
+
+class GraphStore:
+    '''
+    A store of the immutable graphs of the observations, shared by the envs and the replay buffers.
+
+    An observation keeps the node features and the handle of its graph, instead of a copy of the adjacency matrix.
+    The replay buffers acquire the graphs of the transitions they keep and release them when the transitions are
+    overwritten, so a graph stays in the store as long as a transition refers to it.
+    '''
+
+    def __init__(self):
+        self.graphs = {}  # handle: the graph rows of the observation, the adjacency matrix (and the bias)
+        self.ref_counts = {}  # handle: the number of references of the replay buffers
+        self.num_handles = 0
+
+    def new_handle(self):
+        handle = self.num_handles
+        self.num_handles += 1
+        return handle
+
+    def acquire(self, handles, graphs=None):
+        # graphs is None for the observations whose graphs are already in the store
+        for i, handle in enumerate(handles):
+            if handle in self.ref_counts:
+                self.ref_counts[handle] += 1
+            elif graphs is not None:
+                self.graphs[handle] = graphs[i]
+                self.ref_counts[handle] = 1
+            else:
+                raise KeyError(f"graph handle {handle} is not in GRAPH_STORE and its graph is not given")
+
+    def release(self, handles):
+        for handle in handles:
+            self.ref_counts[handle] -= 1
+            if self.ref_counts[handle] == 0:
+                del self.ref_counts[handle]
+                del self.graphs[handle]
+
+    def get(self, handles, device=None):
+        return torch.stack([self.graphs[handle] for handle in handles]).to(device)
+
+    def __len__(self):
+        return len(self.graphs)
+
+
+GRAPH_STORE = GraphStore()
+
+
+class GraphObservation:
+    '''
+    The node features of an observation (or a batch of observations) and the handles of their graphs.
+
+    Indexing, .to() and .float() act on the node features, whose first row is the spin state as in the dense
+    observation. The dense observation torch.cat((state, graph), dim=-2) is built only at batch time by resolve().
+    '''
+
+    def __init__(self, state, graph_handles, graphs=None):
+        self.state = state  # (n_observables, n_actions), or (batch_size, n_observables, n_actions)
+        self.graph_handles = graph_handles  # an int, or a list of ints for a batch
+        self.graphs = graphs  # the graph tensors of live observations, None for the observations in GRAPH_STORE
+
+    def resolve(self):
+        if self.state.dim() == 2:
+            graph = self.graphs if self.graphs is not None else GRAPH_STORE.graphs[self.graph_handles]
+            return torch.cat((self.state, graph.to(self.state.device, self.state.dtype)), dim=0)
+        if self.graphs is not None:
+            graphs = torch.stack(self.graphs).to(self.state.device)
+        else:
+            graphs = GRAPH_STORE.get(self.graph_handles, self.state.device)
+        return torch.cat((self.state, graphs.to(self.state.dtype)), dim=-2)
+
+    def to(self, *args, **kwargs):
+        return GraphObservation(self.state.to(*args, **kwargs), self.graph_handles, self.graphs)
+
+    def float(self):
+        return GraphObservation(self.state.float(), self.graph_handles, self.graphs)
+
+    def __getitem__(self, item):
+        return self.state[item]
+
+    @property
+    def shape(self):
+        return self.state.shape
+
+    @staticmethod
+    def stack(observations):
+        state = torch.stack([obs.state for obs in observations])
+        graph_handles = [obs.graph_handles for obs in observations]
+        graphs = [obs.graphs for obs in observations]
+        return GraphObservation(state, graph_handles, None if any(graph is None for graph in graphs) else graphs)
+
+
+def as_observation(obs):
+    return obs if isinstance(obs, GraphObservation) else torch.as_tensor(obs)
+
+
+def stack_observations(observations):
+    if isinstance(observations[0], GraphObservation):
+        return GraphObservation.stack(observations)
+    return torch.stack([as_observation(obs) for obs in observations])
+
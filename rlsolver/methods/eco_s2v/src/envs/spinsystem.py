@@ -3,6 +3,7 @@ from collections import namedtuple
 from operator import matmul
 
 import numpy as np
+import torch
 import torch.multiprocessing as mp
 
 from rlsolver.methods.eco_s2v.src.envs.util_envs import (EdgeType,
@@ -15,6 +16,7 @@ from rlsolver.methods.eco_s2v.src.envs.util_envs import (EdgeType,
                                                          GraphGenerator,
                                                          RandomGraphGenerator,
                                                          HistoryBuffer)
+from rlsolver.methods.eco_s2v.src.envs.graph_store import GRAPH_STORE, GraphObservation
 
 # from numba import jit, float64, int64
 
@@ -43,20 +45,21 @@ class SpinSystemFactory(object):
             reversible_spins=True,  # Whether the spins can be flipped more than once (i.e. True-->Georgian MDP).
             init_snap=None,
             seed=None,
-            if_greedy=False):
+            if_greedy=False,
+            graph_handle_obs=False):  # Whether the observation is a GraphObservation instead of a dense matrix.
 
         if graph_generator.biased:
             return SpinSystemBiased(graph_generator, max_steps,
                                     observables, reward_signal, extra_action, optimisation_target, spin_basis,
                                     norm_rewards, memory_length, horizon_length, stag_punishment, basin_reward,
                                     reversible_spins,
-                                    init_snap, seed)
+                                    init_snap, seed, graph_handle_obs)
         else:
             return SpinSystemUnbiased(graph_generator, max_steps,
                                       observables, reward_signal, extra_action, optimisation_target, spin_basis,
                                       norm_rewards, memory_length, horizon_length, stag_punishment, basin_reward,
                                       reversible_spins,
-                                      init_snap, seed)
+                                      init_snap, seed, graph_handle_obs)
 
 
 class SpinSystemBase(ABC):
@@ -96,7 +99,8 @@ class SpinSystemBase(ABC):
                  basin_reward=None,
                  reversible_spins=False,
                  init_snap=None,
-                 seed=None):
+                 seed=None,
+                 graph_handle_obs=False):
         '''
         Init method.
 
@@ -108,6 +112,8 @@ class SpinSystemBase(ABC):
                           beyond simply flipping spins.
             init_snap: Optional snapshot to load spin system into pre-configured state for MCTS.
             seed: Optional random seed.
+            graph_handle_obs: Whether the observation is a GraphObservation, the node features and the handle of the
+                              graph in GRAPH_STORE, instead of the node features stacked on the adjacency matrix.
         '''
 
         if seed != None:
@@ -161,6 +167,9 @@ class SpinSystemBase(ABC):
         self.basin_reward = basin_reward
         self.reversible_spins = reversible_spins
 
+        self.graph_handle_obs = graph_handle_obs
+        self.graph_matrix = None  # The matrix of self.graph_handle, a new graph gets a new handle.
+
         self.reset()
 
         self.score = self.calculate_score()
@@ -235,6 +244,13 @@ class SpinSystemBase(ABC):
             else:
                 self.bias_obs = self.bias
 
+        if self.graph_handle_obs and self.graph_matrix is not self.matrix:
+            # The graph rows of the observation are kept once per graph, the observations refer to them by handle.
+            self.graph_matrix = self.matrix
+            self.graph_handle = GRAPH_STORE.new_handle()
+            graph_obs = np.vstack((self.matrix_obs, self.bias_obs)) if self.gg.biased else self.matrix_obs
+            self.graph_obs = torch.as_tensor(graph_obs)
+
     def _reset_state(self, spins=None):
         state = np.zeros((self.observation_space.shape[1], self.n_actions))
 
@@ -487,6 +503,8 @@ class SpinSystemBase(ABC):
             # convert {1,-1} --> {0,1}
             state[0, :] = (1 - state[0, :]) / 2
 
+        if self.graph_handle_obs:
+            return GraphObservation(torch.as_tensor(state), self.graph_handle, self.graph_obs)
         if self.gg.biased:
             obs = np.vstack((state, self.matrix_obs, self.bias_obs))
             return obs
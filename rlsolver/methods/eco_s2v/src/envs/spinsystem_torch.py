@@ -4,7 +4,6 @@ from operator import matmul
 
 import numpy as np
 import torch
-import torch.multiprocessing as mp
 from numba import jit
 
 from rlsolver.methods.eco_s2v.config import *
@@ -18,11 +17,39 @@ from rlsolver.methods.eco_s2v.src.envs.util_envs_torch import (EdgeType,
                                                                GraphGenerator,
                                                                RandomGraphGenerator,
                                                                HistoryBuffer)
+from rlsolver.methods.eco_s2v.src.envs.graph_store import GRAPH_STORE, GraphObservation
 
 # A container for get_result function below. Works just like tuple, but prettier.
 ActionResult = namedtuple("action_result", ("snapshot", "observation", "reward", "is_done", "info"))
 
 
+def calculate_best_brute(matrix, bias=None, i0=0, i_max=None, chunk_size=2 ** 16):
+    """
+    The lowest energy -s^T W s / 2 - s^T b and its signed spins over the spin states i0 <= i < i_max, where the bits
+    of i are the spins of node 0 (the highest bit) to node n-1, and a bit 0 is the spin -1.
+    The states are tried in chunks of chunk_size as batched tensors. If i_max is None, all the 2^n states are tried,
+    or only the half with spin -1 at node 0 for an unbiased system, since its E(s) == E(-s).
+    """
+    matrix = torch.as_tensor(matrix, dtype=torch.float64)
+    bias = None if bias is None else torch.as_tensor(bias, dtype=torch.float64, device=matrix.device)
+    n_spins = matrix.shape[0]
+    if i_max is None:
+        i_max = 2 ** n_spins if bias is not None else 2 ** (n_spins - 1)
+    shifts = torch.arange(n_spins - 1, -1, -1, device=matrix.device)
+
+    best_energy, best_spins = float('inf'), None
+    for i in range(int(i0), int(i_max), chunk_size):
+        ids = torch.arange(i, min(i + chunk_size, int(i_max)), device=matrix.device)
+        spins = ((ids.unsqueeze(1) >> shifts) & 1).to(torch.float64) * 2 - 1
+        energies = -(torch.matmul(spins, matrix) * spins).sum(dim=1) / 2
+        if bias is not None:
+            energies -= torch.matmul(spins, bias)
+        energy, idx = energies.min(dim=0)  # the first of the lowest, like a sequential search
+        if energy.item() < best_energy:
+            best_energy, best_spins = energy.item(), spins[idx]
+    return best_energy, best_spins
+
+
 class SpinSystemFactory(object):
     '''
     Factory class for returning new SpinSystem.
@@ -44,20 +71,21 @@ class SpinSystemFactory(object):
             reversible_spins=True,  # Whether the spins can be flipped more than once (i.e. True-->Georgian MDP).
             init_snap=None,
             seed=None,
-            if_greedy=False):
+            if_greedy=False,
+            graph_handle_obs=False):  # Whether the observation is a GraphObservation instead of a dense matrix.
 
         if graph_generator.biased:
             return SpinSystemBiased(graph_generator, max_steps,
                                     observables, reward_signal, extra_action, optimisation_target, spin_basis,
                                     norm_rewards, memory_length, horizon_length, stag_punishment, basin_reward,
                                     reversible_spins,
-                                    init_snap, seed)
+                                    init_snap, seed, graph_handle_obs)
         else:
             return SpinSystemUnbiased(graph_generator, max_steps,
                                       observables, reward_signal, extra_action, optimisation_target, spin_basis,
                                       norm_rewards, memory_length, horizon_length, stag_punishment, basin_reward,
                                       reversible_spins,
-                                      init_snap, seed)
+                                      init_snap, seed, graph_handle_obs)
 
 
 class SpinSystemBase(ABC):
@@ -97,7 +125,8 @@ class SpinSystemBase(ABC):
                  basin_reward=None,
                  reversible_spins=False,
                  init_snap=None,
-                 seed=None):
+                 seed=None,
+                 graph_handle_obs=False):
         '''
         Init method.
 
@@ -109,6 +138,8 @@ class SpinSystemBase(ABC):
                           beyond simply flipping spins.
             init_snap: Optional snapshot to load spin system into pre-configured state for MCTS.
             seed: Optional random seed.
+            graph_handle_obs: Whether the observation is a GraphObservation, the node features and the handle of the
+                              graph in GRAPH_STORE, instead of the node features stacked on the adjacency matrix.
         '''
 
         if seed != None:
@@ -162,6 +193,9 @@ class SpinSystemBase(ABC):
         self.basin_reward = basin_reward
         self.reversible_spins = reversible_spins
 
+        self.graph_handle_obs = graph_handle_obs
+        self.graph_matrix = None  # The matrix of self.graph_handle, a new graph gets a new handle.
+
         self.reset()
 
         self.score = self.calculate_score()
@@ -236,6 +270,15 @@ class SpinSystemBase(ABC):
             else:
                 self.bias_obs = self.bias
 
+        if self.graph_handle_obs and self.graph_matrix is not self.matrix:
+            # The graph rows of the observation are kept once per graph, the observations refer to them by handle.
+            self.graph_matrix = self.matrix
+            self.graph_handle = GRAPH_STORE.new_handle()
+            if self.gg.biased:
+                self.graph_obs = torch.cat((self.matrix_obs, self.bias_obs.unsqueeze(0)), dim=0)
+            else:
+                self.graph_obs = self.matrix_obs
+
     def _reset_state(self, spins=None):
         state = torch.zeros(self.observation_space.shape[1], self.n_actions, device=self.device)
 
@@ -274,50 +317,27 @@ class SpinSystemBase(ABC):
         return spins
 
     def calculate_best_energy(self):
-        if self.n_spins <= 10:
-            # Generally, for small systems the time taken to start multiple processes is not worth it.
-            res = self.calculate_best_brute()
-
+        # All the spin states are tried as batched tensors, which is faster than a pool of processes.
+        if self.optimisation_target == OptimisationTarget.CUT:
+            # The maximum cut is the ground state of -matrix.
+            res = calculate_best_brute(-torch.as_tensor(self.matrix), self.bias)
         else:
-            # Start up processing pool
-            n_cpu = int(mp.cpu_count()) / 2
-
-            pool = mp.Pool(mp.cpu_count())
-
-            # Split up state trials across the number of cpus
-            iMax = 2 ** (self.n_spins)
-            args = np.round(np.linspace(0, np.ceil(iMax / n_cpu) * n_cpu, n_cpu + 1))
-            arg_pairs = [list(args) for args in zip(args, args[1:])]
-
-            # Try all the states.
-            #             res = pool.starmap(self._calc_over_range, arg_pairs)
-            try:
-                res = pool.starmap(self._calc_over_range, arg_pairs)
-                # Return the best solution,
-                idx_best = np.argmin([e for e, s in res])
-                res = res[idx_best]
-            except Exception as e:
-                # Falling back to single-thread implementation.
-                # res = self.calculate_best_brute()
-                res = self._calc_over_range(0, 2 ** (self.n_spins))
-            finally:
-                # No matter what happens, make sure we tidy up after outselves.
-                pool.close()
+            res = calculate_best_brute(self.matrix, self.bias)
 
-            if self.spin_basis == SpinBasis.BINARY:
-                # convert {1,-1} --> {0,1}
-                best_score, best_spins = res
-                best_spins = (1 - best_spins) / 2
-                res = best_score, best_spins
-
-            if self.optimisation_target == OptimisationTarget.CUT:
-                best_energy, best_spins = res
-                best_cut = self.calculate_cut(best_spins)
-                res = best_cut, best_spins
-            elif self.optimisation_target == OptimisationTarget.ENERGY:
-                pass
-            else:
-                raise NotImplementedError()
+        if self.spin_basis == SpinBasis.BINARY:
+            # convert {1,-1} --> {0,1}
+            best_score, best_spins = res
+            best_spins = (1 - best_spins) / 2
+            res = best_score, best_spins
+
+        if self.optimisation_target == OptimisationTarget.CUT:
+            best_energy, best_spins = res
+            best_cut = self.calculate_cut(best_spins)
+            res = best_cut, best_spins
+        elif self.optimisation_target == OptimisationTarget.ENERGY:
+            pass
+        else:
+            raise NotImplementedError()
 
         return res
 
@@ -495,6 +515,8 @@ class SpinSystemBase(ABC):
             # convert {1,-1} --> {0,1}
             state[0, :] = (1 - state[0, :]) / 2
 
+        if self.graph_handle_obs:
+            return GraphObservation(state, self.graph_handle, self.graph_obs)
         if self.gg.biased:
             return torch.cat((state, self.matrix_obs, self.bias_obs), dim=0)
         else:
@@ -616,12 +638,7 @@ class SpinSystemUnbiased(SpinSystemBase):
             raise NotImplementedError("Can't return best cut when optimisation target is set to energy.")
 
     def _calc_over_range(self, i0, iMax):
-        list_spins = [2 * np.array([int(x) for x in list_string]) - 1
-                      for list_string in
-                      [list(np.binary_repr(i, width=self.n_spins))
-                       for i in range(int(i0), int(iMax))]]
-        matrix = self.matrix.astype('float64')
-        return self.__calc_over_range_jit(list_spins, matrix)
+        return calculate_best_brute(self.matrix, None, i0, iMax)
 
     @staticmethod
     # @jit(float64(float64[:],float64[:,:],int64), nopython=True)
@@ -638,19 +655,6 @@ class SpinSystemUnbiased(SpinSystemBase):
     def _calculate_energy_jit(spins, matrix):
         return - torch.matmul(spins.T, torch.matmul(matrix, spins)) / 2
 
-    @staticmethod
-    def __calc_over_range(list_spins, matrix):
-        # 初始化高能值
-        energy = float('inf')  # 代替 1e50
-        best_spins = None
-        for spins in list_spins:
-            spins = torch.tensor(spins, dtype=torch.float64)
-            current_energy = -torch.matmul(spins.T, torch.matmul(matrix, spins)) / 2
-            if current_energy < energy:
-                energy = current_energy
-                best_spins = spins.clone()
-        return energy, best_spins
-
     @staticmethod
     def _get_immediate_energies_available(spins, matrix):
         spins = torch.tensor(spins, dtype=torch.float)
@@ -682,13 +686,7 @@ class SpinSystemBiased(SpinSystemBase):
         raise NotImplementedError("MaxCut not defined/implemented for biased SpinSystems.")
 
     def _calc_over_range(self, i0, iMax):
-        list_spins = [2 * np.array([int(x) for x in list_string]) - 1
-                      for list_string in
-                      [list(np.binary_repr(i, width=self.n_spins))
-                       for i in range(int(i0), int(iMax))]]
-        matrix = self.matrix.astype('float64')
-        bias = self.bias.astype('float64')
-        return self.__calc_over_range_jit(list_spins, matrix, bias)
+        return calculate_best_brute(self.matrix, self.bias, i0, iMax)
 
     @staticmethod
     @jit(nopython=True)
@@ -705,21 +703,6 @@ class SpinSystemBiased(SpinSystemBase):
     def _calculate_energy_jit(spins, matrix, bias):
         return matmul(spins.T, matmul(matrix, spins)) / 2 + matmul(spins.T, bias)
 
-    @staticmethod
-    @jit(parallel=True)
-    def __calc_over_range_jit(list_spins, matrix, bias):
-        energy = 1e50
-        best_spins = None
-
-        for spins in list_spins:
-            spins = spins.astype('float64')
-            # This is self._calculate_energy_jit without calling to the class or self so jit can do its thing.
-            current_energy = -(matmul(spins.T, matmul(matrix, spins)) / 2 + matmul(spins.T, bias))
-            if current_energy < energy:
-                energy = current_energy
-                best_spins = spins
-        return energy, best_spins
-
     @staticmethod
     @jit(nopython=True)
     def _get_immeditate_energies_avaialable_jit(spins, matrix, bias):
@@ -729,3 +712,403 @@ class SpinSystemBiased(SpinSystemBase):
     @jit(nopython=True)
     def _get_immeditate_cuts_avaialable_jit(spins, matrix, bias):
         raise NotImplementedError("MaxCut not defined/implemented for biased SpinSystems.")
+
+
+class SpinSystemVec(SpinSystemBase):
+    '''
+    n_envs independent unbiased SpinSystems stepped at the same time as batched tensors, one graph and one episode
+    per env. Env b draws its graphs from graph_generators[b % len(graph_generators)].
+
+    The graphs may have different numbers of spins. They are padded with 0 to the largest n_spins, and the extra action
+    is the last action n_max_spins of every env. The padded spins are 0 in all observables, and their actions are
+    False in get_action_mask(). An action of a padded spin does nothing.
+
+    The local fields matrix @ spins are updated with the weight matrix row of each flipped spin, so a step is
+    O(n_envs * n_spins) instead of the O(n_envs * n_spins^2) of a matmul. The observation is
+    (n_envs, n_observables + n_actions, n_actions), so the network does one forward for all the envs.
+    Note that the mean pooling of MPNN includes the padded spins, so the same graphs are batched for exact Q values.
+    '''
+
+    def __init__(self,
+                 graph_generators,
+                 n_envs=1,
+                 max_steps=20,
+                 observables=DEFAULT_OBSERVABLES,
+                 reward_signal=RewardSignal.DENSE,
+                 extra_action=ExtraAction.PASS,
+                 optimisation_target=OptimisationTarget.ENERGY,
+                 spin_basis=SpinBasis.SIGNED,
+                 norm_rewards=False,
+                 memory_length=None,  # None means an infinite memory.
+                 horizon_length=None,  # None means an infinite horizon.
+                 stag_punishment=None,
+                 basin_reward=None,
+                 reversible_spins=False,
+                 seed=None,
+                 graph_handle_obs=False,
+                 device=None):
+        if seed != None:
+            np.random.seed(seed)
+            torch.manual_seed(seed)
+
+        assert observables[0] == Observable.SPIN_STATE, "First observable must be Observation.SPIN_STATE."
+        self.ggs = graph_generators if isinstance(graph_generators, (list, tuple)) else [graph_generators]
+        assert all(isinstance(gg, GraphGenerator) for gg in self.ggs), \
+            "graph_generators must be GraphGenerator implementations."
+        if any(gg.biased for gg in self.ggs):
+            raise NotImplementedError("SpinSystemVec is not implemented for biased SpinSystems.")
+        self.gg = self.ggs[0]
+
+        self.observables = list(enumerate(observables))
+        self.device = TRAIN_DEVICE if device is None else device
+        self.extra_action = extra_action
+        self.n_envs = n_envs
+        self.env_ids = torch.arange(n_envs, device=self.device)
+
+        self.n_max_spins = max(gg.n_spins for gg in self.ggs)
+        self.n_spins = self.n_max_spins
+        self.max_steps = max_steps
+        self.reward_signal = reward_signal
+        self.norm_rewards = norm_rewards
+
+        self.n_actions = self.n_max_spins
+        if extra_action != ExtraAction.NONE:
+            self.n_actions += 1
+        self.action_space = self.action_space(self.n_actions)
+        self.observation_space = self.observation_space(self.n_max_spins, len(self.observables))
+
+        self.optimisation_target = optimisation_target
+        self.spin_basis = spin_basis
+        # The immediate reward of flipping spin i is reward_coef * s_i * (W s)_i.
+        self.reward_coef = 1. if optimisation_target == OptimisationTarget.CUT else -2.
+
+        self.memory_length = memory_length
+        self.horizon_length = horizon_length if horizon_length is not None else self.max_steps
+        self.stag_punishment = stag_punishment
+        self.basin_reward = basin_reward
+        self.reversible_spins = reversible_spins
+        self.graph_handle_obs = graph_handle_obs
+        self.bias = None
+
+        n_envs, n_max, device = self.n_envs, self.n_max_spins, self.device
+        self.matrix_obs = torch.zeros((n_envs, self.n_actions, self.n_actions), device=device)
+        self.matrix = self.matrix_obs[:, :n_max, :n_max]  # a view, the padded rows and columns are 0
+        self.n_spins_per_env = torch.zeros(n_envs, dtype=torch.long, device=device)
+        self.spin_mask = torch.zeros((n_envs, n_max), dtype=torch.bool, device=device)
+        self.action_mask = torch.zeros((n_envs, self.n_actions), dtype=torch.bool, device=device)
+        self.max_local_reward_available = torch.ones(n_envs, device=device)
+        self.graph_obs = [None] * n_envs
+        self.graph_handles = [None] * n_envs
+
+        self.state = torch.zeros((n_envs, len(self.observables), self.n_actions), device=device)
+        self.fields = torch.zeros((n_envs, n_max), device=device)
+        self.current_step = torch.zeros(n_envs, dtype=torch.long, device=device)
+        self.score = torch.zeros(n_envs, device=device)
+        self.init_score = torch.zeros(n_envs, device=device)
+        self.best_score = torch.zeros(n_envs, device=device)
+        self.best_obs_score = torch.zeros(n_envs, device=device)
+        self.best_spins = torch.zeros((n_envs, n_max), device=device)
+        self.best_obs_spins = torch.zeros((n_envs, n_max), device=device)
+        if self.memory_length is not None:
+            self.score_memory = torch.zeros((n_envs, self.memory_length), device=device)
+            self.spins_memory = torch.zeros((n_envs, self.memory_length, n_max), device=device)
+            self.idx_memory = torch.zeros(n_envs, dtype=torch.long, device=device)
+        if self.stag_punishment is not None or self.basin_reward is not None:
+            # A visited state is the hash of its spins, an episode visits at most max_steps + 1 states.
+            self.hash_weights = torch.randint(-2 ** 62, 2 ** 62, (n_max,), device=device)
+            self.visited_hashes = torch.zeros((n_envs, self.max_steps + 1), dtype=torch.long, device=device)
+            self.n_visited = torch.zeros(n_envs, dtype=torch.long, device=device)
+
+        self.reset()
+
+    def _load_graphs(self, env_ids):
+        for b in env_ids.tolist():
+            gg = self.ggs[b % len(self.ggs)]
+            while True:
+                matrix = torch.as_tensor(gg.get(), dtype=torch.float, device=self.device)
+                local_rewards_available = self.reward_coef * matrix.sum(dim=1)  # the rewards when all spins are 1
+                local_rewards_available = local_rewards_available[local_rewards_available != 0]
+                if local_rewards_available.numel() > 0:
+                    break  # else we've generated an empty graph, this is pointless, try again.
+            n_spins = matrix.shape[0]
+            self.matrix_obs[b] = 0
+            self.matrix_obs[b, :n_spins, :n_spins] = matrix
+            self.n_spins_per_env[b] = n_spins
+            self.max_local_reward_available[b] = local_rewards_available.max()
+
+            if self.graph_handle_obs:
+                self.graph_obs[b] = self.matrix_obs[b].clone()
+                self.graph_handles[b] = GRAPH_STORE.new_handle()
+
+        spin_ids = torch.arange(self.n_max_spins, device=self.device)
+        self.spin_mask[env_ids] = spin_ids < self.n_spins_per_env[env_ids].unsqueeze(1)
+        self.action_mask[env_ids, :self.n_max_spins] = self.spin_mask[env_ids]
+        self.action_mask[env_ids, self.n_max_spins:] = True
+
+    def reset(self, env_ids=None, spins=None):
+        """
+        Reset the envs of env_ids (all envs if None) with new graphs, and return the observation of all envs.
+        """
+        env_ids = self.env_ids if env_ids is None else torch.as_tensor(env_ids, dtype=torch.long, device=self.device)
+        self._load_graphs(env_ids)
+        spin_mask = self.spin_mask[env_ids].float()
+
+        state = torch.zeros((env_ids.shape[0], len(self.observables), self.n_actions), device=self.device)
+        if spins is None:
+            if self.reversible_spins:
+                # For reversible spins, initialise randomly to {+1,-1}.
+                state[:, 0, :self.n_max_spins] = (2 * torch.randint(0, 2, spin_mask.shape, device=self.device) - 1) * spin_mask
+            else:
+                # For irreversible spins, initialise all to +1 (i.e. allowed to be flipped).
+                state[:, 0, :self.n_max_spins] = spin_mask
+        else:
+            spins = torch.as_tensor(self._format_spins_to_signed(spins), dtype=torch.float, device=self.device)
+            state[:, 0, :self.n_max_spins] = spins.reshape(spin_mask.shape) * spin_mask
+        spins = state[:, 0, :self.n_max_spins]
+
+        self.fields[env_ids] = torch.matmul(self.matrix[env_ids], spins.unsqueeze(-1)).squeeze(-1)
+        immediate_rewards_available = self.reward_coef * spins * self.fields[env_ids]
+        for idx, obs in self.observables:
+            if obs == Observable.IMMEDIATE_REWARD_AVAILABLE:
+                state[:, idx, :self.n_max_spins] = (immediate_rewards_available
+                                                    / self.max_local_reward_available[env_ids].unsqueeze(1))
+            elif obs == Observable.NUMBER_OF_GREEDY_ACTIONS_AVAILABLE:
+                state[:, idx, :] = self._calc_greedy_actions_available(immediate_rewards_available, env_ids)
+        self.state[env_ids] = state * self.action_mask[env_ids].unsqueeze(1)
+
+        self.current_step[env_ids] = 0
+        self.score[env_ids] = self.calculate_score()[env_ids]
+        self.init_score[env_ids] = self.score[env_ids]
+        self.best_score[env_ids] = self.score[env_ids]
+        self.best_obs_score[env_ids] = self.score[env_ids]
+        self.best_spins[env_ids] = spins
+        self.best_obs_spins[env_ids] = spins
+
+        if self.memory_length is not None:
+            self.score_memory[env_ids] = self.score[env_ids].unsqueeze(1)
+            self.spins_memory[env_ids] = spins.unsqueeze(1)
+            self.idx_memory[env_ids] = 1 % self.memory_length
+
+        if self.stag_punishment is not None or self.basin_reward is not None:
+            self.n_visited[env_ids] = 0
+
+        return self.get_observation()
+
+    def _calc_greedy_actions_available(self, immediate_rewards_available, env_ids):
+        n_bad_actions = ((immediate_rewards_available <= 0) & self.spin_mask[env_ids]).sum(dim=1)
+        return (1 - n_bad_actions.float() / self.n_spins_per_env[env_ids]).unsqueeze(1)
+
+    def _update_history(self):
+        """True if the env visits its spin state for the first time in this episode."""
+        hashes = (self._get_spins() > 0).long().mul(self.hash_weights).sum(dim=1)  # wraps around in int64
+        n_slots = torch.arange(self.max_steps + 1, device=self.device)
+        if_visited = ((self.visited_hashes == hashes.unsqueeze(1)) & (n_slots < self.n_visited.unsqueeze(1))).any(dim=1)
+        new_ids = self.env_ids[~if_visited]
+        self.visited_hashes[new_ids, self.n_visited[new_ids].clamp(max=self.max_steps)] = hashes[new_ids]
+        self.n_visited[new_ids] += 1
+        return ~if_visited
+
+    def step(self, actions):
+        actions = torch.as_tensor(actions, dtype=torch.long, device=self.device).reshape(-1)
+        env_ids = self.env_ids
+        self.current_step += 1
+
+        if (self.current_step > self.max_steps).any():
+            raise RuntimeError("step() called after done; reset(env_ids) first")
+
+        ############################################################
+        # 1. Performs the action and calculates the score change. #
+        ############################################################
+
+        spins = self.state[:, 0, :self.n_max_spins]
+        if_flip = actions < self.n_spins_per_env
+        flip_actions = actions.clamp(max=self.n_max_spins - 1)
+
+        delta_score = torch.where(if_flip, self.get_immeditate_rewards_avaialable()[env_ids, flip_actions], 0.)
+        new_spins = torch.where(if_flip, -spins[env_ids, flip_actions], spins[env_ids, flip_actions])
+        spins[env_ids, flip_actions] = new_spins
+        # (W s)_j changes by 2 * s_a * W_aj when spin a is flipped to s_a.
+        self.fields += (2 * new_spins * if_flip).unsqueeze(1) * self.matrix[env_ids, flip_actions]
+
+        if_randomise = (actions == self.n_max_spins) & (self.extra_action == ExtraAction.RANDOMISE)
+        if if_randomise.any():
+            # Randomise the spin configuration.
+            random_ids = env_ids[if_randomise]
+            random_actions = 2 * torch.randint(0, 2, (random_ids.shape[0], self.n_max_spins), device=self.device) - 1
+            spins[random_ids] *= random_actions
+            self.fields[random_ids] = torch.matmul(self.matrix[random_ids], spins[random_ids].unsqueeze(-1)).squeeze(-1)
+            delta_score[random_ids] = self.calculate_score()[random_ids] - self.score[random_ids]
+        self.score += delta_score
+
+        #############################################################################################
+        # 2. Calculate reward for action and update anymemory buffers.                              #
+        #   a) Calculate reward (always w.r.t best observable score).                              #
+        #   b) If new global best has been found: update best ever score and spin parameters.      #
+        #   c) If the memory buffer is finite (i.e. self.memory_length is not None):                #
+        #          - Add score/spins to their respective buffers.                                  #
+        #          - Update best observable score and spins w.r.t. the new buffers.                #
+        #      else (if the memory is infinite):                                                    #
+        #          - If new best has been found: update best observable score and spin parameters. #
+        #############################################################################################
+
+        immediate_rewards_available = self.get_immeditate_rewards_avaialable()
+
+        done = self.current_step == self.max_steps
+        if not self.reversible_spins:
+            # If no more spins to flip --> done.
+            done |= ~((spins > 0) & self.spin_mask).any(dim=1)
+
+        rew = torch.zeros(self.n_envs, device=self.device)
+        improvement = self.score - self.best_obs_score
+        if self.reward_signal == RewardSignal.BLS:
+            rew = improvement.clamp(min=0)
+        elif self.reward_signal == RewardSignal.CUSTOM_BLS:
+            rew = torch.where(improvement > 0, improvement / (improvement + 0.1), 0.)
+
+        if self.reward_signal == RewardSignal.DENSE:
+            rew = delta_score.clone()
+        elif self.reward_signal == RewardSignal.SINGLE:
+            rew = torch.where(done, self.score - self.init_score, 0.)
+
+        if self.norm_rewards:
+            rew /= self.n_spins_per_env
+
+        if self.stag_punishment is not None or self.basin_reward is not None:
+            visiting_new_state = self._update_history()
+
+        if self.stag_punishment is not None:
+            rew -= self.stag_punishment * (~visiting_new_state)
+
+        if self.basin_reward is not None:
+            # All immediate score changes are +ive <--> we are in a local minima.
+            if_basin = (immediate_rewards_available <= 0).all(dim=1) & visiting_new_state
+            rew += self.basin_reward * if_basin
+
+        if_better = self.score > self.best_score
+        self.best_score = torch.where(if_better, self.score, self.best_score)
+        self.best_spins = torch.where(if_better.unsqueeze(1), spins, self.best_spins)
+
+        if self.memory_length is not None:
+            self.score_memory[env_ids, self.idx_memory] = self.score
+            self.spins_memory[env_ids, self.idx_memory] = spins
+            self.idx_memory = (self.idx_memory + 1) % self.memory_length
+            self.best_obs_score, idx_best = self.score_memory.max(dim=1)
+            self.best_obs_spins = self.spins_memory[env_ids, idx_best]
+        else:
+            self.best_obs_score = self.best_score.clone()
+            self.best_obs_spins = self.best_spins.clone()
+
+        #############################################################################################
+        # 3. Updates the state of the system (except self.state[:,0,:] as this is always the spin   #
+        #    configuration and has already been done.                                               #
+        #   a) Update self.state local features to reflect the chosen action.                       #
+        #   b) Update global features in self.state (always w.r.t. best observable score/spins)     #
+        #############################################################################################
+
+        for idx, observable in self.observables:
+
+            ### Local observables ###
+            if observable == Observable.IMMEDIATE_REWARD_AVAILABLE:
+                self.state[:, idx, :self.n_max_spins] = (immediate_rewards_available
+                                                         / self.max_local_reward_available.unsqueeze(1))
+
+            elif observable == Observable.TIME_SINCE_FLIP:
+                self.state[:, idx, :] += (1. / self.max_steps)
+                self.state[env_ids[if_flip], idx, actions[if_flip]] = 0
+                if if_randomise.any():
+                    self.state[random_ids, idx, :self.n_max_spins] *= (random_actions > 0)
+
+            ### Global observables ###
+            elif observable == Observable.EPISODE_TIME:
+                self.state[:, idx, :] += (1. / self.max_steps)
+
+            elif observable == Observable.TERMINATION_IMMANENCY:
+                # Update 'Immanency of episode termination'
+                immanency = ((self.current_step - self.max_steps) / self.horizon_length + 1).clamp(min=0)
+                self.state[:, idx, :] = immanency.unsqueeze(1)
+
+            elif observable == Observable.NUMBER_OF_GREEDY_ACTIONS_AVAILABLE:
+                self.state[:, idx, :] = self._calc_greedy_actions_available(immediate_rewards_available, env_ids)
+
+            elif observable == Observable.DISTANCE_FROM_BEST_SCORE:
+                self.state[:, idx, :] = (torch.abs(self.score - self.best_obs_score)
+                                         / self.max_local_reward_available).unsqueeze(1)
+
+            elif observable == Observable.DISTANCE_FROM_BEST_STATE:
+                self.state[:, idx, :self.n_max_spins] = torch.count_nonzero(
+                    self.best_obs_spins - spins, dim=1).unsqueeze(1).float()
+
+        self.state *= self.action_mask.unsqueeze(1)  # the padded spins stay 0
+
+        return (self.get_observation(), rew, done, None)
+
+    def get_observation(self):
+        state = self.state.clone()
+        if self.spin_basis == SpinBasis.BINARY:
+            # convert {1,-1} --> {0,1}
+            state[:, 0, :] = (1 - state[:, 0, :]) / 2 * self.action_mask
+
+        if self.graph_handle_obs:
+            return GraphObservation(state, list(self.graph_handles), list(self.graph_obs))
+        return torch.cat((state, self.matrix_obs), dim=1)
+
+    def get_action_mask(self):
+        """True for the actions of the real spins and the extra action, shape == (n_envs, n_actions)."""
+        return self.action_mask.clone()
+
+    def _get_spins(self, basis=SpinBasis.SIGNED):
+        return self.state[:, 0, :self.n_max_spins]
+
+    def get_immeditate_rewards_avaialable(self, spins=None):
+        if spins is None:
+            return self.reward_coef * self._get_spins() * self.fields
+        return self.reward_coef * spins * torch.matmul(self.matrix, spins.unsqueeze(-1)).squeeze(-1)
+
+    def calculate_best_energy(self):
+        best_energies = torch.zeros(self.n_envs, dtype=torch.float64)
+        best_spins = torch.zeros((self.n_envs, self.n_max_spins), dtype=torch.float64)
+        sign = -1 if self.optimisation_target == OptimisationTarget.CUT else 1  # the maximum cut is the ground state of -matrix
+        for b, n_spins in enumerate(self.n_spins_per_env.tolist()):
+            best_energies[b], best_spins[b, :n_spins] = calculate_best_brute(sign * self.matrix[b, :n_spins, :n_spins])
+        best_energies, best_spins = best_energies.to(self.device), best_spins.to(self.device)
+
+        if self.optimisation_target == OptimisationTarget.CUT:
+            best_scores = self.calculate_cut(best_spins.float())
+        else:
+            best_scores = best_energies
+        if self.spin_basis == SpinBasis.BINARY:
+            # convert {1,-1} --> {0,1}
+            best_spins = (1 - best_spins) / 2 * self.spin_mask
+        return best_scores, best_spins
+
+    def calculate_energy(self, spins=None):
+        if spins is None:
+            spins, fields = self._get_spins(), self.fields
+        else:
+            fields = torch.matmul(self.matrix, spins.unsqueeze(-1)).squeeze(-1)
+        return -(spins * fields).sum(dim=-1) / 2
+
+    def calculate_cut(self, spins=None):
+        if spins is None:
+            spins, fields = self._get_spins(), self.fields
+        else:
+            fields = torch.matmul(self.matrix, spins.unsqueeze(-1)).squeeze(-1)
+        return (self.matrix.sum(dim=(1, 2)) - (spins * fields).sum(dim=-1)) / 4
+
+    def get_best_cut(self):
+        if self.optimisation_target == OptimisationTarget.CUT:
+            return self.best_score
+        else:
+            raise NotImplementedError("Can't return best cut when optimisation target is set to energy.")
+
+    def _calc_over_range(self, i0, iMax):
+        return [calculate_best_brute(self.matrix[b, :n_spins, :n_spins], None, i0, iMax)
+                for b, n_spins in enumerate(self.n_spins_per_env.tolist())]
+
+    def _calculate_energy_change(self, new_spins, matrix, action):
+        flipped_spins = new_spins[self.env_ids, action]
+        return -2 * flipped_spins * (new_spins * matrix[self.env_ids, action]).sum(dim=-1)
+
+    def _calculate_cut_change(self, new_spins, matrix, action):
+        flipped_spins = new_spins[self.env_ids, action]
+        return -1 * flipped_spins * (new_spins * matrix[self.env_ids, action]).sum(dim=-1)
@@ -9,7 +9,7 @@ from rlsolver.methods.eco_s2v.src.envs.util_envs import (SingleGraphGenerator,
                                                          RewardSignal, ExtraAction,
                                                          OptimisationTarget, SpinBasis,
                                                          DEFAULT_OBSERVABLES, Observable)
-from rlsolver.methods.eco_s2v.src.networks.mpnn import MPNN
+from rlsolver.methods.eco_s2v.src.networks.mpnn import MPNN, SparseMPNN
 from rlsolver.methods.eco_s2v.util import test_network, load_graph_set_from_txt
 from rlsolver.methods.util import calc_txt_files_with_prefixes
 from rlsolver.methods.util_result import write_graph_result
@@ -33,7 +33,7 @@ def run(save_loc="BA_40spin/eco",
     # NETWORK SETUP
     ####################################################
 
-    network_fn = MPNN
+    network_fn = SparseMPNN if USE_SPARSE_MPNN_IN_INFERENCE else MPNN
     network_args = {
         'n_layers': 3,
         'n_features': 64,
@@ -15,7 +15,7 @@ from rlsolver.methods.eco_s2v.src.envs.util_envs_eeco import (SetGraphGenerator,
 from rlsolver.methods.eco_s2v.src.envs.util_envs import (RewardSignal, ExtraAction,
                                                          OptimisationTarget, SpinBasis,
                                                          DEFAULT_OBSERVABLES)
-from rlsolver.methods.eco_s2v.src.networks.mpnn import MPNN
+from rlsolver.methods.eco_s2v.src.networks.mpnn import MPNN, SparseMPNN
 
 from rlsolver.methods.util_result import write_graph_result
 from rlsolver.methods.eco_s2v.config import *
@@ -30,7 +30,7 @@ def run(graph_folder="../../data/syn_BA",
 
     print("Testing network: ", network_save_path)
 
-    network_fn = MPNN
+    network_fn = SparseMPNN if USE_SPARSE_MPNN_IN_INFERENCE else MPNN
     network_args = {
         'n_layers': 3,
         'n_features': 64,
@@ -47,7 +47,8 @@ def run(save_loc):
                 'stag_punishment': None,
                 # 'basin_reward':1./200,
                 'basin_reward': 1. / NUM_TRAIN_NODES,
-                'reversible_spins': True}
+                'reversible_spins': True,
+                'graph_handle_obs': True}
 
     ####################################################
     # SET UP TRAINING AND TEST GRAPHS
@@ -44,7 +44,8 @@ def run(save_loc):
                 'horizon_length': None,
                 'stag_punishment': None,
                 'basin_reward': None,
-                'reversible_spins': False}
+                'reversible_spins': False,
+                'graph_handle_obs': True}
 
     ####################################################
     # SET UP TRAINING AND TEST GRAPHS
@@ -10,6 +10,7 @@ os.environ['KMP_DUPLICATE_LIB_OK']='True'
 import copy
 import time
 import numpy as np
+import torch as th
 import networkx as nx
 from rlsolver.methods.config import *
 
@@ -25,6 +26,10 @@ from rlsolver.methods.util_read_data import (read_nxgraph,
                                             )
 from rlsolver.methods.util_obj import (obj_maxcut,
                                         )
+from rlsolver.methods.util_move import (MaxcutMoveGains,
+                                        )
+from rlsolver.methods.simulated_annealing_batch import (build_graph_annealer,
+                                                        )
 from rlsolver.methods.util_result import (write_graph_result,
                                          )
 
@@ -33,6 +38,17 @@ P_iter = 100
 MaxIter = 10000
 gamma = 65
 
+# constants for the genetic algorithm
+pop_size = 10
+num_parents = 5
+num_children = 4  # the children of a generation, their tabu searches run at the same time
+c_itMax = 5  # the number of generations
+
+
+def solution_key(binary_vector) -> bytes:
+    # the hashable key of a solution, for the set of the population
+    return np.packbits(np.asarray(binary_vector, dtype=np.uint8)).tobytes()
+
 
 def generate_random(graph):
     nodes = list(graph.nodes())
@@ -43,21 +59,26 @@ def generate_random(graph):
 def generate_random_population(graph, pop_size):
     count = 1
     Pop = []
+    pop_keys = set()
     best_binary_vector = []
     score_list = []
     best_score = 0
+    num_nodes = graph.number_of_nodes()
     while len(Pop) < pop_size:
-        binary_vector, result = generate_random(graph)
-        score = result
-
-        if binary_vector not in Pop:
-            score_list.append(score)
-            Pop.append(binary_vector)
-            print(count, "Score: ", score)
-            count += 1
-            if score > best_score:
-                best_score = score
-                best_binary_vector = binary_vector
+        # the tabu searches of the missing members run at the same time
+        init_solutions = np.random.randint(0, 2, size=(pop_size - len(Pop), num_nodes))
+        binary_vectors, scores = tabu_search_batch(init_solutions, graph)
+        for binary_vector, score in zip(binary_vectors, scores):
+            key = solution_key(binary_vector)
+            if key not in pop_keys:
+                pop_keys.add(key)
+                score_list.append(score)
+                Pop.append(binary_vector)
+                print(count, "Score: ", score)
+                count += 1
+                if score > best_score:
+                    best_score = score
+                    best_binary_vector = binary_vector
     return Pop, best_binary_vector, best_score, score_list
 
 
@@ -71,32 +92,6 @@ def tenure(iteration, maxT):
     return a[interval]
 
 
-def compute_move_gains(graph, vector, tabu_list):
-    move_gains = []
-    for i in range(len(vector)):
-        delta_v = 0
-        neighbor_nodes = list(graph.neighbors(i))
-        for j in neighbor_nodes:
-            if vector[i] == vector[j]:
-                delta_v += float(graph[i][j]["weight"])
-            else:
-                delta_v -= float(graph[i][j]["weight"])
-        move_gains.append(delta_v)
-
-    return move_gains
-
-
-def update_move_gains(node_flipped, move_gains, vector, graph):
-    neighbors = list(graph.neighbors(node_flipped))
-    for i in neighbors:
-        if vector[i] == vector[node_flipped]:
-            move_gains[i] += 2 * float(graph[i][node_flipped]["weight"])
-        else:
-            move_gains[i] -= 2 * float(graph[i][node_flipped]["weight"])
-    move_gains[node_flipped] = -move_gains[node_flipped]
-    return move_gains
-
-
 def perturb(binary_vector):
     # randomly select gamma vertices to move
     vertices_to_move = random.sample(range(len(binary_vector)), gamma)
@@ -112,79 +107,124 @@ def tabu_search(initial_solution, graph):
     # initialize best solution and its score
     best_solution = initial_solution
     best_score = obj_maxcut(initial_solution, graph)
-    curr_solution = copy.deepcopy(initial_solution)
-    curr_score = best_score
+    # the move gains are updated incrementally after each flip
+    moves = MaxcutMoveGains(graph, initial_solution)
     # initialize iteration counter
     Iter = 0
     pit = 0
 
     # initialize tabu list and tabu tenure
-    tabu_list = [0] * len(curr_solution)
+    tabu_list = np.zeros(len(initial_solution), dtype=np.int64)
     maxT = 150
 
-    # compute move gains
-    move_gains = compute_move_gains(graph, curr_solution, tabu_list)
     while Iter < MaxIter:
-        v = 0
-        delta_v = -999999
-        for i in range(0, len(move_gains)):
-            if delta_v < move_gains[i] and tabu_list[i] <= Iter:
-                delta_v = move_gains[i]
-                v = i
+        # the non-tabu vertex with the largest move gain
+        v = moves.best_move(is_allowed=tabu_list <= Iter)
+        if v is None:
+            v = moves.best_move()
 
         # move v from its original subset to the opposite set
-        curr_solution[v] = 1 - curr_solution[v]
-        curr_score += delta_v
-        # print("Current ",curr_score)
-        # print("Actual ",obj_maxcut(curr_solution,graph))
-        # update tabu list and move gains for each vertex v ∈ V
+        moves.flip(v)
+        # update tabu list for each vertex v ∈ V
         tabu_list[v] = maxT + Iter
-        move_gains = update_move_gains(v, move_gains, curr_solution, graph)
 
         # update best solution if current solution is better
-        if curr_score > best_score:
-            best_solution = copy.deepcopy(curr_solution)
-            best_score = curr_score
+        if moves.score > best_score:
+            best_solution = moves.solution.tolist()
+            best_score = moves.score
             pit = 0
 
         # increment iteration counter
         Iter += 1
         pit += 1
         # check if best solution hasn't improved after P_iter iterations
-        if pit == P_iter and curr_score <= best_score:
+        if pit == P_iter and moves.score <= best_score:
             pit = 0
-            curr_solution = perturb(curr_solution)
-            curr_score = obj_maxcut(curr_solution, graph)
-            tabu_list = [0] * len(curr_solution)
-            move_gains = compute_move_gains(graph, curr_solution, tabu_list)
+            curr_solution = perturb(moves.solution.tolist())
+            tabu_list[:] = 0
+            moves = MaxcutMoveGains(graph, curr_solution)
 
     return best_solution, best_score
 
 
+def tabu_search_batch(initial_solutions, graph, device=None):
+    """`tabu_search()` of many initial solutions at the same time, shape == (num_solutions, num_nodes).
+    The gains of all searches are a tensor, updated by the local fields of the QUBO form of maxcut after each flip.
+    Ties are broken by the smaller node index, the same as `tabu_search()`."""
+    xs = th.as_tensor(np.array(initial_solutions), dtype=th.int8, device=device)
+    num_solutions, num_nodes = xs.shape
+    searches = build_graph_annealer(graph, xs, Problem.maxcut)
+    chain_ids = searches.chain_ids
+
+    best_solutions = searches.xs.clone()
+    best_scores = searches.scores.clone()
+    tabu_list = th.zeros((num_solutions, num_nodes), dtype=th.int64, device=searches.device)
+    pits = th.zeros(num_solutions, dtype=th.int64, device=searches.device)
+    maxT = 150
+
+    for Iter in range(MaxIter):
+        # the non-tabu vertex with the largest move gain, or the best vertex if all vertices are tabu
+        gains = (1 - 2 * searches.xs.float()) * (searches.linears + searches.fields)
+        if_tabu = tabu_list > Iter
+        masked_gains = gains.masked_fill(if_tabu, -np.inf)
+        v = th.where(if_tabu.all(1), gains.argmax(1), masked_gains.argmax(1))
+
+        # move v from its original subset to the opposite set, and update the tabu list
+        searches.scores += gains[chain_ids, v]
+        searches.flip(chain_ids, v)
+        tabu_list[chain_ids, v] = maxT + Iter
+
+        # update best solutions if current solutions are better
+        if_better = searches.scores > best_scores
+        best_scores[if_better] = searches.scores[if_better]
+        best_solutions[if_better] = searches.xs[if_better]
+        pits = th.where(if_better, 0, pits) + 1
+
+        # perturb the searches which have not improved after P_iter iterations
+        if_perturb = pits == P_iter
+        if if_perturb.any():
+            perturb_ids = chain_ids[if_perturb]
+            # randomly select gamma vertices of each search to move
+            ranks = th.argsort(th.rand((perturb_ids.shape[0], num_nodes), device=searches.device), dim=1)
+            searches.reset_chains(perturb_ids, searches.xs[perturb_ids] ^ (ranks < gamma).to(th.int8))
+            tabu_list[perturb_ids] = 0
+            pits[perturb_ids] = 0
+
+    best_solutions = best_solutions.tolist()
+    best_scores = [obj_maxcut(solution, graph) for solution in best_solutions]  # the exact scores
+    return best_solutions, best_scores
+
 
 def cross_over(population, graph):
-    selected_parents = random.sample(population, num_parents)
+    return cross_over_batch(population, graph, num=1)[0]
 
-    child = []
-    for node in range(0, len(selected_parents[0])):
-        node_in_same_set = all(parent[node] == selected_parents[0][node] for parent in selected_parents)
 
-        if node_in_same_set:
-            child.append(selected_parents[0][node])
-        else:
-            child.append(random.randint(0, 1))
-    child, child_score = tabu_search(child, graph)
-    return child
+def cross_over_batch(population, graph, num):
+    # the nodes in the same set of all selected parents are kept, the other nodes are random
+    children = []
+    for _ in range(num):
+        selected_parents = np.array(random.sample(population, num_parents))
+        node_in_same_set = (selected_parents == selected_parents[0]).all(0)
+        child = np.where(node_in_same_set, selected_parents[0], np.random.randint(0, 2, selected_parents.shape[1]))
+        children.append(child)
+    children, children_scores = tabu_search_batch(children, graph)
+    return children
 
 
 def genetic_maxcut(graph: nx.Graph(), filename):
     start_time = time.time()
-    population, best_binary_vector, best_score, population_scores = generate_random_population(graph, 10)
+    population, best_binary_vector, best_score, population_scores = generate_random_population(graph, pop_size)
+    pop_keys = {solution_key(binary_vector) for binary_vector in population}
+    print(f"population: {time.time() - start_time:.3f}s")
     c_iter = 0
     print("Start Genetic Crossover")
     while c_iter < c_itMax:
-        child = cross_over(population, graph)
-        if (child not in population):
+        generation_start_time = time.time()
+        children = cross_over_batch(population, graph, num_children)
+        for child in children:
+            key = solution_key(child)
+            if key in pop_keys:
+                continue
             child_score = obj_maxcut(child, graph)
 
             print(c_iter + 1, " Childs Score: ", child_score)
@@ -192,9 +232,13 @@ def genetic_maxcut(graph: nx.Graph(), filename):
             # Finding the min score in the list and replacing it with the child if smaller than child cut
             min_score_index = np.argmin(population_scores)
             if (population_scores[min_score_index] < child_score):
+                pop_keys.discard(solution_key(population[min_score_index]))
+                pop_keys.add(key)
                 population_scores[min_score_index] = child_score
                 population[min_score_index] = child
-            c_iter += 1
+        print(f"generation {c_iter + 1}: {time.time() - generation_start_time:.3f}s, "
+              f"best score: {max(population_scores)}")
+        c_iter += 1
 
     max_score_index = np.argmax(population_scores)
     obj = population_scores[max_score_index]
@@ -225,10 +269,6 @@ def run_genetic_over_multiple_files(directory_data: str, prefixes: List[str])->
 
 
 if __name__ == '__main__':
-    # Constants
-    num_parents = 5
-    c_itMax = 5
-
     if_run_one_case = False
     if if_run_one_case:
         # read data
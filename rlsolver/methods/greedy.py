@@ -26,6 +26,11 @@ from rlsolver.methods.util_obj import (cover_all_edges,
                   obj_set_cover_ratio,
                   obj_set_cover,
                   obj_graph_coloring,)
+from rlsolver.methods.util_move import (MaxcutMoveGains,
+                                        PartitionSwapGains,
+                                        VertexCoverMoveGains,
+                                        IndependentSetMoveGains,
+                                        )
 from rlsolver.methods.util_result import (write_graph_result,
                                           )
 from rlsolver.methods.config import *
@@ -35,48 +40,37 @@ def greedy_maxcut(num_steps: Optional[int], graph: nx.Graph, filename) -> (int,
     print('greedy')
     start_time = time.time()
     num_nodes = int(graph.number_of_nodes())
-    nodes = list(range(num_nodes))
     init_solution = [0] * graph.number_of_nodes()
     assert sum(init_solution) == 0
     if num_steps is None:
         num_steps = num_nodes
-    curr_solution = copy.deepcopy(init_solution)
-    curr_score: int = obj_maxcut(curr_solution, graph)
-    init_score = curr_score
+    moves = MaxcutMoveGains(graph, init_solution)
+    init_score = moves.score
     scores = []
     for iteration in range(num_nodes):
         if iteration >= num_steps:
             break
-        score = obj_maxcut(curr_solution, graph)
-        print(f"iteration: {iteration}, score: {score}")
-        traversal_scores = []
-        traversal_solutions = []
-        # calc the new solution when moving to a new node. Then store the scores and solutions.
-        for node in nodes:
-            new_solution = copy.deepcopy(curr_solution)
-            # search a new solution and calc obj
-            new_solution[node] = (new_solution[node] + 1) % 2
-            new_score = obj_maxcut(new_solution, graph)
-            traversal_scores.append(new_score)
-            traversal_solutions.append(new_solution)
-        best_score = max(traversal_scores)
-        index = traversal_scores.index(best_score)
-        best_solution = traversal_solutions[index]
-        if best_score > curr_score:
-            scores.append(best_score)
-            curr_score = best_score
-            curr_solution = best_solution
+        print(f"iteration: {iteration}, score: {moves.score}")
+        # the node with the largest gain of flipping
+        node = moves.best_move()
+        if node is not None and moves.gains[node] > 0:
+            moves.flip(node)
+            scores.append(moves.score)
         else:
             break
+    curr_score = moves.score
+    curr_solution = moves.solution.tolist()
     print("init_score, final score of greedy", init_score, curr_score, )
-    print("scores: ", traversal_scores)
+    print("scores: ", scores)
     print("solution: ", curr_solution)
     running_duration = time.time() - start_time
     print('running_duration: ', running_duration)
     alg_name = "greedy"
-    write_graph_result(score, running_duration, num_nodes, alg_name, curr_solution, filename)
+    if filename is not None:
+        write_graph_result(curr_score, running_duration, num_nodes, alg_name, curr_solution, filename)
     return curr_score, curr_solution, scores
 
+
 def greedy_graph_partitioning(num_steps:Optional[int], graph: nx.Graph) -> (int, Union[List[int], np.array], List[int]):
     print('greedy')
     init_solution = [0] * int(graph.number_of_nodes() / 2) + [1] * int(graph.number_of_nodes() / 2)
@@ -84,37 +78,21 @@ def greedy_graph_partitioning(num_steps:Optional[int], graph: nx.Graph) -> (int,
     if num_steps is None:
         num_steps = num_nodes
     start_time = time.time()
-    nodes = list(range(num_nodes))
-    curr_solution = copy.deepcopy(init_solution)
-    curr_score: int = obj_graph_partitioning(curr_solution, graph)
-    init_score = curr_score
+    if len(init_solution) < num_nodes:  # an odd number of nodes, the last node is in part 1
+        init_solution.append(1)
+    moves = PartitionSwapGains(graph, init_solution)
+    init_score: int = obj_graph_partitioning(init_solution, graph)
     scores = []
     for i in range(num_steps):
-        node1 = nodes[i]
-        traversal_scores = []
-        traversal_solutions = []
-        for j in range(i + 1, num_steps):
-            node2 = nodes[j]
-            if curr_solution[node1] == curr_solution[node2]:
-                continue
-            new_solution = copy.deepcopy(curr_solution)
-            tmp = new_solution[node1]
-            new_solution[node1] = new_solution[node2]
-            new_solution[node2] = tmp
-            new_score = obj_graph_partitioning(new_solution, graph)
-            traversal_scores.append(new_score)
-            traversal_solutions.append(new_solution)
-        if len(traversal_scores) == 0:
-            continue
-        best_score = max(traversal_scores)
-        index = traversal_scores.index(best_score)
-        best_solution = traversal_solutions[index]
-        if best_score > curr_score:
-            scores.append(best_score)
-            curr_score = best_score
-            curr_solution = best_solution
+        # swap the pair of nodes in different parts with the largest gain
+        node0, node1, gain = moves.best_swap()
+        if node0 is not None and gain > 0:
+            moves.swap(node0, node1)
+            scores.append(moves.score)
         else:
             break
+    curr_solution = moves.solution.tolist()
+    curr_score = obj_graph_partitioning(curr_solution, graph)
     print("init_score, final score of greedy", init_score, curr_score, )
     print("scores: ", scores)
     print("solution: ", curr_solution)
@@ -130,30 +108,20 @@ def greedy_minimum_vertex_cover(num_steps: int, graph: nx.Graph) -> (int, Union[
     assert num_steps is None
     start_time = time.time()
     num_nodes = int(graph.number_of_nodes())
-    nodes = list(range(num_nodes))
-    curr_solution = copy.deepcopy(init_solution)
-    curr_score: int = obj_minimum_vertex_cover(curr_solution, graph)
-    init_score = curr_score
+    moves = VertexCoverMoveGains(graph, init_solution)
+    init_score: int = obj_minimum_vertex_cover(init_solution, graph)
     scores = []
     iter = 0
-    unselected_nodes = list(graph.nodes())
-    while True:
-        cover_all = cover_all_edges(curr_solution, graph)
-        if cover_all:
+    while moves.num_uncovered > 0:
+        # select the unselected node which covers the most uncovered edges
+        node = moves.best_move(is_allowed=moves.solution == 0)
+        if node is None:
             break
-        max_degree = 0
-        best_node = -INF
-        for node in unselected_nodes:
-            degree = graph.degree(node)
-            if degree > max_degree:
-                max_degree = degree
-                best_node = node
-        if max_degree > 0:
-            curr_solution[best_node] = 1
-            unselected_nodes.remove(best_node)
+        moves.flip(node)
         iter += 1
         if iter > num_nodes:
             break
+    curr_solution = moves.solution.tolist()
     curr_score = obj_minimum_vertex_cover(curr_solution, graph)
     print("score, init_score", curr_score, init_score)
     print("solution: ", curr_solution)
@@ -161,60 +129,31 @@ def greedy_minimum_vertex_cover(num_steps: int, graph: nx.Graph) -> (int, Union[
     print('running_duration: ', running_duration)
     return curr_score, curr_solution, scores
 
+
 def greedy_maximum_independent_set(num_steps: Optional[int], graph: nx.Graph) -> (int, Union[List[int], np.array], List[int]):
-    def calc_candidate_nodes(unselected_nodes: List[int], selected_nodes: List[int], graph: nx.Graph):
-        candidate_nodes = []
-        remove_nodes = set()
-        for node1, node2 in graph.edges():
-            if node1 in selected_nodes:
-                remove_nodes.add(node2)
-            elif node2 in selected_nodes:
-                remove_nodes.add(node1)
-        for node in unselected_nodes:
-            if node not in remove_nodes:
-                candidate_nodes.append(node)
-        return candidate_nodes
     print('greedy')
     num_nodes = int(graph.number_of_nodes())
-    nodes = list(range(num_nodes))
     init_solution = [0] * num_nodes
     if num_steps is None:
         num_steps = num_nodes
     start_time = time.time()
-    curr_solution = copy.deepcopy(init_solution)
-    curr_score: int = obj_maximum_independent_set(curr_solution, graph)
+    moves = IndependentSetMoveGains(graph, init_solution)
+    curr_score: int = obj_maximum_independent_set(init_solution, graph)
     init_score = curr_score
     scores = []
-    selected_nodes = []
-    unselected_nodes = copy.deepcopy(nodes)
-    candidate_graph = copy.deepcopy(graph)
-    # extend_candidate_graph = copy.deepcopy(graph)
     step = 0
     while True:
         step += 1
-        candidate_nodes = calc_candidate_nodes(unselected_nodes, selected_nodes, graph)
-        if len(candidate_nodes) == 0:
-            break
-        min_degree = num_nodes
-        selected_node = None
-        for node in candidate_nodes:
-            degree = candidate_graph.degree(node)
-            if degree < min_degree:
-                min_degree = degree
-                selected_node = node
-        if selected_node is None:
+        # a candidate node has no selected neighbor, so its gain is 1. The candidate with the min degree is selected
+        selected_node = moves.best_move()
+        if selected_node is None or moves.gains[selected_node] <= 0:
             break
-        else:
-            selected_nodes.append(selected_node)
-            unselected_nodes.remove(selected_node)
-            candidate_graph.remove_node(selected_node)
-            curr_solution[selected_node] = 1
-            # curr_score2 = obj_maximum_independent_set(curr_solution, graph)
-            curr_score += 1
-            # assert curr_score == curr_score2
-            scores.append(curr_score)
+        moves.flip(selected_node)
+        curr_score += 1
+        scores.append(curr_score)
         if step > num_steps:
             break
+    curr_solution = moves.solution.tolist()
     curr_score2 = obj_maximum_independent_set(curr_solution, graph)
     assert curr_score == curr_score2
     print("init_score, final score of greedy", init_score, curr_score, )
@@ -224,6 +163,7 @@ def greedy_maximum_independent_set(num_steps: Optional[int], graph: nx.Graph) ->
     print('running_duration: ', running_duration)
     return curr_score, curr_solution, scores
 
+
 def greedy_set_cover(num_items: int, num_sets: int, item_matrix: List[List[int]]) -> (int, Union[List[int], np.array], List[int]):
     print('greedy')
     start_time = time.time()
@@ -72,4 +72,33 @@ def mh_step(log_prob, current_sample, new_sample):
     return (
         torch.where(expanded_use_new_sample, new_sample, current_sample),
         use_new_sample,
-    )
\ No newline at end of file
+    )
+
+def build_adjacency(edge_from, edge_to, num_nodes):
+    # 对称的稀疏邻接矩阵，A[i, j] 是边 (i, j) 的数量，自环计两次，使得 A @ x 就是能量函数对 x 的梯度中的邻居求和
+    rows = torch.cat((edge_from, edge_to))
+    cols = torch.cat((edge_to, edge_from))
+    values = torch.ones(rows.shape[0], device=edge_from.device)
+    adjacency = torch.sparse_coo_tensor(torch.stack((rows, cols)), values, size=(num_nodes, num_nodes),
+                                        check_invariants=True).coalesce()
+
+    # 每个点的邻居表，shape=(num_nodes, max_degree)，用该点自身和权重 0 补齐
+    rows, cols = adjacency.indices()
+    degrees = torch.bincount(rows, minlength=num_nodes)
+    max_degree = max(int(degrees.max()), 1) if rows.shape[0] > 0 else 1
+    offsets = torch.arange(rows.shape[0], device=rows.device) - (torch.cumsum(degrees, dim=0) - degrees)[rows]
+    nbr_ids = torch.arange(num_nodes, device=rows.device).unsqueeze(1).repeat(1, max_degree)
+    nbr_weights = torch.zeros((num_nodes, max_degree), device=rows.device)
+    nbr_ids[rows, offsets] = cols
+    nbr_weights[rows, offsets] = adjacency.values()
+    return adjacency, nbr_ids, nbr_weights
+
+
+def add_flip_deltas(fields, nbr_ids, nbr_weights, deltas):
+    # fields = A @ x 的增量更新：fields += deltas @ A，只遍历 deltas 中非零的点（被翻转的点）的邻居
+    fields = fields.clone()
+    batch_ids, node_ids = deltas.nonzero(as_tuple=True)
+    ids = nbr_ids[node_ids]
+    values = deltas[batch_ids, node_ids].unsqueeze(1).to(fields.dtype) * nbr_weights[node_ids].to(fields.dtype)
+    fields.index_put_((batch_ids.unsqueeze(1).expand_as(ids), ids), values, accumulate=True)
+    return fields
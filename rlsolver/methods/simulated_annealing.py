@@ -28,6 +28,11 @@ from rlsolver.methods.util_obj import (
                   obj_set_cover,
                   obj_graph_coloring,
                       )
+from rlsolver.methods.util_move import (MaxcutMoveGains,
+                                        PartitionSwapGains,
+                                        VertexCoverMoveGains,
+                                        IndependentSetMoveGains,
+                                        )
 from rlsolver.methods.greedy import (greedy_maxcut,
                     greedy_graph_partitioning,
                     greedy_minimum_vertex_cover,
@@ -133,6 +138,16 @@ def simulated_annealing(init_temperature: int, num_steps: Optional[int], graph:
     init_score = gr_score
     curr_solution = copy.deepcopy(gr_solution)
     curr_score = gr_score
+    # the gains of the moves are updated incrementally, instead of evaluating the objective of each new solution
+    moves = None
+    if PROBLEM == Problem.maxcut:
+        moves = MaxcutMoveGains(graph, gr_solution, if_heap=False)
+    elif PROBLEM == Problem.graph_partitioning:
+        moves = PartitionSwapGains(graph, gr_solution, if_heap=False)
+    elif PROBLEM == Problem.minimum_vertex_cover:
+        moves = VertexCoverMoveGains(graph, gr_solution, if_heap=False)
+    elif PROBLEM == Problem.maximum_independent_set:
+        moves = IndependentSetMoveGains(graph, gr_solution, penalty=INF, if_heap=False)
     # if PROBLEM == Problem.maximum_independent_set:
     #     curr_score = gr_score / graph.number_of_edges()
     scores = []
@@ -141,71 +156,57 @@ def simulated_annealing(init_temperature: int, num_steps: Optional[int], graph:
     for k in range(num_steps):
         # The temperature decreases
         temperature = init_temperature * (1 - (k + 1) / num_steps)
-        new_solution = copy.deepcopy(curr_solution)
-        if PROBLEM == Problem.maxcut:
-            idx = np.random.randint(0, num_nodes)
-            new_solution[idx] = (new_solution[idx] + 1) % 2
-            new_score = obj_maxcut(new_solution, graph)
-        elif PROBLEM == Problem.graph_partitioning:
-            while True:
+        if moves is not None:
+            if PROBLEM == Problem.maxcut:
                 idx = np.random.randint(0, num_nodes)
-                node2 = np.random.randint(0, num_nodes)
-                if new_solution[idx] != new_solution[node2]:
-                    break
-            print(f"new_solution[index]: {new_solution[idx]}, new_solution[index2]: {new_solution[node2]}")
-            tmp = new_solution[idx]
-            new_solution[idx] = new_solution[node2]
-            new_solution[node2] = tmp
-            new_score = obj_graph_partitioning(new_solution, graph)
-        elif PROBLEM == Problem.minimum_vertex_cover:
-            iter = 0
-            index = None
-            while True:
-                iter += 1
-                if iter >= num_steps:
-                    break
-                indices_eq_1 = []
-                for i in range(len(new_solution)):
-                    if new_solution[i] == 1:
-                        indices_eq_1.append(i)
-                idx = np.random.randint(0, len(indices_eq_1))
-                new_solution2 = copy.deepcopy(new_solution)
-                new_solution2[indices_eq_1[idx]] = 0
-                if cover_all_edges(new_solution2, graph):
-                    index = indices_eq_1[idx]
-                    break
-            if index is not None:
-                new_solution[index] = 0
-            new_score = obj_minimum_vertex_cover(new_solution, graph, False)
-        elif PROBLEM == Problem.maximum_independent_set:
-            selected_indices = []
-            unselected_indices = []
-            for i in range(len(new_solution)):
-                if new_solution[i] == 1:
-                    selected_indices.append(i)
-                else:
-                    unselected_indices.append(i)
-            idx_out = np.random.randint(0, len(selected_indices))
-            node_out = selected_indices[idx_out]
-            new_solution[node_out] = (new_solution[node_out] + 1) % 2
-            # if prob < prob_thresh, change one node; if prob > prob_thresh, change two nodes
-            prob_thresh = 0.05
-            prob = random.random()
-            if prob < prob_thresh:
-                idx_in = np.random.randint(0, len(unselected_indices))
-                node_in = unselected_indices[idx_in]
-                new_solution[node_in] = (new_solution[node_in] + 1) % 2
-            else:
+                flipped_nodes = [idx]
+            elif PROBLEM == Problem.graph_partitioning:
                 while True:
-                    node1, node2 = np.random.randint(0, len(unselected_indices), 2)
-                    if node1 != node2:
+                    idx = np.random.randint(0, num_nodes)
+                    node2 = np.random.randint(0, num_nodes)
+                    if moves.solution[idx] != moves.solution[node2]:
                         break
-                node_in1 = unselected_indices[node1]
-                node_in2 = unselected_indices[node2]
-                new_solution[node_in1] = (new_solution[node_in1] + 1) % 2
-                new_solution[node_in2] = (new_solution[node_in2] + 1) % 2
-            new_score = obj_maximum_independent_set(new_solution, graph)
-        elif PROBLEM == Problem.graph_coloring:
+                flipped_nodes = [idx, node2]
+            elif PROBLEM == Problem.minimum_vertex_cover:
+                # unselect a node which keeps all edges covered
+                removable_nodes = moves.removable_nodes()
+                flipped_nodes = [np.random.choice(removable_nodes)] if len(removable_nodes) > 0 else []
+            else:  # PROBLEM == Problem.maximum_independent_set
+                selected_indices = np.flatnonzero(moves.solution == 1)
+                unselected_indices = np.flatnonzero(moves.solution == 0)
+                node_out = selected_indices[np.random.randint(0, len(selected_indices))]
+                # if prob < prob_thresh, change one node; if prob > prob_thresh, change two nodes
+                prob_thresh = 0.05
+                prob = random.random()
+                if prob < prob_thresh:
+                    node_in = unselected_indices[np.random.randint(0, len(unselected_indices))]
+                    flipped_nodes = [node_out, node_in]
+                else:
+                    while True:
+                        node1, node2 = np.random.randint(0, len(unselected_indices), 2)
+                        if node1 != node2:
+                            break
+                    flipped_nodes = [node_out, unselected_indices[node1], unselected_indices[node2]]
+            if PROBLEM == Problem.graph_partitioning:
+                delta_e = -moves.swap_gain(*flipped_nodes)
+            elif len(flipped_nodes) == 1:
+                delta_e = -moves.gains[flipped_nodes[0]]
+            else:
+                prev_score = moves.score
+                for node in flipped_nodes:
+                    moves.flip(node)
+                delta_e = prev_score - moves.score
+                for node in flipped_nodes[::-1]:
+                    moves.flip(node)
+            if delta_e < 0 or np.exp(-delta_e / (temperature + 1e-6)) > random.random():
+                for node in flipped_nodes:
+                    moves.flip(node)
+                curr_score -= delta_e
+                scores.append(curr_score)
+            continue
+
+        new_solution = copy.deepcopy(curr_solution)
+        if PROBLEM == Problem.graph_coloring:
             while True:
                 node1, node2 = np.random.randint(0, num_nodes, 2)
                 if node1 != node2:
@@ -234,6 +235,8 @@ def simulated_annealing(init_temperature: int, num_steps: Optional[int], graph:
             #     scores.append(tmp_new_score)
             # else:
             #     scores.append(new_score)
+    if moves is not None:
+        curr_solution = moves.solution.tolist()
     print("init_score, final score of simulated_annealing", init_score, curr_score)
     print("scores: ", scores)
     print("solution: ", curr_solution)
@@ -0,0 +1,392 @@
+import sys
+import os
+cur_path = os.path.dirname(os.path.abspath(__file__))
+rlsolver_path = os.path.join(cur_path, '../../rlsolver')
+sys.path.append(os.path.dirname(rlsolver_path))
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+import math
+import time
+from typing import Union, Optional, List, Tuple
+import numpy as np
+import torch as th
+import networkx as nx
+
+from rlsolver.methods.util import get_graph_arrays
+from rlsolver.methods.util_read_data import (read_nxgraph,
+                                             read_set_cover_data, )
+from rlsolver.methods.util_result import (write_graph_result,
+                                          write_result_set_cover
+                                          )
+from rlsolver.methods.util_obj import (obj_maxcut_batch,
+                                       obj_graph_partitioning_batch,
+                                       obj_minimum_vertex_cover_batch,
+                                       obj_maximum_independent_set_batch,
+                                       )
+from rlsolver.methods.config import *
+
+TEN = th.Tensor
+
+'''temperature schedules'''
+
+
+def calc_temperatures(num_steps: int, init_temperature: Union[float, TEN], final_temperature: Union[float, TEN] = 0.,
+                      schedule: str = 'linear') -> TEN:
+    """the temperature of each step, shape == (num_steps, ) or (num_steps, num_chains) if the temperatures are tensors.
+
+    linear: the same as `simulated_annealing()`, from init_temperature down to final_temperature
+    exponential: geometric cooling, final_temperature must be positive (1e-3 * init_temperature if it is 0)
+    cosine: a slow start and a slow end
+    """
+    init_temperature = th.as_tensor(init_temperature, dtype=th.float32)
+    final_temperature = th.as_tensor(final_temperature, dtype=th.float32)
+    progress = (th.arange(num_steps, dtype=th.float32) + 1) / num_steps
+    if init_temperature.ndim or final_temperature.ndim:
+        progress = progress.unsqueeze(1)  # a temperature for each chain
+
+    if schedule == 'linear':
+        return final_temperature + (init_temperature - final_temperature) * (1 - progress)
+    elif schedule == 'exponential':
+        final_temperature = th.where(final_temperature > 0, final_temperature, init_temperature * 1e-3)
+        return init_temperature * (final_temperature / init_temperature) ** progress
+    elif schedule == 'cosine':
+        return final_temperature + (init_temperature - final_temperature) * 0.5 * (1 + th.cos(math.pi * progress))
+    raise ValueError(f"| calc_temperatures() unknown schedule: {schedule}")
+
+
+'''engines'''
+
+
+class BatchAnnealer:
+    num_flips = 1  # the number of nodes flipped by a move
+
+    def __init__(self, xs: TEN):
+        """simulated annealing of `num_chains` independent chains on the 0/1 solutions `xs`, shape == (num_chains, num_nodes).
+
+        All chains propose a move at each step. The gains of the moves are computed from a state which is updated
+        incrementally after each accepted move, so a step costs O(num_chains * max_degree) instead of
+        evaluating the objective of num_chains solutions. The best solution of each chain is tracked in `best_xs`.
+        """
+        self.num_chains, self.num_nodes = xs.shape
+        self.device = xs.device
+        self.chain_ids = th.arange(self.num_chains, device=self.device)
+        self.xs = xs.to(th.int8).clone()
+
+        self.init_state()
+        self.scores = self.calc_scores()
+        self.best_scores = self.scores.clone()
+        self.best_xs = self.xs.clone()
+
+    '''override these methods in subclasses'''
+
+    def init_state(self):
+        pass
+
+    def calc_scores(self) -> TEN:
+        raise NotImplementedError
+
+    def propose(self) -> TEN:
+        """the nodes flipped by the move of each chain, shape == (num_chains, num_flips)"""
+        return th.randint(self.num_nodes, size=(self.num_chains, 1), device=self.device)
+
+    def calc_gains(self, nodes: TEN) -> TEN:
+        """the score gains of flipping `nodes` of each chain, shape == (num_chains, )"""
+        raise NotImplementedError
+
+    def flip(self, chain_ids: TEN, nodes: TEN):
+        """flip `nodes[i]` of chain `chain_ids[i]`, and update the state"""
+        raise NotImplementedError
+
+    def accept(self, if_accept: TEN, nodes: TEN):
+        chain_ids = self.chain_ids[if_accept]
+        for i in range(self.num_flips):
+            self.flip(chain_ids, nodes[if_accept, i])
+
+    '''annealing'''
+
+    def step(self, temperature: TEN):
+        nodes = self.propose()
+        gains = self.calc_gains(nodes)
+        # accept the move with probability min(1, exp(gain / temperature)), the same rule as `simulated_annealing()`
+        if_accept = th.rand(self.num_chains, device=self.device) < th.exp(gains / (temperature + 1e-6))
+        if not if_accept.any():
+            return
+        self.accept(if_accept, nodes)
+        self.scores += gains * if_accept
+
+        if_better = self.scores > self.best_scores
+        if if_better.any():
+            self.best_scores[if_better] = self.scores[if_better]
+            self.best_xs[if_better] = self.xs[if_better]
+
+    def run(self, num_steps: int, init_temperature: Union[float, TEN], final_temperature: Union[float, TEN] = 0.,
+            schedule: str = 'linear') -> TEN:
+        """run `num_steps` steps, return the best score among the chains of each step"""
+        temperatures = calc_temperatures(num_steps, init_temperature, final_temperature, schedule).to(self.device)
+        best_scores = th.empty(num_steps, dtype=th.float32, device=self.device)
+        for k in range(num_steps):
+            self.step(temperatures[k])
+            best_scores[k] = self.best_scores.max()
+        return best_scores
+
+
+class QuboAnnealer(BatchAnnealer):
+    def __init__(self, xs: TEN, linears: TEN, srcs: TEN, dsts: TEN, weights: TEN, constant: float = 0.):
+        """score = constant + sum_i linears[i] * x_i + sum_(i, j) weights[(i, j)] * x_i * x_j, edges without self-loops.
+
+        `fields[k, i]` = sum_j weights[(i, j)] * xs[k, j], so the gain of flipping x_i is (1 - 2 * x_i) * (linears[i] + fields[k, i]).
+        The neighbors are saved in a table of shape (num_nodes, max_degree), padded with the node itself and a 0 weight.
+        """
+        num_nodes = xs.shape[1]
+        device = xs.device
+        self.linears = linears.to(device, th.float32)
+        self.constant = constant
+        self.sparse = th.sparse_coo_tensor(th.stack((th.cat((srcs, dsts)), th.cat((dsts, srcs)))).to(device),
+                                           th.cat((weights, weights)).to(device, th.float32),
+                                           size=(num_nodes, num_nodes), check_invariants=True).coalesce()
+
+        rows, cols = self.sparse.indices()
+        degrees = th.bincount(rows, minlength=num_nodes)
+        max_degree = max(int(degrees.max()), 1) if num_nodes else 1
+        offsets = th.arange(rows.shape[0], device=device) - (th.cumsum(degrees, dim=0) - degrees)[rows]
+        self.nbr_ids = th.arange(num_nodes, device=device).unsqueeze(1).repeat(1, max_degree)
+        self.nbr_weights = th.zeros((num_nodes, max_degree), dtype=th.float32, device=device)
+        self.nbr_ids[rows, offsets] = cols
+        self.nbr_weights[rows, offsets] = self.sparse.values()
+        super().__init__(xs)
+
+    def init_state(self):
+        self.fields = self.calc_fields(self.xs)
+
+    def calc_fields(self, xs: TEN) -> TEN:
+        return th.sparse.mm(self.sparse, xs.T.float()).T.contiguous()
+
+    def calc_scores(self) -> TEN:
+        xs = self.xs.float()
+        return self.constant + xs @ self.linears + 0.5 * (xs * self.fields).sum(1)
+
+    def reset_chains(self, chain_ids: TEN, xs: TEN):
+        """set the solutions of some chains, e.g. after many flips of a perturbation, which is cheaper than flipping"""
+        self.xs[chain_ids] = xs.to(th.int8)
+        self.fields[chain_ids] = self.calc_fields(xs)
+        xs = xs.float()
+        self.scores[chain_ids] = self.constant + xs @ self.linears + 0.5 * (xs * self.fields[chain_ids]).sum(1)
+
+    def calc_flip_gains(self, nodes: TEN) -> TEN:
+        signs = 1 - 2 * self.xs[self.chain_ids, nodes].float()
+        return signs * (self.linears[nodes] + self.fields[self.chain_ids, nodes])
+
+    def calc_gains(self, nodes: TEN) -> TEN:
+        gains = self.calc_flip_gains(nodes[:, 0])
+        if self.num_flips == 2:  # flip two nodes: the sum of the gains plus their interaction
+            node0, node1 = nodes[:, 0], nodes[:, 1]
+            weights = ((self.nbr_ids[node0] == node1.unsqueeze(1)) * self.nbr_weights[node0]).sum(1)
+            signs = (1 - 2 * self.xs[self.chain_ids, node0].float()) * (1 - 2 * self.xs[self.chain_ids, node1].float())
+            gains = gains + self.calc_flip_gains(nodes[:, 1]) + weights * signs
+        return gains
+
+    def flip(self, chain_ids: TEN, nodes: TEN):
+        signs = 1 - 2 * self.xs[chain_ids, nodes].float()
+        self.xs[chain_ids, nodes] = 1 - self.xs[chain_ids, nodes]
+        nbr_ids = self.nbr_ids[nodes]
+        self.fields.index_put_((chain_ids.unsqueeze(1).expand_as(nbr_ids), nbr_ids),
+                               self.nbr_weights[nodes] * signs.unsqueeze(1), accumulate=True)
+
+
+class PartitionAnnealer(QuboAnnealer):
+    """score = -cut. A move swaps a node of part 0 with a node of part 1, which keeps the sizes of the two parts."""
+    num_flips = 2
+
+    def init_state(self):
+        super().init_state()
+        # the nodes of part 0 are members[k, :num_zeros[k]], the nodes of part 1 are members[k, num_zeros[k]:]
+        self.members = th.argsort(self.xs, dim=1, stable=True)
+        self.num_zeros = (self.xs == 0).sum(1)
+        assert ((0 < self.num_zeros) & (self.num_zeros < self.num_nodes)).all(), "a part is empty"
+        self.positions = None
+
+    def propose(self) -> TEN:
+        rands = th.rand((self.num_chains, 2), device=self.device)
+        pos0 = (rands[:, 0] * self.num_zeros).long().clamp_max(self.num_zeros - 1)
+        pos1 = self.num_zeros + (rands[:, 1] * (self.num_nodes - self.num_zeros)).long()
+        pos1 = pos1.clamp_max(self.num_nodes - 1)
+        self.positions = th.stack((pos0, pos1), dim=1)
+        return self.members.gather(1, self.positions)
+
+    def accept(self, if_accept: TEN, nodes: TEN):
+        super().accept(if_accept, nodes)
+        chain_ids = self.chain_ids[if_accept]
+        positions = self.positions[if_accept]
+        self.members[chain_ids, positions[:, 0]] = nodes[if_accept, 1]
+        self.members[chain_ids, positions[:, 1]] = nodes[if_accept, 0]
+
+
+class SetCoverAnnealer(BatchAnnealer):
+    def __init__(self, xs: TEN, num_items: int, item_matrix: List[List[int]], penalty: float = None):
+        """score = -num_selected_sets - penalty * num_uncovered_items. `item_matrix[i]` are the items (from 1) of set i.
+
+        `counts[k, j]` is the number of selected sets which cover item j, the last column is the padding of the sets.
+        """
+        num_sets = xs.shape[1]
+        self.num_items = num_items
+        self.penalty = num_sets + 1 if penalty is None else penalty
+        max_size = max([len(items) for items in item_matrix] + [1])
+        set_items = np.full((num_sets, max_size), num_items, dtype=np.int64)
+        for i, items in enumerate(item_matrix):
+            items = np.unique(np.array(items, dtype=np.int64) - 1)
+            set_items[i, :len(items)] = items
+        self.set_items = th.as_tensor(set_items, device=xs.device)
+        super().__init__(xs)
+
+    def init_state(self):
+        self.counts = self.calc_counts(self.xs)
+
+    def calc_counts(self, xs: TEN) -> TEN:
+        counts = th.zeros((xs.shape[0], self.num_items + 1), dtype=th.int32, device=self.device)
+        chain_ids, sets = th.nonzero(xs, as_tuple=True)
+        items = self.set_items[sets]
+        counts.index_put_((chain_ids.unsqueeze(1).expand_as(items), items),
+                          th.ones_like(items, dtype=th.int32), accumulate=True)
+        return counts
+
+    def calc_num_uncovered(self, counts: TEN) -> TEN:
+        return (counts[:, :self.num_items] == 0).sum(1)
+
+    def calc_scores(self) -> TEN:
+        num_uncovered = self.calc_num_uncovered(self.counts)
+        return -self.xs.sum(1).float() - self.penalty * num_uncovered.float()
+
+    def calc_gains(self, nodes: TEN) -> TEN:
+        sets = nodes[:, 0]
+        items = self.set_items[sets]
+        counts = self.counts.gather(1, items)
+        if_item = items < self.num_items
+        if_select = self.xs[self.chain_ids, sets] == 0
+        num_new_covered = ((counts == 0) & if_item).sum(1)  # selecting a set covers these items
+        num_new_uncovered = ((counts == 1) & if_item).sum(1)  # unselecting a set uncovers these items
+        return th.where(if_select, self.penalty * num_new_covered - 1., 1. - self.penalty * num_new_uncovered)
+
+    def flip(self, chain_ids: TEN, nodes: TEN):
+        signs = 1 - 2 * self.xs[chain_ids, nodes].int()
+        self.xs[chain_ids, nodes] = 1 - self.xs[chain_ids, nodes]
+        items = self.set_items[nodes]
+        self.counts.index_put_((chain_ids.unsqueeze(1).expand_as(items), items),
+                               signs.unsqueeze(1).expand_as(items).contiguous(), accumulate=True)
+
+
+def build_graph_annealer(graph: nx.Graph, xs: TEN, problem: Problem = PROBLEM, penalty: float = None) -> QuboAnnealer:
+    """the QUBO form of a graph problem, constraints are penalized by `penalty` (num_nodes + 1 by default)"""
+    arrays = get_graph_arrays(graph)
+    num_nodes = arrays.num_nodes
+    penalty = num_nodes + 1 if penalty is None else penalty
+    if_other = arrays.srcs != arrays.dsts
+    srcs = th.as_tensor(arrays.srcs[if_other])
+    dsts = th.as_tensor(arrays.dsts[if_other])
+    weights = th.as_tensor(arrays.weights[if_other], dtype=th.float32)
+    degrees = th.as_tensor(np.bincount(arrays.srcs[if_other], minlength=num_nodes) +
+                           np.bincount(arrays.dsts[if_other], minlength=num_nodes), dtype=th.float32)
+    weighted_degrees = th.as_tensor(np.bincount(arrays.srcs[if_other], weights=arrays.weights[if_other],
+                                                minlength=num_nodes) +
+                                    np.bincount(arrays.dsts[if_other], weights=arrays.weights[if_other],
+                                                minlength=num_nodes), dtype=th.float32)
+
+    if problem == Problem.maxcut:  # cut = sum w * (x_i + x_j - 2 * x_i * x_j)
+        return QuboAnnealer(xs, weighted_degrees, srcs, dsts, -2 * weights)
+    elif problem == Problem.graph_partitioning:  # -cut
+        return PartitionAnnealer(xs, -weighted_degrees, srcs, dsts, 2 * weights)
+    elif problem == Problem.maximum_independent_set:  # num_selected - penalty * num_conflicts
+        return QuboAnnealer(xs, th.ones(num_nodes), srcs, dsts, th.full_like(weights, -penalty))
+    elif problem == Problem.minimum_vertex_cover:  # -num_selected - penalty * sum (1 - x_i) * (1 - x_j)
+        return QuboAnnealer(xs, penalty * degrees - 1, srcs, dsts, th.full_like(weights, -penalty),
+                            constant=-penalty * srcs.shape[0])
+    raise ValueError(f"| build_graph_annealer() unsupported problem: {problem}")
+
+
+def calc_init_xs(num_chains: int, num_nodes: int, init_solution=None, if_balanced: bool = False, device=None) -> TEN:
+    """all chains start from `init_solution`, or from random solutions (random balanced partitions if `if_balanced`)"""
+    if init_solution is not None:
+        init_x = th.as_tensor(np.array(init_solution), dtype=th.int8, device=device).reshape(1, num_nodes)
+        return init_x.repeat(num_chains, 1)
+    if if_balanced:
+        ranks = th.argsort(th.rand((num_chains, num_nodes), device=device), dim=1)
+        return (ranks >= num_nodes // 2).to(th.int8)
+    return th.randint(2, size=(num_chains, num_nodes), dtype=th.int8, device=device)
+
+
+'''solvers'''
+
+
+def simulated_annealing_batch(init_temperature: Union[float, TEN], num_steps: Optional[int], graph: nx.Graph,
+                              num_chains: int = 1024, final_temperature: float = 0., schedule: str = 'linear',
+                              init_solution=None, problem: Problem = PROBLEM, penalty: float = None, device=None) \
+        -> (float, List[int], List[float]):
+    """run `num_chains` chains of simulated annealing at the same time, return the best solution of all chains.
+    `init_temperature` can be a tensor of shape (num_chains, ) to anneal the chains at different temperatures."""
+    print('simulated_annealing_batch')
+    start_time = time.time()
+    num_nodes = graph.number_of_nodes()
+    num_steps = num_nodes if num_steps is None else num_steps
+    xs = calc_init_xs(num_chains, num_nodes, init_solution, if_balanced=problem == Problem.graph_partitioning,
+                      device=device)
+    annealer = build_graph_annealer(graph, xs, problem, penalty)
+    scores = annealer.run(num_steps, init_temperature, final_temperature, schedule).tolist()
+
+    obj_batch = {Problem.maxcut: obj_maxcut_batch,
+                 Problem.graph_partitioning: obj_graph_partitioning_batch,
+                 Problem.minimum_vertex_cover: obj_minimum_vertex_cover_batch,
+                 Problem.maximum_independent_set: obj_maximum_independent_set_batch}[problem]
+    objs = obj_batch(annealer.best_xs.long(), graph).float()  # the exact objectives, -INF if not feasible
+    i = int(objs.argmax())
+    score = objs[i].item()
+    solution = annealer.best_xs[i].tolist()
+    print("score of simulated_annealing_batch", score)
+    print('running_duration: ', time.time() - start_time)
+    return score, solution, scores
+
+
+def simulated_annealing_set_cover_batch(init_temperature: Union[float, TEN], num_steps: Optional[int], num_items: int,
+                                        num_sets: int, item_matrix: List[List[int]], num_chains: int = 1024,
+                                        final_temperature: float = 0., schedule: str = 'linear', init_solution=None,
+                                        penalty: float = None, device=None) -> (float, List[int], List[float]):
+    print('simulated_annealing_set_cover_batch')
+    start_time = time.time()
+    num_steps = 50 * num_sets if num_steps is None else num_steps
+    xs = calc_init_xs(num_chains, num_sets, init_solution, device=device)
+    annealer = SetCoverAnnealer(xs, num_items, item_matrix, penalty)
+    scores = annealer.run(num_steps, init_temperature, final_temperature, schedule).tolist()
+
+    # the best chain which covers all items, a small penalty can rank a solution with uncovered items first
+    if_covered = annealer.calc_num_uncovered(annealer.calc_counts(annealer.best_xs)) == 0
+    i = int(th.where(if_covered, annealer.best_scores, -INF).argmax())
+    solution = annealer.best_xs[i].tolist()
+    score = annealer.best_scores[i].item()
+    score = score if if_covered[i] else -INF  # -INF if an item is not covered, the same as obj_set_cover
+    print("score of simulated_annealing_set_cover_batch", score)
+    print('running_duration: ', time.time() - start_time)
+    return score, solution, scores
+
+
+if __name__ == '__main__':
+    print(f'problem: {PROBLEM}')
+    device = th.device('cpu')
+    num_chains = 1024
+    schedule = 'linear'
+
+    if PROBLEM == Problem.set_cover:
+        filename = '../data/set_cover/frb30-15-1.msc'
+        num_items, num_sets, item_matrix = read_set_cover_data(filename)
+        start_time = time.time()
+        score, solution, scores = simulated_annealing_set_cover_batch(4, None, num_items, num_sets, item_matrix,
+                                                                      num_chains=num_chains, schedule=schedule,
+                                                                      device=device)
+        running_duration = time.time() - start_time
+        write_result_set_cover(score, running_duration, num_items, num_sets, 'simulated_annealing_batch', filename)
+    else:
+        filename = '../data/syn_BA/BA_100_ID0.txt'
+        graph = read_nxgraph(filename)
+        start_time = time.time()
+        score, solution, scores = simulated_annealing_batch(0.2, 10 * graph.number_of_nodes(), graph,
+                                                            num_chains=num_chains, schedule=schedule, device=device)
+        running_duration = time.time() - start_time
+        write_graph_result(score, running_duration, graph.number_of_nodes(), 'simulated_annealing_batch', solution,
+                           filename)
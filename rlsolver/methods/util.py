@@ -15,6 +15,7 @@ from typing import Union, Tuple, List
 import networkx as nx
 from torch import Tensor
 from rlsolver.methods.config import *
+from rlsolver.methods.util_bits import PackedSolutions
 try:
     import matplotlib as mpl
     import matplotlib.pyplot as plt
@@ -36,6 +37,97 @@ def plot_nxgraph(g: nx.Graph(), fig_filename='.result/fig.png'):
 def transfer_nxgraph_to_adjacencymatrix(graph: nx.Graph):
     return nx.to_numpy_array(graph)
 
+
+class GraphArrays:
+    def __init__(self, graph: nx.Graph = None):
+        """The edge list and the CSR of a nx.Graph, which nodes are 0, 1, ..., num_nodes - 1.
+
+        edge list: each edge once, `srcs[i] <= dsts[i]`, `weights[i]` is a float (the txt files save it as a str)
+        CSR: the sorted neighbors of `node` are `indices[indptr[node]:indptr[node + 1]]` with weights `data[...]`
+        Use `GraphArrays.from_edges()` to build it from the edge arrays without a nx.Graph.
+        """
+        self.device_edges = {}  # {device: (srcs, dsts, weights)} the edge list on torch devices
+        self.device_csr = {}  # {device: (indptr, indices, data)} the CSR on torch devices
+        if graph is None:
+            return
+
+        edges = [(int(n0), int(n1), float(w)) for n0, n1, w in graph.edges(data='weight', default=1)]
+        edges = np.array(edges, dtype=np.float64).reshape((-1, 3))
+        self.set_edges(num_nodes=graph.number_of_nodes(),
+                       srcs=edges[:, 0].astype(np.int64), dsts=edges[:, 1].astype(np.int64), weights=edges[:, 2])
+
+    @classmethod
+    def from_edges(cls, num_nodes: int, srcs: np.ndarray, dsts: np.ndarray, weights: np.ndarray) -> 'GraphArrays':
+        arrays = cls()
+        arrays.set_edges(num_nodes=num_nodes, srcs=srcs, dsts=dsts, weights=weights)
+        return arrays
+
+    def set_edges(self, num_nodes: int, srcs: np.ndarray, dsts: np.ndarray, weights: np.ndarray):
+        """a repeated edge keeps its last weight, the same as `nx.Graph.add_edge`"""
+        self.num_nodes = int(num_nodes)
+        srcs = np.asarray(srcs, dtype=np.int64)
+        dsts = np.asarray(dsts, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        srcs, dsts = np.minimum(srcs, dsts), np.maximum(srcs, dsts)
+        _, ids = np.unique((srcs * self.num_nodes + dsts)[::-1], return_index=True)
+        ids = len(srcs) - 1 - ids
+        self.srcs = srcs[ids]
+        self.dsts = dsts[ids]
+        self.weights = weights[ids]
+        self.num_edges = len(ids)
+
+        '''CSR of both directions, a self-loop is saved once'''
+        if_loop = self.srcs == self.dsts
+        rows = np.concatenate((self.srcs, self.dsts[~if_loop]))
+        cols = np.concatenate((self.dsts, self.srcs[~if_loop]))
+        data = np.concatenate((self.weights, self.weights[~if_loop]))
+        order = np.lexsort((cols, rows))  # sort by rows, then by cols
+        self.indices = cols[order]
+        self.data = data[order]
+        self.indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.num_nodes), out=self.indptr[1:])
+        self.degrees = np.diff(self.indptr)
+        self.weighted_degrees = np.bincount(rows, weights=data, minlength=self.num_nodes)
+        self.device_edges = {}
+        self.device_csr = {}
+
+    def neighbors(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        beg, end = self.indptr[node], self.indptr[node + 1]
+        return self.indices[beg:end], self.data[beg:end]
+
+    def edge_weight(self, node0: int, node1: int) -> float:
+        """the weight of edge (node0, node1), 0.0 if they are not adjacent"""
+        nodes, weights = self.neighbors(node0)
+        i = np.searchsorted(nodes, node1)
+        return float(weights[i]) if i < len(nodes) and nodes[i] == node1 else 0.0
+
+    def get_edges(self, device=None) -> Tuple[TEN, TEN, TEN]:
+        """the edge list (srcs, dsts, weights) as tensors on the device"""
+        device = th.device('cpu') if device is None else th.device(device)
+        if device not in self.device_edges:
+            self.device_edges[device] = (th.as_tensor(self.srcs, device=device),
+                                         th.as_tensor(self.dsts, device=device),
+                                         th.as_tensor(self.weights, dtype=th.float32, device=device))
+        return self.device_edges[device]
+
+    def get_csr(self, device=None) -> Tuple[TEN, TEN, TEN]:
+        """the CSR (indptr, indices, data) as tensors on the device"""
+        device = th.device('cpu') if device is None else th.device(device)
+        if device not in self.device_csr:
+            self.device_csr[device] = (th.as_tensor(self.indptr, device=device),
+                                       th.as_tensor(self.indices, device=device),
+                                       th.as_tensor(self.data, dtype=th.float32, device=device))
+        return self.device_csr[device]
+
+
+def get_graph_arrays(graph: nx.Graph) -> GraphArrays:
+    """build the GraphArrays once and cache it in `graph.graph`, rebuild it after the graph is changed"""
+    arrays = graph.graph.get('graph_arrays')
+    if (arrays is None) or (arrays.num_nodes, arrays.num_edges) != (graph.number_of_nodes(), graph.number_of_edges()):
+        arrays = GraphArrays(graph)
+        graph.graph['graph_arrays'] = arrays
+    return arrays
+
 # the returned weightmatrix has the following format： node1 node2 weight
 # For example: 1 2 3 // the weight of node1 and node2 is 3
 def transfer_nxgraph_to_weightmatrix(graph: nx.Graph):
@@ -80,12 +172,17 @@ def gpu_info_str(device) -> str:
     return (f"RAM(GB) {memory_allocated:.2f} < {max_allocated:.2f} < {total_memory:.2f}  "
             f"Rate {(max_allocated / total_memory):5.2f}")
 
-def evolutionary_replacement(xs: TEN, vs: TEN, low_k: int, if_maximize: bool):
+def evolutionary_replacement(xs: TEN, vs: TEN, low_k: int, if_maximize: bool, if_replace_duplicates: bool = False):
     num_sims = xs.shape[0]
 
     ids = vs.argsort()
     top_ids, low_ids = (ids[:-low_k], ids[-low_k:]) if if_maximize else (ids[:low_k], ids[low_k:])
     replace_ids = top_ids[th.randperm(num_sims - low_k, device=xs.device)[:low_k]]
+    if if_replace_duplicates:  # replace the repeated solutions first, which keeps the solutions diverse
+        if_duplicate = PackedSolutions.from_bools(xs).duplicate_mask()
+        priorities = th.rand(num_sims, device=xs.device) + if_duplicate.float()
+        priorities[low_ids] = -1
+        replace_ids = priorities.topk(low_k).indices
     xs[replace_ids] = xs[low_ids]
     vs[replace_ids] = vs[low_ids]
 
@@ -0,0 +1,109 @@
+import sys
+import os
+cur_path = os.path.dirname(os.path.abspath(__file__))
+rlsolver_path = os.path.join(cur_path, '../../rlsolver')
+sys.path.append(os.path.dirname(rlsolver_path))
+
+import numpy as np
+import torch as th
+from typing import Union, List
+
+TEN = th.Tensor
+ARY = np.ndarray
+
+WORD_BITS = 64
+WORD_SHIFTS = th.arange(WORD_BITS - 1, -1, -1, dtype=th.long)  # node i is the bit (63 - i % 64) of the word i // 64
+POPCOUNT_TABLE = th.tensor([bin(i).count('1') for i in range(256)], dtype=th.uint8)
+
+
+def popcount(words: TEN) -> TEN:
+    """the number of 1 bits of each row of int64 words, shape == words.shape[:-1]"""
+    table = POPCOUNT_TABLE.to(words.device)
+    return table[words.contiguous().view(th.uint8).long()].sum(dim=-1, dtype=th.long)
+
+
+class PackedSolutions:
+    def __init__(self, words: TEN, num_nodes: int):
+        """a pool of 0/1 solutions packed in int64 words, words.shape == (num_solutions, ceil(num_nodes / 64)).
+
+        A solution uses num_nodes / 8 bytes, 8x less than th.bool. The bits are big-endian: node 0 is the highest bit of
+        word 0, which is the bit order of `EncoderBase64`. The padding bits after num_nodes are 0.
+        """
+        assert words.dtype == th.long and words.ndim == 2
+        self.words = words
+        self.num_nodes = num_nodes
+
+    @classmethod
+    def from_bools(cls, xs: Union[TEN, ARY]) -> 'PackedSolutions':
+        xs = th.as_tensor(xs).bool()
+        xs = xs.reshape((1, -1)) if xs.ndim == 1 else xs
+        num_solutions, num_nodes = xs.shape
+        num_words = -(-num_nodes // WORD_BITS)
+        bits = th.zeros((num_solutions, num_words * WORD_BITS), dtype=th.long, device=xs.device)
+        bits[:, :num_nodes] = xs
+        bits = bits.reshape((num_solutions, num_words, WORD_BITS))
+        # the bits are distinct, so the sum (which wraps around at the sign bit) is the bitwise OR
+        words = (bits << WORD_SHIFTS.to(xs.device)).sum(dim=2)
+        return cls(words, num_nodes)
+
+    def to_bools(self) -> TEN:
+        bits = (self.words.unsqueeze(2) >> WORD_SHIFTS.to(self.device)) & 1
+        return bits.reshape((self.words.shape[0], -1))[:, :self.num_nodes].bool()
+
+    @property
+    def device(self):
+        return self.words.device
+
+    def __len__(self) -> int:
+        return self.words.shape[0]
+
+    def __getitem__(self, ids) -> 'PackedSolutions':
+        words = self.words[ids]
+        return PackedSolutions(words.reshape((-1, self.words.shape[1])), self.num_nodes)
+
+    def get_bits(self, nodes: TEN) -> TEN:
+        """the bits of `nodes` of each solution, shape == (num_solutions, len(nodes)), without unpacking all bits.
+        e.g. the cut values are `(pool.get_bits(n0_ids) ^ pool.get_bits(n1_ids)).sum(dim=1)`"""
+        nodes = nodes.to(self.device)
+        words = self.words[:, nodes // WORD_BITS]
+        return ((words >> (WORD_BITS - 1 - nodes % WORD_BITS)) & 1).bool()
+
+    def count_ones(self) -> TEN:
+        return popcount(self.words)
+
+    def hamming_distances(self, other: 'PackedSolutions' = None) -> TEN:
+        """the Hamming distances between the solutions of self and other, shape == (len(self), len(other))"""
+        other = self if other is None else other
+        return popcount(self.words.unsqueeze(1) ^ other.words.unsqueeze(0))
+
+    '''deduplication'''
+
+    def keys(self) -> List[bytes]:
+        """the hashable key of each solution, for a Python set or dict"""
+        words = self.words.cpu().numpy()
+        return [words[i].tobytes() for i in range(words.shape[0])]
+
+    def unique_ids(self) -> TEN:
+        """the index of the first appearance of each distinct solution, in ascending order"""
+        _, inverse = th.unique(self.words, dim=0, return_inverse=True)
+        ids = th.arange(len(self), device=self.device)
+        first_ids = th.full((int(inverse.max()) + 1 if len(self) else 0,), len(self), device=self.device)
+        first_ids = first_ids.scatter_reduce(0, inverse, ids, reduce='amin')
+        return first_ids.sort()[0]
+
+    def duplicate_mask(self) -> TEN:
+        """True if the solution is the same as a previous solution"""
+        if_duplicate = th.ones(len(self), dtype=th.bool, device=self.device)
+        if_duplicate[self.unique_ids()] = False
+        return if_duplicate
+
+    '''the string format of `EncoderBase64`'''
+
+    def to_strs(self, encoder) -> List[str]:
+        xs = self.to_bools().cpu()
+        return [encoder.bool_to_str(x) for x in xs]
+
+    @classmethod
+    def from_strs(cls, x_strs: List[str], encoder) -> 'PackedSolutions':
+        xs = th.stack([encoder.str_to_bool(x_str) for x_str in x_strs])
+        return cls.from_bools(xs)
@@ -30,17 +30,13 @@ class EncoderBase64:
         assert self.base_num == 2 ** num_power
 
     def bool_to_str(self, x_bool: Union[TEN, ARY]) -> str:
-        x_int = int(''.join([('1' if i else '0') for i in x_bool.tolist()]), 2)
-
-        '''bin_int_to_str'''
-        base_num = len(self.base_digits)
-        x_str = ""
-        while True:
-            remainder = x_int % base_num
-            x_str = self.base_digits[remainder] + x_str
-            x_int //= base_num
-            if x_int == 0:
-                break
+        """each digit is 6 bits, from the end of x_bool (the lowest bit). The leading zero digits are dropped"""
+        x_bool = np.asarray(x_bool.cpu() if isinstance(x_bool, TEN) else x_bool).astype(bool).reshape(-1)
+        num_pad = -len(x_bool) % 6
+        bits = np.concatenate((np.zeros(num_pad, dtype=bool), x_bool)).reshape((-1, 6))
+        digits = bits @ (2 ** np.arange(5, -1, -1))
+        digits = digits[np.argmax(digits != 0):] if digits.any() else digits[-1:]
+        x_str = ''.join(self.base_digits[d] for d in digits)
 
         if len(x_str) > 120:
             x_str = '\n'.join([x_str[i:i + 120] for i in range(0, len(x_str), 120)])
@@ -51,17 +47,13 @@ class EncoderBase64:
     def str_to_bool(self, x_str: str) -> TEN:
         x_b64 = x_str.replace('\n', '').replace(' ', '')
 
-        '''b64_str_to_int'''
-        x_int = 0
-        base_len = len(x_b64)
-        for i in range(base_len):
-            digit = self.base_digits.index(x_b64[i])
-            power = base_len - 1 - i
-            x_int += digit * (self.base_num ** power)
-
-        x_bin: str = bin(x_int)[2:]
+        '''b64_str_to_bits'''
+        digits = np.array([self.base_digits.index(c) for c in x_b64], dtype=np.int64)
+        bits = ((digits[:, None] >> np.arange(5, -1, -1)) & 1).reshape(-1).astype(bool)
         x_bool = th.zeros(self.encode_len, dtype=th.bool)
-        x_bool[-len(x_bin):] = th.tensor([int(i) for i in x_bin], dtype=th.bool)
+        num_bits = min(len(bits), self.encode_len)
+        if num_bits > 0:
+            x_bool[-num_bits:] = th.as_tensor(bits[len(bits) - num_bits:])
         return x_bool
 
 
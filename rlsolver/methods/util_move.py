@@ -0,0 +1,253 @@
+import sys
+import os
+cur_path = os.path.dirname(os.path.abspath(__file__))
+rlsolver_path = os.path.join(cur_path, '../../rlsolver')
+sys.path.append(os.path.dirname(rlsolver_path))
+
+import heapq
+import numpy as np
+from typing import Union, Optional, List
+import networkx as nx
+from torch import Tensor
+
+from rlsolver.methods.util import get_graph_arrays
+
+
+class MoveGains:
+    def __init__(self, graph: nx.Graph, solution: Union[Tensor, List[int], np.array], if_heap: bool = True):
+        """The gains of flipping each node of a 0/1 solution, updated incrementally after each flip.
+
+        `gains[node]` is the change of `score` after flipping `solution[node]`. After a flip, only the gains of the
+        flipped node and its neighbors are updated, which costs O(degree) instead of a full objective evaluation.
+        The best move is found by a lazy max-heap: stale entries are skipped by the version of each node,
+        so `best_move()` is O(1) amortized, and a flip costs O(degree * log(num_nodes)).
+        Nodes are put in the heap of `group(node)`, so that a subclass can search the best move in a part of nodes.
+        Ties are broken by the smaller `ties[node]`, then by the smaller node index.
+        Set `if_heap=False` to skip the heaps when the moves are sampled randomly, e.g. in simulated annealing.
+        Self-loops are ignored.
+        """
+        self.arrays = get_graph_arrays(graph)
+        self.num_nodes = self.arrays.num_nodes
+        self.solution = np.array(solution, dtype=np.int64).reshape(-1)
+        assert self.solution.shape[0] == self.num_nodes
+
+        if_other = self.arrays.srcs != self.arrays.dsts
+        self.srcs = self.arrays.srcs[if_other]  # the edge list without self-loops
+        self.dsts = self.arrays.dsts[if_other]
+        self.weights = self.arrays.weights[if_other]
+
+        self.ties = np.zeros(self.num_nodes)
+        self.init_state()
+        self.score = self.calc_score()
+        self.gains = self.calc_gains()
+
+        self.if_heap = if_heap
+        self.max_skips = 32  # scan all nodes after skipping `max_skips` disallowed nodes in a heap
+        self.versions = np.zeros(self.num_nodes, dtype=np.int64)
+        self.heaps = {}
+        self.num_items = 0  # the number of entries in the heaps, including the stale entries
+        if if_heap:
+            self.build_heaps()
+
+    '''override these methods in subclasses'''
+
+    def init_state(self):
+        pass
+
+    def calc_score(self) -> float:
+        raise NotImplementedError
+
+    def calc_gains(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def update_gains(self, node: int, nodes: np.ndarray, weights: np.ndarray):
+        """update the state and `gains[node]`, `gains[nodes]` after `solution[node]` was flipped"""
+        raise NotImplementedError
+
+    def group(self, node: int) -> int:
+        return 0
+
+    def group_mask(self, group: int) -> np.ndarray:
+        return np.full(self.num_nodes, group == 0)
+
+    def build_heaps(self):
+        self.heaps = {}
+        for node in range(self.num_nodes):
+            item = (-self.gains[node], self.ties[node], node, self.versions[node])
+            self.heaps.setdefault(self.group(node), []).append(item)
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+        self.num_items = self.num_nodes
+
+    '''moves'''
+
+    def top_moves(self, num: int = 1, group: int = 0, is_allowed: Optional[np.ndarray] = None) -> List[int]:
+        """the `num` nodes with the largest gains in the group, skipping the nodes with `is_allowed[node] == False`"""
+        assert self.if_heap
+        heap = self.heaps.get(group, [])
+        nodes = []
+        items = []
+        num_skips = 0
+        while heap and len(nodes) < num:
+            item = heapq.heappop(heap)
+            node, version = item[2], item[3]
+            if version != self.versions[node]:
+                self.num_items -= 1
+                continue  # drop the stale entry
+            items.append(item)
+            if is_allowed is None or is_allowed[node]:
+                nodes.append(node)
+            else:
+                num_skips += 1
+                if num_skips > self.max_skips:
+                    break
+        for item in items:
+            heapq.heappush(heap, item)
+
+        if num_skips > self.max_skips:  # most top nodes are not allowed (e.g. tabu), scan all nodes instead
+            if_candidate = is_allowed & self.group_mask(group)
+            if_candidate[nodes] = False
+            candidates = np.flatnonzero(if_candidate)
+            order = np.lexsort((candidates, self.ties[candidates], -self.gains[candidates]))
+            nodes.extend(candidates[order[:num - len(nodes)]].tolist())
+        return nodes
+
+    def best_move(self, group: int = 0, is_allowed: Optional[np.ndarray] = None) -> Optional[int]:
+        nodes = self.top_moves(num=1, group=group, is_allowed=is_allowed)
+        return nodes[0] if nodes else None
+
+    def flip(self, node: int):
+        self.score += self.gains[node]
+        self.solution[node] = 1 - self.solution[node]
+
+        nodes, weights = self.arrays.neighbors(node)
+        if_other = nodes != node
+        nodes, weights = nodes[if_other], weights[if_other]
+        self.update_gains(node, nodes, weights)
+        if not self.if_heap:
+            return
+
+        self.versions[node] += 1
+        self.versions[nodes] += 1
+        if self.num_items > 4 * self.num_nodes:  # drop the stale entries, when they are not popped by `top_moves`
+            self.build_heaps()
+            return
+        for i in (node, *nodes.tolist()):
+            heapq.heappush(self.heaps.setdefault(self.group(i), []),
+                           (-self.gains[i], self.ties[i], i, self.versions[i]))
+        self.num_items += len(nodes) + 1
+
+
+class MaxcutMoveGains(MoveGains):
+    sign = 1  # score = sign * cut
+
+    def calc_score(self) -> float:
+        x = self.solution
+        return self.sign * float((self.weights * (x[self.srcs] != x[self.dsts])).sum())
+
+    def calc_gains(self) -> np.ndarray:
+        x = self.solution
+        edge_gains = np.where(x[self.srcs] == x[self.dsts], self.weights, -self.weights) * self.sign
+        return (np.bincount(self.srcs, weights=edge_gains, minlength=self.num_nodes) +
+                np.bincount(self.dsts, weights=edge_gains, minlength=self.num_nodes))
+
+    def update_gains(self, node: int, nodes: np.ndarray, weights: np.ndarray):
+        if_same = self.solution[nodes] == self.solution[node]
+        self.gains[nodes] += np.where(if_same, 2 * weights, -2 * weights) * self.sign
+        self.gains[node] = -self.gains[node]
+
+
+class PartitionSwapGains(MaxcutMoveGains):
+    """score = -cut. A move swaps a node of part 0 with a node of part 1, which keeps the two parts balanced."""
+    sign = -1
+
+    def group(self, node: int) -> int:
+        return int(self.solution[node])
+
+    def group_mask(self, group: int) -> np.ndarray:
+        return self.solution == group
+
+    def swap_gain(self, node0: int, node1: int) -> float:
+        assert self.solution[node0] != self.solution[node1]
+        return self.gains[node0] + self.gains[node1] - 2 * self.arrays.edge_weight(node0, node1)
+
+    def best_swap(self, num_candidates: int = 4) -> (Optional[int], Optional[int], float):
+        """a heuristic swap: the best pair among the top `num_candidates` move gains of each part.
+        It is not guaranteed to find the best swap, since an edge between a pair (of either sign) changes its gain."""
+        nodes0 = self.top_moves(num=num_candidates, group=0)
+        nodes1 = self.top_moves(num=num_candidates, group=1)
+        best = (None, None, -np.inf)
+        for node0 in nodes0:
+            for node1 in nodes1:
+                gain = self.swap_gain(node0, node1)
+                if gain > best[2]:
+                    best = (node0, node1, gain)
+        return best
+
+    def swap(self, node0: int, node1: int):
+        self.flip(node0)
+        self.flip(node1)
+
+
+class VertexCoverMoveGains(MoveGains):
+    def __init__(self, graph: nx.Graph, solution: Union[Tensor, List[int], np.array], penalty: float = None,
+                 if_heap: bool = True):
+        """score = -num_selected - penalty * num_uncovered. A larger degree wins a tie."""
+        self.penalty = graph.number_of_nodes() + 1 if penalty is None else penalty
+        super().__init__(graph, solution, if_heap)
+
+    def init_state(self):
+        x = self.solution
+        # free_degrees[node]: the number of unselected neighbors, which are the uncovered edges of an unselected node
+        self.free_degrees = (np.bincount(self.srcs, weights=x[self.dsts] == 0, minlength=self.num_nodes) +
+                             np.bincount(self.dsts, weights=x[self.srcs] == 0, minlength=self.num_nodes))
+        self.num_uncovered = int(((x[self.srcs] == 0) & (x[self.dsts] == 0)).sum())
+        self.ties = -np.diff(self.arrays.indptr).astype(np.float64)
+
+    def calc_score(self) -> float:
+        return -float((self.solution == 1).sum()) - self.penalty * self.num_uncovered
+
+    def calc_gains(self, nodes: Union[np.ndarray, slice] = slice(None)) -> np.ndarray:
+        # selecting a node: -1 + penalty * free_degree; unselecting a node: the opposite
+        return (1 - 2 * self.solution[nodes]) * (self.penalty * self.free_degrees[nodes] - 1)
+
+    def update_gains(self, node: int, nodes: np.ndarray, weights: np.ndarray):
+        if_select = self.solution[node] == 1
+        self.num_uncovered += -int(self.free_degrees[node]) if if_select else int(self.free_degrees[node])
+        self.free_degrees[nodes] += -1 if if_select else 1
+        self.gains[nodes] = self.calc_gains(nodes)
+        self.gains[node] = -self.gains[node]
+
+    def removable_nodes(self) -> np.ndarray:
+        """the selected nodes which can be unselected without uncovering an edge"""
+        return np.flatnonzero((self.solution == 1) & (self.free_degrees == 0))
+
+
+class IndependentSetMoveGains(MoveGains):
+    def __init__(self, graph: nx.Graph, solution: Union[Tensor, List[int], np.array], penalty: float = None,
+                 if_heap: bool = True):
+        """score = num_selected - penalty * num_conflicts. A smaller degree wins a tie."""
+        self.penalty = graph.number_of_nodes() + 1 if penalty is None else penalty
+        super().__init__(graph, solution, if_heap)
+
+    def init_state(self):
+        x = self.solution
+        # busy_degrees[node]: the number of selected neighbors, which are the conflicts of a selected node
+        self.busy_degrees = (np.bincount(self.srcs, weights=x[self.dsts] == 1, minlength=self.num_nodes) +
+                             np.bincount(self.dsts, weights=x[self.srcs] == 1, minlength=self.num_nodes))
+        self.num_conflicts = int(((x[self.srcs] == 1) & (x[self.dsts] == 1)).sum())
+        self.ties = np.diff(self.arrays.indptr).astype(np.float64)
+
+    def calc_score(self) -> float:
+        return float((self.solution == 1).sum()) - self.penalty * self.num_conflicts
+
+    def calc_gains(self, nodes: Union[np.ndarray, slice] = slice(None)) -> np.ndarray:
+        # selecting a node: 1 - penalty * busy_degree; unselecting a node: the opposite
+        return (1 - 2 * self.solution[nodes]) * (1 - self.penalty * self.busy_degrees[nodes])
+
+    def update_gains(self, node: int, nodes: np.ndarray, weights: np.ndarray):
+        if_select = self.solution[node] == 1
+        self.num_conflicts += int(self.busy_degrees[node]) if if_select else -int(self.busy_degrees[node])
+        self.busy_degrees[nodes] += 1 if if_select else -1
+        self.gains[nodes] = self.calc_gains(nodes)
+        self.gains[node] = -self.gains[node]
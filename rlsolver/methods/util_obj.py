@@ -18,7 +18,9 @@ try:
 except ImportError:
     plt = None
 
+import torch as th
 from rlsolver.methods.util import (transfer_nxgraph_to_adjacencymatrix,
+                                   get_graph_arrays,
                                    )
 
 from rlsolver.methods.util_read_data import (read_nxgraph,
@@ -27,78 +29,101 @@ from rlsolver.methods.util_read_data import (read_nxgraph,
 from rlsolver.methods.util_generate import generate_write_adjacencymatrix_and_nxgraph
 
 
+'''batched objectives. `solutions` is a np.ndarray or a torch.Tensor, shape == (num_solutions, num_nodes)'''
+
+
+def get_edges_like(solutions: Union[Tensor, np.ndarray], graph: nx.Graph):
+    """the cached edge list (srcs, dsts, weights) of the graph, as tensors on the device of `solutions` if it is a tensor"""
+    arrays = get_graph_arrays(graph)
+    if isinstance(solutions, Tensor):
+        return arrays.get_edges(device=solutions.device)
+    return arrays.srcs, arrays.dsts, arrays.weights
+
+
+def as_solutions(solutions: Union[Tensor, List[List[int]], np.ndarray]) -> Union[Tensor, np.ndarray]:
+    solutions = solutions if isinstance(solutions, Tensor) else np.asarray(solutions)
+    return solutions.reshape((1, -1)) if solutions.ndim == 1 else solutions
+
+
+# max total cuts
+def obj_maxcut_batch(solutions: Union[Tensor, np.ndarray], graph: nx.Graph):
+    solutions = as_solutions(solutions)
+    srcs, dsts, weights = get_edges_like(solutions, graph)
+    return ((solutions[:, srcs] != solutions[:, dsts]) * weights).sum(1)
+
+
+# min total cuts, -INF if the two parts are not balanced
+def obj_graph_partitioning_batch(solutions: Union[Tensor, np.ndarray], graph: nx.Graph):
+    solutions = as_solutions(solutions)
+    objs = -obj_maxcut_batch(solutions, graph)
+    if_balanced = (solutions == 0).sum(1) * 2 == solutions.shape[1]
+    return objs * if_balanced + (-INF) * (~if_balanced)
+
+
+# -INF if an edge is not covered
+def obj_minimum_vertex_cover_batch(solutions: Union[Tensor, np.ndarray], graph: nx.Graph,
+                                   need_check_cover_all_edges=True):
+    solutions = as_solutions(solutions)
+    objs = -(solutions == 1).sum(1)
+    if need_check_cover_all_edges:
+        srcs, dsts, _ = get_edges_like(solutions, graph)
+        if_cover = ((solutions[:, srcs] != 0) | (solutions[:, dsts] != 0)).all(1)
+        objs = objs * if_cover + (-INF) * (~if_cover)
+    return objs
+
+
+# solutions[:, i] = 0 or 1, -INF if two selected nodes are adjacent
+def obj_maximum_independent_set_batch(solutions: Union[Tensor, np.ndarray], graph: nx.Graph):
+    solutions = as_solutions(solutions)
+    srcs, dsts, _ = get_edges_like(solutions, graph)
+    objs = (solutions == 1).sum(1)
+    if_independent = ~((solutions[:, srcs] == 1) & (solutions[:, dsts] == 1)).any(1)
+    return objs * if_independent + (-INF) * (~if_independent)
+
+
+# -num_colors, -INF if two adjacent nodes have the same color
+def obj_graph_coloring_batch(solutions: Union[Tensor, np.ndarray], graph: nx.Graph):
+    solutions = as_solutions(solutions)
+    srcs, dsts, _ = get_edges_like(solutions, graph)
+    if_valid = ~(solutions[:, srcs] == solutions[:, dsts]).any(1)
+    if isinstance(solutions, Tensor):
+        num_colors = (th.diff(th.sort(solutions, dim=1)[0], dim=1) != 0).sum(1) + 1
+    else:
+        num_colors = (np.diff(np.sort(solutions, axis=1), axis=1) != 0).sum(1) + 1
+    return -num_colors * if_valid + (-INF) * (~if_valid)
+
+
+'''objectives of one solution'''
+
+
 # max total cuts
 def obj_maxcut(result: Union[Tensor, List[int], np.array], graph: nx.Graph):
-    num_nodes = len(result)
-    obj = 0
-    adj_matrix = transfer_nxgraph_to_adjacencymatrix(graph)
-    for i in range(num_nodes):
-        for j in range(i + 1, num_nodes):
-            if result[i] != result[j]:
-                obj += adj_matrix[(i, j)]
-    return obj
+    return obj_maxcut_batch(as_solutions(result), graph)[0].item()
 
 
 # min total cuts
 def obj_graph_partitioning(solution: Union[Tensor, List[int], np.array], graph: nx.Graph):
-    num_nodes = len(solution)
-    obj = 0
-    adj_matrix = transfer_nxgraph_to_adjacencymatrix(graph)
-    sum1 = 0
-    for i in range(num_nodes):
-        if solution[i] == 0:
-            sum1 += 1
-        for j in range(i + 1, num_nodes):
-            if solution[i] != solution[j]:
-                obj -= adj_matrix[(i, j)]
-    if sum1 != num_nodes / 2:
-        return -INF
-    return obj
+    return obj_graph_partitioning_batch(as_solutions(solution), graph)[0].item()
 
 
 def cover_all_edges(solution: List[int], graph: nx.Graph):
     if graph.number_of_nodes() == 0:
         return False
-    cover_all = True
-    for node1, node2 in graph.edges:
-        if solution[node1] == 0 and solution[node2] == 0:
-            cover_all = False
-            break
-    return cover_all
+    return obj_minimum_vertex_cover_batch(as_solutions(solution), graph)[0].item() != -INF
 
 
 def obj_minimum_vertex_cover(solution: Union[Tensor, List[int], np.array], graph: nx.Graph,
                              need_check_cover_all_edges=True):
-    num_nodes = len(solution)
-    obj = 0
-    for i in range(num_nodes):
-        if solution[i] == 1:
-            obj -= 1
-    if need_check_cover_all_edges:
-        if not cover_all_edges(solution, graph):
-            return -INF
-    return obj
+    return int(obj_minimum_vertex_cover_batch(as_solutions(solution), graph, need_check_cover_all_edges)[0].item())
 
 
 # make sure solution[i] = 0 or 1
 def obj_maximum_independent_set(solution: Union[Tensor, List[int], np.array], graph: nx.Graph):
-    sol = set(solution)
-    # if len(solution) > 0:
-    #     assert len(sol) == 2
-    max_elem = max(sol)
-    min_elem = min(sol)
-    if max_elem == min_elem:
-        max_elem += 1
-    obj = 0
-    edges = list(graph.edges)
-    num_nodes = int(graph.number_of_nodes())
-    for i, j in edges:
-        if solution[i] == max_elem and solution[j] == max_elem:
-            return -INF
-    for i in range(num_nodes):
-        if solution[i] == max_elem:
-            obj += 1
-    return obj
+    solution = as_solutions(solution)
+    max_elem = solution.max()
+    if max_elem == solution.min():  # no node is selected
+        return 0
+    return int(obj_maximum_independent_set_batch((solution == max_elem) * 1, graph)[0].item())
 
 
 # the returned score, the higher, the better
@@ -167,15 +192,7 @@ def obj_set_cover(solution: Union[Tensor, List[int], np.array], num_items: int,
 def obj_graph_coloring(solution: Union[Tensor, List[int], np.array], graph: nx.Graph) -> int:
     assert None not in solution
     assert len(solution) == graph.number_of_nodes()
-    for node1, node2 in graph.edges:
-        if solution[node1] == solution[node2]:
-            return -INF
-    colors = set()
-    for node in range(len(solution)):
-        color = solution[node]
-        colors.add(color)
-    num_colors = len(colors)
-    return -num_colors
+    return int(obj_graph_coloring_batch(as_solutions(solution), graph)[0].item())
 
 
 if __name__ == '__main__':
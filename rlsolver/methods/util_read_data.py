@@ -4,8 +4,10 @@ cur_path = os.path.dirname(os.path.abspath(__file__))
 rlsolver_path = os.path.join(cur_path, '../../rlsolver')
 sys.path.append(os.path.dirname(rlsolver_path))
 
-from typing import List, Tuple, Union
-from rlsolver.methods.config import GRAPH_TYPE
+import hashlib
+import numpy as np
+from typing import List, Tuple, Union, Optional, Iterator
+from rlsolver.methods.config import GRAPH_TYPE, GRAPH_CACHE_DIR
 os.environ['KMP_DUPLICATE_LIB_OK']='True'
 import networkx as nx
 try:
@@ -20,29 +22,75 @@ IndexList = List[List[int]]  # 按索引顺序记录每个点的所有邻居节
 GraphTypes = ['BarabasiAlbert', 'ErdosRenyi', 'PowerLaw']
 TEN = th.Tensor
 
-from rlsolver.methods.util import calc_txt_files_with_prefixes
+from rlsolver.methods.util import calc_txt_files_with_prefixes, GraphArrays
+
+def calc_file_hash(filename: str) -> str:
+    hasher = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# read the edges of a graph file, e.g., gset_14.txt, as arrays (num_nodes, srcs, dsts, weights) in the file order.
+# The nodes in file start from 1, but the nodes start from 0 in our codes.
+# The arrays are saved in `{cache_dir}/{file hash}.npz` once, and the later calls load the .npz file instead of the txt.
+def read_graph_edges(filename: str, cache_dir: Optional[str] = GRAPH_CACHE_DIR) \
+        -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    cache_path = None
+    if cache_dir:
+        file_hash = calc_file_hash(filename)
+        cache_path = f"{cache_dir}/{file_hash}.npz"
+        if os.path.isfile(cache_path):
+            with np.load(cache_path) as data:
+                return (int(data['num_nodes']), data['srcs'].astype(np.int64), data['dsts'].astype(np.int64),
+                        data['weights'])
+
+    with open(filename, 'r') as file:
+        lines = [line for line in file.read().splitlines() if line.strip() and '//' not in line]
+    num_nodes = int(lines[0].split()[0])
+    edges = np.array(' '.join(lines[1:]).split(), dtype=np.float64).reshape((-1, 3))
+    srcs = edges[:, 0].astype(np.int64) - 1
+    dsts = edges[:, 1].astype(np.int64) - 1
+    weights = edges[:, 2]
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{cache_dir}/{file_hash}_{os.getpid()}.temp.npz"  # rename it, since other processes may read it
+        node_dtype = np.int32 if num_nodes < 2 ** 31 else np.int64
+        np.savez(temp_path, num_nodes=num_nodes, srcs=srcs.astype(node_dtype), dsts=dsts.astype(node_dtype),
+                 weights=weights)
+        os.replace(temp_path, cache_path)
+    return num_nodes, srcs, dsts, weights
+
+
+# read graph file as GraphArrays (the edge list and the CSR) without building a networkx.Graph
+def read_graph_arrays(filename: str, cache_dir: Optional[str] = GRAPH_CACHE_DIR) -> GraphArrays:
+    num_nodes, srcs, dsts, weights = read_graph_edges(filename, cache_dir=cache_dir)
+    return GraphArrays.from_edges(num_nodes=num_nodes, srcs=srcs, dsts=dsts, weights=weights)
+
+
+# yield (filename, GraphArrays) of the graph files in the directory one by one, all the txt files if prefixes is None
+def read_graph_arrays_in_directory(directory: str, prefixes: Optional[List[str]] = None,
+                                   cache_dir: Optional[str] = GRAPH_CACHE_DIR) -> Iterator[Tuple[str, GraphArrays]]:
+    if prefixes is None:
+        files = sorted(f"{directory}/{file}" for file in os.listdir(directory) if file.endswith('.txt'))
+    else:
+        files = calc_txt_files_with_prefixes(directory, prefixes)
+    for filename in files:
+        yield filename, read_graph_arrays(filename, cache_dir=cache_dir)
+
 
 # read graph file, e.g., gset_14.txt, as networkx.Graph
 # The nodes in file start from 1, but the nodes start from 0 in our codes.
 def read_nxgraph(filename: str) -> nx.Graph():
+    num_nodes, srcs, dsts, weights = read_graph_edges(filename)
+    if np.all(weights == np.round(weights)):
+        weights = weights.astype(np.int64)
     graph = nx.Graph()
-    with open(filename, 'r') as file:
-        # lines = []
-        line = file.readline()
-        is_first_line = True
-        while line is not None and line != '':
-            if '//' not in line:
-                if is_first_line:
-                    strings = line.split(" ")
-                    num_nodes = int(strings[0])
-                    num_edges = int(strings[1])
-                    nodes = list(range(num_nodes))
-                    graph.add_nodes_from(nodes)
-                    is_first_line = False
-                else:
-                    node1, node2, weight = line.split(" ")
-                    graph.add_edge(int(node1) - 1, int(node2) - 1, weight=weight)
-            line = file.readline()
+    graph.add_nodes_from(range(num_nodes))
+    graph.add_weighted_edges_from(zip(srcs.tolist(), dsts.tolist(), weights.tolist()))
+    graph.graph['graph_arrays'] = GraphArrays.from_edges(num_nodes=num_nodes, srcs=srcs, dsts=dsts, weights=weights)
     return graph
 
 def read_nxgraphs(directory: str, prefixes: List[str]) -> List[nx.Graph]:
@@ -55,11 +103,10 @@ def read_nxgraphs(directory: str, prefixes: List[str]) -> List[nx.Graph]:
     return graphs
 
 def read_graphlist(filename: str) -> GraphList:
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-        lines = [[int(i1) for i1 in i0.split()] for i0 in lines]
-    num_nodes, num_edges = lines[0]
-    graph_list = [(n0 - 1, n1 - 1, dt) for n0, n1, dt in lines[1:]]  # 将node_id 由“从1开始”改为“从0开始”
+    num_nodes, srcs, dsts, weights = read_graph_edges(filename)  # node_id 已经由“从1开始”改为“从0开始”
+    if np.all(weights == np.round(weights)):  # fractional weights are kept as floats
+        weights = weights.astype(np.int64)
+    graph_list = list(zip(srcs.tolist(), dsts.tolist(), weights.tolist()))
     return graph_list
 
 def generate_graph_list(graph_type: str, num_nodes: int) -> GraphList:
@@ -321,6 +321,96 @@ def check_agent_ppo_discrete_style(batch_size=3, horizon_len=16, net_dims=(64, 3
         assert len(logging_tuple) >= 2
 
 
+def _get_advantages_by_loop(agent, states, rewards, undones, unmasks, values):  # the reverse loop before scan
+    advantages = torch.empty_like(values)
+
+    truncated = torch.logical_not(unmasks)
+    if torch.any(truncated):
+        rewards[truncated] += agent.cri(states[truncated]).squeeze(1).detach()
+        undones[truncated] = False
+
+    masks = undones * agent.gamma
+    horizon_len = rewards.shape[0]
+    next_value = agent.cri(agent.last_state.clone()).detach().squeeze(-1)
+
+    advantage = torch.zeros_like(next_value)
+    if agent.if_use_v_trace:
+        for t in range(horizon_len - 1, -1, -1):
+            next_value = rewards[t] + masks[t] * next_value
+            advantages[t] = advantage = next_value - values[t] + masks[t] * agent.lambda_gae_adv * advantage
+            next_value = values[t]
+    else:
+        for t in range(horizon_len - 1, -1, -1):
+            advantages[t] = rewards[t] - values[t] + masks[t] * advantage
+            advantage = values[t] + agent.lambda_gae_adv * advantages[t]
+    return advantages
+
+
+def test_get_advantages(horizon_len=97, num_envs=5, state_dim=3, action_dim=1, net_dims=(16, 16)):
+    print("\n| test_get_advantages()")
+    from elegantrl.agents.AgentPPO import AgentPPO
+    torch.set_grad_enabled(False)
+
+    states = torch.rand((horizon_len, num_envs, state_dim))
+    rewards = torch.randn((horizon_len, num_envs))
+    undones = torch.rand((horizon_len, num_envs)).gt(0.05)
+    unmasks = torch.rand((horizon_len, num_envs)).gt(0.05)
+    values = torch.randn((horizon_len, num_envs))
+
+    args = Config()
+    args.num_envs = num_envs
+    for if_use_v_trace in (True, False):
+        args.if_use_v_trace = if_use_v_trace
+        agent = AgentPPO(net_dims=list(net_dims), state_dim=state_dim, action_dim=action_dim, gpu_id=-1, args=args)
+        agent.last_state = torch.rand((num_envs, state_dim))
+
+        advantages0 = _get_advantages_by_loop(agent, states, rewards.clone(), undones.clone(), unmasks, values)
+        advantages1 = agent.get_advantages(states, rewards.clone(), undones.clone(), unmasks, values)
+        assert advantages1.shape == (horizon_len, num_envs)
+        assert torch.allclose(advantages0, advantages1, atol=1e-5)
+    torch.set_grad_enabled(True)
+
+
+def test_flat_soft_update(state_dim=3, action_dim=2, net_dims=(16, 16), tau=0.25):
+    print("\n| test_flat_soft_update()")
+    from elegantrl.agents.AgentTD3 import AgentTD3
+    from elegantrl.agents.AgentDQN import AgentD3QN
+    from elegantrl.agents.AgentBase import get_flat_parameters
+
+    for agent_class in (AgentTD3, AgentD3QN):
+        args = Config()
+        args.if_flat_soft_update = True
+        agent = agent_class(net_dims=list(net_dims), state_dim=state_dim, action_dim=action_dim, gpu_id=-1, args=args)
+        for param in agent.cri.parameters():
+            param.data.add_(torch.randn_like(param))
+        tar_params0 = [(tar + (cur - tar) * tau).detach() for tar, cur in
+                       zip(agent.cri_target.parameters(), agent.cri.parameters())]
+
+        agent.flatten_target_parameters()
+        assert get_flat_parameters(agent.cri) is not None
+        assert get_flat_parameters(agent.cri_target) is not None
+        agent.soft_update(agent.cri_target, agent.cri, tau)
+        for tar_param0, tar_param1 in zip(tar_params0, agent.cri_target.parameters()):
+            assert torch.allclose(tar_param0, tar_param1, atol=1e-6)
+
+        '''the optimizer still updates the flattened parameters'''
+        state = torch.rand((4, state_dim))
+        flat_params = agent.cri.flat_params.clone()
+        q_value = agent.cri.get_q_values(state, torch.rand((4, action_dim))) if agent_class is AgentTD3 \
+            else agent.cri.get_q1_q2(state)[0]
+        agent.optimizer_backward(agent.cri_optimizer, q_value.mean())
+        assert not torch.equal(flat_params, agent.cri.flat_params)
+
+        '''fall back to `_foreach_lerp_` when the views are broken'''
+        agent.cri_target.load_state_dict(deepcopy(agent.cri_target.state_dict()), assign=True)
+        assert get_flat_parameters(agent.cri_target) is None
+        tar_params0 = [(tar * (1 - tau) + cur * tau).detach() for tar, cur in
+                       zip(agent.cri_target.parameters(), agent.cri.parameters())]
+        assert agent.soft_update(agent.cri_target, agent.cri, tau) is None
+        for tar_param0, tar_param1 in zip(tar_params0, agent.cri_target.parameters()):
+            assert torch.allclose(tar_param0, tar_param1, atol=1e-6)
+
+
 if __name__ == '__main__':
     print('\n| check_agents.py.')
     check_agent_base()
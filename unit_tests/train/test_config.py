@@ -226,58 +226,62 @@ def test_sub_env():
 
     env_args = EnvArgsPendulum
     env_class = PendulumEnv
-    env_id = 0
+    env_id = 1
+    num_envs = 2  # the number of envs in this subprocess
 
     state_dim = env_args['state_dim']
     action_dim = env_args['action_dim']
-    if_discrete = env_args['if_discrete']
+
+    '''build the shared memory of (states, actions, rewards, terminals, truncates) for 1 + num_envs envs'''
+    states = torch.zeros((1 + num_envs, state_dim), dtype=torch.float32).share_memory_()
+    actions = torch.zeros((1 + num_envs, action_dim), dtype=torch.float32).share_memory_()
+    rewards = torch.zeros(1 + num_envs, dtype=torch.float32).share_memory_()
+    terminals = torch.zeros(1 + num_envs, dtype=torch.bool).share_memory_()
+    truncates = torch.zeros(1 + num_envs, dtype=torch.bool).share_memory_()
+    shared_tensors = (states, actions, rewards, terminals, truncates)
 
     '''build sub_env'''
-    sub_env = SubEnv(sub_pipe0=sub_pipe0, vec_pipe1=vec_pipe1,
-                     env_class=env_class, env_args=env_args, env_id=env_id)
+    sub_env = SubEnv(sub_pipe0=sub_pipe0, vec_pipe1=vec_pipe1, env_class=env_class, env_args=env_args,
+                     shared_tensors=shared_tensors, env_id=env_id, num_envs=num_envs)
     sub_env.start()
 
     '''check reset'''
     for i in range(2):
         print(f"  test_sub_env() loop:{i}")
-        sub_pipe1.send(None)  # reset
-        _env_id, state = vec_pipe0.recv()
-        assert _env_id == env_id
-        assert isinstance(state, ndarray)
-        assert state.shape == (state_dim,)
+        sub_pipe1.send(False)  # reset
+        assert vec_pipe0.recv() == env_id
+        assert states[1:].abs().sum(dim=1).gt(0).all()
+        assert states[0].eq(0).all()  # the env outside this subprocess
 
         '''check step loop'''
         for _ in range(2):
-            action = torch.ones(action_dim, dtype=torch.float32).detach().numpy()
-            if if_discrete:
-                action = action.squeeze(1)
-            sub_pipe1.send(action)
+            actions[:] = 1.0
+            sub_pipe1.send(True)  # step
 
-            _env_id, state, reward, done, info_dict = vec_pipe0.recv()
-            assert _env_id == env_id
-            assert isinstance(state, ndarray)
-            assert state.shape == (state_dim,)
-            assert isinstance(reward, float)
-            assert isinstance(done, bool)
-            assert not done
+            assert vec_pipe0.recv() == env_id
+            assert rewards[1:].lt(0).all()
+            assert not terminals.any()
+            assert not truncates.any()
 
     sub_env.terminate()
 
 
 def test_vec_env():
     print("\n| test_vec_env()")
+    import gymnasium
     from elegantrl.train.config import VecEnv
 
     '''check for elegantrl.train.config build_env()'''
     gpu_id = -1
     num_envs = 4
     env_args_env_class_list = (
-        (EnvArgsCartPole, gym.make),  # discrete action space
+        (EnvArgsCartPole, gymnasium.make),  # discrete action space
         (EnvArgsPendulum, PendulumEnv),  # continuous action space
     )
     for env_args, env_class in env_args_env_class_list:
         _env_args = env_args.copy()
         _env_args['num_envs'] = num_envs
+        _env_args['max_step'] = 200
         _env_args['if_build_vec_env'] = True
 
         env_name = _env_args['env_name']
@@ -287,13 +291,14 @@ def test_vec_env():
         print(f"  env_name = {env_name}  if_build_vec_env = True")
 
         # env = build_env(env_class=env_class, env_args=_env_args, gpu_id=gpu_id)
-        env = VecEnv(env_class=env_class, env_args=_env_args, num_envs=num_envs, gpu_id=gpu_id)
+        env = VecEnv(env_class=env_class, env_args=_env_args, num_envs=num_envs, gpu_id=gpu_id, num_envs_per_proc=3)
+        assert env.num_procs == 2  # the subprocesses host 3 envs and 1 env
         assert isinstance(env.env_name, str)
         assert isinstance(env.state_dim, int)
         assert isinstance(env.action_dim, int)
         assert isinstance(env.if_discrete, bool)
 
-        states = env.reset()
+        states, info_dict = env.reset()
         assert isinstance(states, Tensor)
         assert states.shape == (num_envs, state_dim)
 
@@ -302,19 +307,21 @@ def test_vec_env():
                 action = torch.randint(action_dim, size=(num_envs, 1))
             else:
                 action = torch.rand(num_envs, action_dim)
-            state, reward, done, info_dict = env.step(action)
+            state, reward, terminal, truncate, info_dict = env.step(action)
 
             assert isinstance(state, Tensor)
             assert state.dtype is torch.float
             assert state.shape == (num_envs, state_dim,)
+            assert state.data_ptr() != env.states.data_ptr()  # the shared memory will be rewritten in next step
 
             assert isinstance(reward, Tensor)
             assert reward.dtype is torch.float
             assert reward.shape == (num_envs,)
 
-            assert isinstance(done, Tensor)
-            assert done.dtype is torch.bool
-            assert done.shape == (num_envs,)
+            for done in (terminal, truncate):
+                assert isinstance(done, Tensor)
+                assert done.dtype is torch.bool
+                assert done.shape == (num_envs,)
         env.close()
 
 
@@ -1,22 +1,23 @@
 import os
+import torch as th
+from elegantrl.train.config import Config, build_env
 from elegantrl.train.evaluator import Evaluator
 from elegantrl.envs.CustomGymEnv import PendulumEnv
 
-EnvArgsPendulum = {'env_name': 'Pendulum-v1', 'state_dim': 3, 'action_dim': 1, 'if_discrete': False}
+EnvArgsPendulum = {'env_name': 'Pendulum-v1', 'max_step': 200, 'state_dim': 3, 'action_dim': 1, 'if_discrete': False}
 
 
 def test_get_rewards_and_steps():
     print("\n| test_get_rewards_and_steps()")
     from elegantrl.train.evaluator import get_rewards_and_steps
-    from elegantrl.agents.net import Actor
+    from elegantrl.agents.AgentTD3 import Actor
 
-    env = PendulumEnv()
+    env = build_env(env_class=PendulumEnv, env_args=EnvArgsPendulum.copy())
 
     state_dim = env.state_dim
     action_dim = env.action_dim
-    if_discrete = env.if_discrete
 
-    actor = Actor(dims=[8, 8], state_dim=state_dim, action_dim=action_dim)
+    actor = Actor(net_dims=[8, 8], state_dim=state_dim, action_dim=action_dim)
 
     if_render = False
     rewards, steps = get_rewards_and_steps(env=env, actor=actor, if_render=if_render)
@@ -31,6 +32,36 @@ def test_get_rewards_and_steps():
         assert isinstance(steps, int)
 
 
+def test_get_rewards_and_steps_side_by_side():
+    print("\n| test_get_rewards_and_steps_side_by_side()")
+    from elegantrl.agents.AgentTD3 import Actor
+
+    eval_times = 4
+    actor = Actor(net_dims=[8, 8], state_dim=EnvArgsPendulum['state_dim'], action_dim=EnvArgsPendulum['action_dim'])
+
+    args = Config(env_class=PendulumEnv, env_args=EnvArgsPendulum.copy())
+    args.eval_times = eval_times
+    env = build_env(env_class=args.env_class, env_args=args.env_args.copy())
+    evaluator = Evaluator(cwd='.', env=env, args=args)
+    assert evaluator.get_cumulative_rewards_and_step == evaluator.get_cumulative_rewards_and_step_single_env
+    assert evaluator.eval_envs is None  # no env copies unless eval_env_pool is set
+
+    for eval_env_pool in ('copy', 'proc'):
+        args = Config(env_class=PendulumEnv, env_args=EnvArgsPendulum.copy())
+        args.eval_times = eval_times
+        args.eval_env_pool = eval_env_pool
+        env = build_env(env_class=args.env_class, env_args=args.env_args.copy())
+
+        evaluator = Evaluator(cwd='.', env=env, args=args)
+        assert evaluator.get_cumulative_rewards_and_step == evaluator.get_cumulative_rewards_and_step_side_by_side
+        rewards_steps_ten = evaluator.get_cumulative_rewards_and_step(actor)
+        assert rewards_steps_ten.shape == (eval_times, 2)
+        assert th.equal(rewards_steps_ten[:, 1], th.full((eval_times,), 200.))  # Pendulum is truncated at 200 steps
+        assert rewards_steps_ten[:, 0].unique().shape[0] == eval_times  # the episodes start from different states
+        evaluator.close_eval_envs()
+
+
 if __name__ == '__main__':
     print("\n| test_evaluator.py")
     test_get_rewards_and_steps()
+    test_get_rewards_and_steps_side_by_side()
@@ -0,0 +1,50 @@
+import os
+import time
+from elegantrl.train.profiler import Profiler, load_profile_records
+
+
+def test_profiler(cwd='./temp_profiler'):
+    print("\n| test_profiler()")
+    os.makedirs(cwd, exist_ok=True)
+
+    '''a disabled profiler records nothing'''
+    profiler = Profiler(cwd=cwd, name='disabled', if_enable=False)
+    with profiler.tick('explore'):
+        profiler.count('steps', 8)
+    assert profiler.used_times == {}
+    assert profiler.dump(if_force=True) == {}
+    assert not os.path.exists(f"{cwd}/profile_disabled.jsonl")
+
+    '''the nested phases and the counts'''
+    profiler = Profiler(cwd=cwd, name='learner', if_enable=True, dump_gap=3600)
+    for _ in range(3):
+        with profiler.tick('update_net'):
+            for _ in range(2):
+                with profiler.tick('sample'):
+                    time.sleep(0.01)
+                profiler.count('samples', 64)
+        profiler.count('steps', 16)
+    assert profiler.dump() == {}  # before `dump_gap` seconds
+    assert profiler.call_nums == {'update_net': 3, 'sample': 6}
+    assert profiler.used_times['update_net'] >= profiler.used_times['sample'] >= 0.06
+
+    record = profiler.dump(step=48, if_force=True)
+    assert record['step'] == 48
+    assert record['phases']['sample']['calls'] == 6
+    assert 0 < record['phases']['sample']['ratio'] <= record['phases']['update_net']['ratio'] <= 1
+    assert abs(record['samples_per_sec'] * record['used_time'] - 64 * 6) < 1e-6
+    assert abs(record['steps_per_sec'] * record['used_time'] - 16 * 3) < 1e-6
+    assert profiler.used_times == {}
+
+    profiler.close()
+    records = load_profile_records(cwd=cwd, name='learner')
+    assert len(records) == 2
+    assert records[0]['phases']['update_net']['calls'] == 3
+
+    import shutil
+    shutil.rmtree(cwd)
+
+
+if __name__ == '__main__':
+    print("\n| test_profiler.py")
+    test_profiler()
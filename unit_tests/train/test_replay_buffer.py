@@ -0,0 +1,182 @@
+import warnings
+import pytest
+import torch as th
+from elegantrl.train.config import Config
+from elegantrl.train.replay_buffer import ReplayBuffer, ReplayBufferMemmap, VecSumTree
+
+
+def test_vec_sum_tree():
+    print("\n| test_vec_sum_tree()")
+    buf_len = 37
+    num_trees = 3
+    batch_size = 2 ** 12
+
+    sum_tree = VecSumTree(buf_len=buf_len, num_trees=num_trees)
+    probs = th.rand((num_trees, buf_len)) + 0.1
+    probs[1, 5:9] = 0.  # zero-priority data can't be sampled
+    sum_tree.update_ids(tree_ids=th.arange(num_trees).repeat_interleave(buf_len),
+                        data_ids=th.arange(buf_len).repeat(num_trees), probs=probs.view(-1))
+    assert th.allclose(sum_tree.tree[:, 0], probs.sum(dim=1))
+
+    data_ids, tree_ids, leaf_values = sum_tree.important_sampling(batch_size=batch_size)
+    assert data_ids.shape == tree_ids.shape == leaf_values.shape == (num_trees, batch_size)
+    assert data_ids.min() >= 0
+    assert data_ids.max() < buf_len
+    assert th.equal(tree_ids[:, 0], th.arange(num_trees))
+    assert th.equal(leaf_values, probs[tree_ids, data_ids])
+    assert not th.isin(data_ids[1], th.arange(5, 9)).any()
+
+    '''check proportional prioritization'''
+    counts = th.zeros((num_trees, buf_len)).scatter_add_(1, data_ids, th.ones_like(leaf_values))
+    assert th.allclose(counts / batch_size, probs / probs.sum(dim=1, keepdim=True), atol=0.02)
+
+    '''check partial update'''
+    sum_tree.update_ids(tree_ids=th.tensor([0, 0, 2]), data_ids=th.tensor([3, 36, 3]), probs=th.tensor([5., 6., 7.]))
+    probs[0, 3], probs[0, 36], probs[2, 3] = 5., 6., 7.
+    assert th.allclose(sum_tree.tree[:, 0], probs.sum(dim=1))
+
+
+def test_replay_buffer_per():
+    print("\n| test_replay_buffer_per()")
+    max_size = 64
+    state_dim = 3
+    action_dim = 2
+    num_seqs = 4
+    batch_size = 32
+    add_size = 24
+
+    args = Config()
+    args.per_alpha = 0.6
+    args.per_beta = 0.4
+    buffer = ReplayBuffer(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=-1,
+                          num_seqs=num_seqs, if_use_per=True, args=args)
+
+    for i in range(5):  # the pointer wraps around the buffer
+        states = th.arange(add_size * i, add_size * (i + 1), dtype=th.float32)
+        states = states.view(add_size, 1, 1).repeat(1, num_seqs, state_dim)
+        actions = th.rand((add_size, num_seqs, action_dim))
+        rewards = th.rand((add_size, num_seqs))
+        undones = th.ones((add_size, num_seqs), dtype=th.bool)
+        unmasks = th.ones((add_size, num_seqs), dtype=th.bool)
+        buffer.update((states, actions, rewards, undones, unmasks))
+
+        (state, action, reward, undone, unmask, next_state,
+         is_weight, is_index) = buffer.sample_for_per(batch_size)
+        assert state.shape == next_state.shape == (batch_size, state_dim)
+        assert is_weight.shape == is_index.shape == (batch_size,)
+        assert th.equal(next_state[:, 0], state[:, 0] + 1)  # the newest transition is never sampled
+        assert is_weight.max() <= 1.0
+
+        td_error = th.rand(batch_size)
+        buffer.td_error_update_for_per(is_index, td_error)
+        assert th.isfinite(buffer.sum_trees.tree).all()
+
+
+def test_replay_buffer_memmap(tmp_path='./temp_replay_buffer_memmap'):
+    print("\n| test_replay_buffer_memmap()")
+    max_size = 64
+    state_dim = 3
+    action_dim = 2
+    num_seqs = 4
+    batch_size = 32
+    add_size = 24
+
+    args = Config()
+    args.buffer_memmap_dir = str(tmp_path)
+    args.buffer_cache_len = 16
+    buffer0 = ReplayBuffer(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=-1,
+                           num_seqs=num_seqs, args=args)
+    buffer1 = ReplayBufferMemmap(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=-1,
+                                 num_seqs=num_seqs, args=args)
+
+    for i in range(5):  # the pointer wraps around the buffer
+        states = th.rand((add_size, num_seqs, state_dim))
+        actions = th.rand((add_size, num_seqs, action_dim))
+        rewards = th.rand((add_size, num_seqs))
+        undones = th.rand((add_size, num_seqs)).gt(0.1)
+        unmasks = th.rand((add_size, num_seqs)).gt(0.1)
+        buffer0.update((states, actions, rewards, undones, unmasks))
+        buffer1.update((states, actions, rewards, undones, unmasks))
+        assert (buffer0.p, buffer0.cur_size) == (buffer1.p, buffer1.cur_size)
+
+        '''the sampled rows from hot cache and memmap files are the same as the rows in memory'''
+        ids0 = th.randint(buffer0.cur_size - 1, size=(batch_size,))
+        ids1 = th.randint(num_seqs, size=(batch_size,))
+        ids0[0] = (buffer0.p - 2) % max_size  # a transition in hot cache
+        for item0, item1 in zip(buffer0.get_items(ids0, ids1), buffer1.get_items(ids0, ids1)):
+            assert th.equal(item0, item1)
+
+    '''resume the buffer from the memmap files'''
+    buffer1.save_or_load_history(cwd=str(tmp_path), if_save=True)
+    args.continue_train = True
+    buffer2 = ReplayBufferMemmap(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=-1,
+                                 num_seqs=num_seqs, args=args)
+    assert (buffer2.p, buffer2.cur_size, buffer2.if_full) == (buffer1.p, buffer1.cur_size, buffer1.if_full)
+    assert th.equal(buffer2.states, buffer0.states)
+    state, action, reward, undone, unmask, next_state = buffer2.sample(batch_size)
+    assert state.shape == next_state.shape == (batch_size, state_dim)
+
+    del buffer1, buffer2
+    import shutil
+    shutil.rmtree(tmp_path)
+
+
+def test_replay_buffer_compact():
+    print("\n| test_replay_buffer_compact()")
+    max_size = 64
+    state_dim = 3
+    action_dim = 2
+    num_seqs = 4
+    batch_size = 32
+    add_size = 24
+
+    buffers = {}
+    for state_dtype in (None, 'float16', 'bfloat16', 'uint8'):
+        args = Config()
+        args.buffer_state_dtype = state_dtype
+        buffers[state_dtype] = ReplayBuffer(max_size=max_size, state_dim=state_dim, action_dim=action_dim, gpu_id=-1,
+                                            num_seqs=num_seqs, args=args)
+    assert buffers['uint8'].states.dtype == th.uint8
+    assert buffers['uint8'].flags.dtype == th.uint8
+
+    for i in range(5):  # the pointer wraps around the buffer
+        states = th.rand((add_size, num_seqs, state_dim)) * 4 - 2
+        actions = th.rand((add_size, num_seqs, action_dim))
+        rewards = th.rand((add_size, num_seqs))
+        undones = th.rand((add_size, num_seqs)).gt(0.1)
+        unmasks = th.rand((add_size, num_seqs)).gt(0.5)
+        for buffer in buffers.values():
+            buffer.update((states, actions, rewards, undones, unmasks))
+
+        ids0 = th.randint(buffers[None].cur_size - 1, size=(batch_size,))
+        ids1 = th.randint(num_seqs, size=(batch_size,))
+        items0 = buffers[None].get_items(ids0, ids1)
+        for state_dtype, atol in (('float16', 2e-3), ('bfloat16', 2e-2), ('uint8', 4e-2)):
+            state, action, reward, undone, unmask, next_state = buffers[state_dtype].get_items(ids0, ids1)
+            assert state.dtype == next_state.dtype == th.float32
+            assert th.allclose(state, items0[0], atol=atol)
+            assert th.allclose(next_state, items0[5], atol=atol)
+            assert th.equal(action, items0[1])
+            assert th.equal(reward, items0[2])
+            assert th.equal(undone, items0[3])
+            assert th.equal(unmask, items0[4])
+
+    '''the states out of the fitted bounds are clipped, counted and warned about once'''
+    buffer = buffers['uint8']
+    assert buffer.num_clipped_states == 0
+    with pytest.warns(UserWarning, match='clipped'):
+        buffer.update((th.full((add_size, num_seqs, state_dim), 1e3), actions, rewards, undones, unmasks))
+    assert buffer.decode_state(buffer.states[buffer.p - 1]).max() < 4
+    assert buffer.num_clipped_states == add_size * num_seqs * state_dim
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        buffer.update((th.full((add_size, num_seqs, state_dim), -1e3), actions, rewards, undones, unmasks))
+    assert buffer.num_clipped_states == 2 * add_size * num_seqs * state_dim
+
+
+if __name__ == '__main__':
+    print("\n| test_replay_buffer.py")
+    test_vec_sum_tree()
+    test_replay_buffer_per()
+    test_replay_buffer_memmap()
+    test_replay_buffer_compact()